@@ -47,14 +47,16 @@ class CalibrationController(QtGui.QWidget):
 
     def addSymbols(self, symbolNames, cw):
         '''Add a symbol to the calibration widget cw'''
-        for symbolName in symbolNames:
-            try:
-                self._calmeas.addParam(symbolName)
-            except Exception, e:
-                raise e
-            else:
-                cw.addParameter(symbolName)
-                self.refreshAllParameters()
+        # The target values are read in one batch before the widget is updated
+        try:
+            self._calmeas.addParams(symbolNames)
+        finally:
+            paramSet = self._calmeas.getParamSet()
+            for symbolName in symbolNames:
+                if symbolName in paramSet:
+                    cw.addParameter(symbolName)
+
+            self.refreshAllParameters()
 
     def removeSymbols(self, symbolNames):
         map(self._calmeas.removeParam, symbolNames)
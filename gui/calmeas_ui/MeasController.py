@@ -3,15 +3,21 @@ logging.basicConfig(level=logging.DEBUG, datefmt='%H:%M:%S',
                     format='%(asctime)s,%(msecs)-3d %(levelname)-8s [%(threadName)s:%(filename)s:%(lineno)d] %(message)s')
 
 from PyQt4 import QtCore, QtGui
-import csv
 from datetime import datetime
 
+from calmeas import RAW_HISTORY
+from recorder import Recorder, recordingToCsv, RECORDING_DIR
+import os
+
 class Toolbar_UI(QtGui.QToolBar):
 
     START_BTN_TEXT = "Start measurement"
     STOP_BTN_TEXT = "Stop measurement"
     UNINIT_BTN_TEXT = "Initialize first"
     LOG_BTN_TEXT = "Toggle logging"
+    HISTORY_TEXT = "Measurement history, older than {} s is decimated"
+
+    HISTORY_CHOICES = [("10 s", 10), ("1 min", 60), ("10 min", 600), ("1 h", 3600), ("8 h", 8*3600)]
 
     def __init__(self, parent=None):
         super(Toolbar_UI, self).__init__(parent)
@@ -28,6 +34,11 @@ class Toolbar_UI(QtGui.QToolBar):
         self.record.setCheckable(True)
         self.addAction(self.record)
 
+        self.history = QtGui.QComboBox(self)
+        self.history.addItems([text for text, seconds in self.HISTORY_CHOICES])
+        self.history.setToolTip(self.HISTORY_TEXT.format(RAW_HISTORY))
+        self.addWidget(self.history)
+
         self.setIconSize(QtCore.QSize(23,23))
 
 class MeasController(QtGui.QWidget):
@@ -52,11 +63,35 @@ class MeasController(QtGui.QWidget):
 
         self.ui_toolbar.record.toggled.connect(self._onLog)
 
-        self._calmeas.setUpdatedSymbolValueCallback(self._updatedSymbol)
+        self.ui_toolbar.history.currentIndexChanged[int].connect(self._onHistory)
+
+        self._calmeas.setUpdatedRasterCallback(self._updatedRaster)
         self._doLog = False
+        self._recorder = None
 
     def _clearLogBuffer(self):
-        self._logBuffer = dict()
+        # The samples are streamed to a new recording file, the previous one is dropped
+        self._closeRecording()
+        self._discardRecording()
+
+        if self._doLog:
+            fname = "Log_{}.rec".format(datetime.now().strftime("%Y%m%d_%H%M%S"))
+            self._recorder = Recorder(os.path.join(RECORDING_DIR, fname))
+            self._recorder.start()
+
+    def _closeRecording(self):
+        if self._recorder is not None:
+            self._recorder.close()
+
+    def _discardRecording(self):
+        recorder = self._recorder
+        self._recorder = None
+
+        if recorder is not None:
+            try:
+                os.remove(recorder.path)
+            except Exception, e:
+                logging.warning("Could not remove recording {}: {}".format(recorder.path, e))
 
     def startLog(self):
         self._doLog = True
@@ -67,6 +102,7 @@ class MeasController(QtGui.QWidget):
     def stopLog(self):
         self._doLog = False
         self.ui_toolbar.record.setChecked(False)
+        self._closeRecording()
         logging.debug("Stopping log")
 
     def saveLogToFile(self):
@@ -83,23 +119,7 @@ class MeasController(QtGui.QWidget):
             fname = str(logFileDialog.selectedFiles()[0])
 
             try:
-                with open(fname, 'w') as f:
-                    headerWriter = csv.writer(f, quoting=csv.QUOTE_ALL, delimiter=',')
-                    writer = csv.writer(f, quoting=csv.QUOTE_NONE, delimiter=',')
-
-                    columns = list()
-                    header = list()
-                    for name in self._logBuffer.keys():
-                        header.extend(['{}_time'.format(name), '{}'.format(name)])
-                        [time, values] = zip(*self._logBuffer[name])
-                        columns.extend([time, values])
-                    
-                    rows = map(list,map(None,*columns)) # Transpose list of lists
-
-                    headerWriter.writerow(tuple(header))
-
-                    for r in rows:
-                        writer.writerow(tuple(r))
+                recordingToCsv(self._recorder.path, fname)
 
             except Exception, e:
                 msg = QtGui.QMessageBox()
@@ -113,19 +133,23 @@ class MeasController(QtGui.QWidget):
 
             else:
                 logging.info("Saved measurement log to {}".format(fname))
+                self._discardRecording()
+                return
 
-    def _updatedSymbol(self, symbol):
-        if self._doLog:
-            newValue = symbol.getValueRaw()
-            timestamp_s = symbol.getSymbolTime()
+        # Kept, so that it can still be converted
+        logging.info("Measurement log not saved, the recording is kept in {}".format(self._recorder.path))
+        self._recorder = None
 
-            try:
-                self._logBuffer[symbol.name].append((timestamp_s, newValue))
-            except Exception, e:
-                self._logBuffer[symbol.name] = list()
-                self._logBuffer[symbol.name].append((timestamp_s, newValue))
+    def _updatedRaster(self, rasterIndex, sampleRange):
+        recorder = self._recorder
+
+        if self._doLog and recorder is not None:
+            n = sampleRange[1] - sampleRange[0]
+
+            names = self._calmeas.raster[rasterIndex]
+            values = [self._calmeas.workingSymbols[symbolName].getValues(n) for symbolName in names]
 
-            #logging.debug("Logged {} = {} at t = {} ms".format(symbol.name, newValue, timestamp_s * 1000.0))
+            recorder.append(rasterIndex, self._calmeas.rasterTimebases[rasterIndex].latest(n), names, values)
 
     def _onLog(self, checked):
         if checked:
@@ -141,6 +165,7 @@ class MeasController(QtGui.QWidget):
             self.ui_toolbar.startStop.setText(self.ui_toolbar.STOP_BTN_TEXT)
 
             self._calmeas.startMeasurements()
+            self.ui_toolbar.history.setEnabled(False)
             
             for cw in self.widgets:
                 cw.start()
@@ -157,6 +182,7 @@ class MeasController(QtGui.QWidget):
             self.ui_toolbar.startStop.setText(self.ui_toolbar.START_BTN_TEXT)
 
             self._calmeas.stopMeasurements()
+            self.ui_toolbar.history.setEnabled(True)
             
             for cw in self.widgets:
                 cw.stop()
@@ -167,8 +193,14 @@ class MeasController(QtGui.QWidget):
 
             self.ui_toolbar.record.setChecked(False)
 
-            if len(self._logBuffer)>0:
+            if self._recorder is not None and self._recorder.nbrSamples>0:
                 self.saveLogToFile()
+            else:
+                self._discardRecording()
+
+    def _onHistory(self, index):
+        # Takes effect when the measurement is started
+        self._calmeas.historyLength = self.ui_toolbar.HISTORY_CHOICES[index][1]
 
     def _onStop(self):
         self.ui_toolbar.startStop.triggered.disconnect(self._onStop)
@@ -5,8 +5,8 @@ logging.basicConfig(level=logging.DEBUG, datefmt='%H:%M:%S',
 from PyQt4 import QtCore, QtGui
 
 from datetime import datetime
-import copy
 import json
+import os
 
 
 class Synch_UI(QtGui.QWidget):
@@ -22,12 +22,22 @@ class Synch_UI(QtGui.QWidget):
         self.InitBtn.setFixedWidth(105)
         self.InitBtn.setEnabled(False)
 
+        self.ElfBtn = QtGui.QPushButton('Initialize ELF...', self)
+        self.ElfBtn.setFixedWidth(105)
+        self.ElfBtn.setToolTip('Take the symbol table from the firmware ELF file, if it is the one running on the target. Cancel the dialog to stop using one')
+        self.ElfBtn.setEnabled(False)
+
+        self.ElfLabel = QtGui.QLabel('No ELF file', self)
+        self.ElfLabel.setFixedWidth(105)
+
         self.SynchBtn = QtGui.QPushButton('Datasets', self)
         self.SynchBtn.setFixedWidth(105)
         self.SynchBtn.setEnabled(False)
 
         self.vbox.addStretch()
         self.vbox.addWidget(self.InitBtn)
+        self.vbox.addWidget(self.ElfBtn)
+        self.vbox.addWidget(self.ElfLabel)
         self.vbox.addWidget(self.SynchBtn)
 
         self.hbox.addLayout(self.vbox)
@@ -132,14 +142,17 @@ class SynchManager(QtGui.QWidget):
     CHBOX_TARGET_TEXT = "Use target values"
     CHBOX_TARGET_DESC = "Create a new dataset based on the current target values"
     TOOLTIP_NOTFOUND = "Symbol not found on target"
+    PLAN_TEXT = "{} unchanged, {} to download"
+    PLAN_CACHED_TEXT = "{} unchanged, {} to download, as the target values were last read"
+    PLAN_ERROR_TEXT = "Could not compare with the target: {}"
+    READ_TARGET_TEXT = "Read target"
+    READ_TARGET_DESC = "Read the target values of the dataset and compare them with it"
 
     def __init__(self, calmeas, parent=None):
         super(SynchManager, self).__init__(parent)
 
         self._calmeas = calmeas
 
-        self._cachedTargetValues = dict()
-
         self.initGui()
 
         self.setIcon = QtGui.QIcon('icons/dset_icon.png')
@@ -180,8 +193,20 @@ class SynchManager(QtGui.QWidget):
         self.symTree.setContextMenuPolicy(QtCore.Qt.CustomContextMenu)
         self.symTree.customContextMenuRequested.connect(self._openParamMenu)
 
+        self.planLabel = QtGui.QLabel("", self)
+
+        self.readTargetBtn = QtGui.QPushButton(self.READ_TARGET_TEXT, self)
+        self.readTargetBtn.setToolTip(self.READ_TARGET_DESC)
+        self.readTargetBtn.clicked.connect(lambda checked: self.updateSymTree(readTarget=True))
+
+        planLayout = QtGui.QHBoxLayout()
+        planLayout.addWidget(self.planLabel)
+        planLayout.addStretch()
+        planLayout.addWidget(self.readTargetBtn)
+
         rightLayout.addWidget(QtGui.QLabel(self.COMPARISON_TEXT, self))
         rightLayout.addWidget(self.symTree)
+        rightLayout.addLayout(planLayout)
 
         splitter.addWidget(leftWidget)
         splitter.addWidget(rightWidget)
@@ -216,24 +241,28 @@ class SynchManager(QtGui.QWidget):
         self.updateSymTree()
 
 
-    def updateSymTree(self):
+    def updateSymTree(self, readTarget=False):
         try:
-            paramSet = self._calmeas.getParamSet( str(self.dataSetList.currentItem().text()) )
+            setName = str(self.dataSetList.currentItem().text())
+            paramSet = self._calmeas.getParamSet(setName)
         except Exception, e:
             return
 
         self.symTree.clear()
 
+        # Compares the set with the target values, only read from the target when asked
+        try:
+            plan = self._calmeas.planParamSet(setName, readTarget)
+        except Exception, e:
+            plan = None
+            self.planLabel.setText(self.PLAN_ERROR_TEXT.format(e))
+        else:
+            text = self.PLAN_TEXT if readTarget else self.PLAN_CACHED_TEXT
+            self.planLabel.setText(text.format(len(plan.unchanged), len(plan.toWrite)))
+
         for name, val in sorted(paramSet.items(), key=lambda kv: kv[0]):
             # Get corresponding target value
-            try:
-                targetVal = self._cachedTargetValues[name]
-            except Exception, e:
-                try:
-                    self._cachedTargetValues[name] = self._calmeas.getSymbolTargetValue(name)[0]
-                    targetVal = self._cachedTargetValues[name]
-                except Exception, e:
-                    targetVal = None
+            targetVal = self._calmeas.targetValueCache.get(name)
 
             # Create tree item and apply formatting
             item = QtGui.QTreeWidgetItem(self.symTree)
@@ -242,7 +271,7 @@ class SynchManager(QtGui.QWidget):
 
             try:
                 symbol = self._calmeas.workingSymbols[name]
-                item.setText( 1, symbol.getValueStr(self._cachedTargetValues[name]) )
+                item.setText( 1, symbol.getValueStr(self._calmeas.targetValueCache[name]) )
                 toolTip = symbol.desc
             except Exception, e:
                 item.setText( 1, "" )
@@ -251,7 +280,7 @@ class SynchManager(QtGui.QWidget):
             for column in range(self.symTree.columnCount()):
                 item.setToolTip(column, toolTip)
 
-            if targetVal != val:
+            if targetVal is None or (plan is not None and name in plan.toWrite):
                 item.setBackgroundColor(1, QtGui.QColor(255, 0, 0, 100))
 
         for column in range(self.symTree.columnCount()):
@@ -268,9 +297,8 @@ class SynchManager(QtGui.QWidget):
                 selectedSet = newSetDiag.setName
                 self._calmeas.newParamSet(selectedSet)
 
-                for symbolName, isParameter in newSetDiag.selectedSymbols:
-                    if isParameter:
-                        self._calmeas.addParam(symbolName, toSet=selectedSet)
+                self._calmeas.addParams([symbolName for symbolName, isParameter in newSetDiag.selectedSymbols if isParameter],
+                                        toSet=selectedSet)
 
             else:
                 return None
@@ -281,7 +309,17 @@ class SynchManager(QtGui.QWidget):
             except Exception, e:
                 return None
 
-        self._calmeas.useParamSet(selectedSet)
+        failed = self._calmeas.useParamSet(selectedSet)
+
+        if failed:
+            msg = QtGui.QMessageBox()
+            msg.setIcon(QtGui.QMessageBox.Warning)
+            msg.setText("Synchronization failed")
+            text = "Could not write to target:\n\n {0}".format(", ".join(sorted(failed)))
+            msg.setInformativeText(text)
+            msg.setWindowTitle("Warning")
+            msg.setStandardButtons(QtGui.QMessageBox.Ok)
+            retval = msg.exec_()
 
         
     def addDatasets(self):
@@ -415,9 +453,8 @@ class SynchManager(QtGui.QWidget):
         OK = addParamDiag.exec_()
 
         if OK:
-            for symbolName, isParameter in addParamDiag.selectedSymbols:
-                if isParameter:
-                    self._calmeas.addParam(symbolName, toSet=dataSet)
+            self._calmeas.addParams([symbolName for symbolName, isParameter in addParamDiag.selectedSymbols if isParameter],
+                                    toSet=dataSet)
 
             self.addDatasets()
 
@@ -544,13 +581,18 @@ class SynchController(QtGui.QWidget):
         self.ui = Synch_UI(self)
         
         self.ui.InitBtn.clicked.connect(self._onInitButton)
+        self.ui.ElfBtn.clicked.connect(self._onElfButton)
         self.ui.SynchBtn.clicked.connect(self._onSynchButton)
 
+        self._showElfFile()
+
     def enableInit(self):
         self.ui.InitBtn.setEnabled(True)
+        self.ui.ElfBtn.setEnabled(True)
 
     def disableInit(self):
         self.ui.InitBtn.setEnabled(False)
+        self.ui.ElfBtn.setEnabled(False)
 
     def enableSynch(self):
         self.ui.SynchBtn.setEnabled(True)
@@ -567,6 +609,29 @@ class SynchController(QtGui.QWidget):
         if prevSet!=self._calmeas.workingParamSet:
             self.DatasetChanged.emit()
 
+    def _onElfButton(self):
+        elfFile = self._calmeas.symbolElfFile
+        fname = QtGui.QFileDialog.getOpenFileName(self, 'Firmware ELF file (cancel to stop using one)',
+                                                  os.path.dirname(elfFile) if elfFile else '',
+                                                  'ELF (*.elf);;All files (*)')
+
+        # Cancelling clears the file, the symbols are then requested from the target
+        self._calmeas.symbolElfFile = str(fname) if fname else None
+        self._showElfFile()
+
+        if fname:
+            self._onInitButton()
+
+    def _showElfFile(self):
+        elfFile = self._calmeas.symbolElfFile
+
+        if elfFile is None:
+            self.ui.ElfLabel.setText('No ELF file')
+            self.ui.ElfLabel.setToolTip('The symbols are requested from the target')
+        else:
+            self.ui.ElfLabel.setText(os.path.basename(elfFile))
+            self.ui.ElfLabel.setToolTip('Symbols are taken from {}'.format(elfFile))
+
     def _onInitButton(self):
         try:
             oldPeriods = list( self._calmeas.rasterPeriods )
@@ -600,7 +665,7 @@ class SynchController(QtGui.QWidget):
                     # Inherit isParameter
                     targetSymbols[name].isParameter = s.isParameter
 
-            self._calmeas.workingSymbols = copy.deepcopy(targetSymbols)
+            self._calmeas.workingSymbols = dict((name, s.copyMeta()) for name,s in targetSymbols.iteritems())
 
             self._onSynchButton()
 
@@ -1,11 +1,20 @@
 from comcommands import putResponseData, getResponseData
 from comcommands import ComCommands
+from comcommands import planReadRanges
+from comcommands import WRITE_CHUNK_SIZE_MAX
 from comframe import ComFrame
+from elfsymbols import readSymbolTable
+from ringbuffer import RingBuffer
+from decimation import DecimationPyramid
 
 import numpy as np
 import ctypes
+import struct
+import hashlib
 import Queue
 import copy
+import json
+import os
 
 import logging
 logging.basicConfig(level=logging.DEBUG, datefmt='%H:%M:%S', 
@@ -25,6 +34,21 @@ CALMEAS_ID_RASTER_PERIODS = 7
 SET_COPIED_KEY = 'copy from'
 SET_DATA_KEY = 'data'
 
+# Max number of symbols whose name and description are requested before the responses are in
+SYMBOL_REQUEST_WINDOW = 8
+
+# Seconds of raw samples kept of each measured symbol, the rest of the history is decimated
+RAW_HISTORY = 10
+
+# Bytes read at the address of a symbol name or description when reading them from target memory
+SYMBOL_STRING_READ_SIZE = 64
+
+# Names and descriptions of the symbols of the last initialized target, keyed by their meta data
+SYMBOL_CACHE_FILE = os.path.join(os.path.expanduser('~'), '.calmeas', 'symbols.json')
+
+# Name of the leading raster index field in a compiled raster dtype
+RASTER_INDEX_FIELD = '__raster__'
+
 class SymbolDataType():
     def __init__(self, basetype=np.uint8):
         self.enumerations = dict()
@@ -78,6 +102,53 @@ class SymbolDataType():
 
         return (minval, maxval)
 
+class ParamSetPlan():
+    '''What switching to a data set takes: the parameters whose value the
+       target already holds, and the values that have to be written'''
+
+    def __init__(self, setName, unchanged, toWrite):
+        self.setName = setName
+        self.unchanged = unchanged
+        self.toWrite = toWrite
+
+    def __str__(self):
+        return '{}: {} unchanged, {} to write'.format(self.setName, len(self.unchanged), len(self.toWrite))
+
+class Timebase():
+    '''The sample instants of a raster. All symbols in the raster share them,
+       so they are stored and advanced once per raster instead of per symbol'''
+
+    def __init__(self, period_s=0.0, size=0):
+        self.period_s = period_s
+        self.timeBuffer = RingBuffer(size)
+        self._relative = None
+
+    def __len__(self):
+        return len(self.timeBuffer)
+
+    def advance(self, n):
+        '''Append the instants of n new samples'''
+        if len(self.timeBuffer)>0:
+            self.timeBuffer.extend(self.timeBuffer.last() + self.period_s * np.arange(1, n+1))
+
+    def last(self):
+        if len(self.timeBuffer)>0:
+            return self.timeBuffer.last()
+        else:
+            return None
+
+    def latest(self, n):
+        return self.timeBuffer.latest(n)
+
+    def view(self):
+        return self.timeBuffer.view()
+
+    def relative(self):
+        '''The instants relative to the latest sample, oldest first. The same array every time'''
+        if self._relative is None:
+            self._relative = -self.period_s * np.arange(len(self.timeBuffer)-1, -1, -1)
+        return self._relative
+
 class Symbol():
     def __init__(self, name=""):
         self._datatype = None
@@ -116,7 +187,8 @@ class Symbol():
         else:
             self.getValue = self.getValueRaw
 
-        self.initDataBuffer()
+        # Samples are only stored for symbols that are measured, see initForSampling
+        self.releaseDataBuffer()
 
     def getValueStr(self, raw=None):
         if raw is None:
@@ -125,31 +197,80 @@ class Symbol():
             return self._datatype.basetypeToStr(raw)
 
     def getValueRaw(self):
-        if len(self.data)>0:
-            return self.data[-1]
+        if len(self.dataBuffer)>0:
+            return self.dataBuffer.last()
         else:
             return None
 
     def getSymbolTime(self):
-        return self.time[-1]
+        return self.timebase.last()
+
+    @property
+    def data(self):
+        return self.dataBuffer.view()
+
+    @property
+    def time(self):
+        return self.timebase.view()
+
+    # The time stamps are added by the timebase, see CalMeas.appendRasterBlock
 
     def setValue(self, val):
+        self.dataBuffer.append(val)
+
+        if self.decimated is not None:
+            self.decimated.extend([val])
 
-        self.data[:-1] = self.data[1:]
-        self.data[-1] = val
+    def appendValues(self, values):
+        '''Append a block of consecutive samples'''
+        self.dataBuffer.extend(values)
 
-        self.time[:-1] = self.time[1:]
-        self.time[-1] = self.time[-2] + self.period_s
+        if self.decimated is not None:
+            self.decimated.extend(values)
+
+    def getValues(self, n):
+        '''The n latest samples, oldest first'''
+        return self.dataBuffer.latest(n)
+
+    def getTimes(self, n):
+        '''The time stamps of the n latest samples'''
+        return self.timebase.latest(n)
 
     def initDataBuffer(self, size=10000):
-        self.data = np.zeros(size, dtype=self._datatype.np_basetype)
-        self.time = np.zeros(size)
+        self.dataBuffer = RingBuffer(size, dtype=self._datatype.np_basetype)
+
+    def releaseDataBuffer(self):
+        '''Drop the samples, leaving empty buffers'''
+        self.initDataBuffer(size=0)
+        self.timebase = Timebase()
+        self.decimated = None
+
+    def copyMeta(self):
+        '''A copy of the symbol without its samples'''
+        s = Symbol(self.name)
+        s.index = self.index
+        s.address = self.address
+        s.nameAddress = self.nameAddress
+        s.descAddress = self.descAddress
+        s.desc = self.desc
+        s.isParameter = self.isParameter
+        s.setDatatype(copy.deepcopy(self._datatype))
+        s.setPeriod(self.period_s)
+        return s
 
     def setPeriod(self, p):
         self.period_s = p
 
-    def initForSampling(self, timeRange):
-        self.initDataBuffer(size=int(timeRange/self.period_s))
+    def initForSampling(self, timebase, historyLength=0):
+        '''Store the samples of timebase, and a decimated history of
+           historyLength samples if that is more than the timebase holds'''
+        self.timebase = timebase
+        self.initDataBuffer(size=len(timebase))
+
+        if historyLength > len(timebase):
+            self.decimated = DecimationPyramid(historyLength, len(timebase))
+        else:
+            self.decimated = None
 
 class CalMeas():
 
@@ -158,7 +279,7 @@ class CalMeas():
     def __init__(self, comhandler):
         self._comhandler = comhandler
 
-        self._comhandler.addInterfaceCallback(CALMEAS_INTERFACE, self.interfaceCallback)
+        self._comhandler.addInterfaceCallback(CALMEAS_INTERFACE, self.interfaceBatchCallback, batch=True)
 
         self.comcmds = ComCommands(self._comhandler)
 
@@ -186,6 +307,18 @@ class CalMeas():
         self.targetSymbols = dict()
         self.workingSymbols = dict()
 
+        # Last known target value of each symbol, from reads and verified writes
+        self.targetValueCache = dict()
+
+        # None to always get all names and descriptions from the target
+        self.symbolCacheFile = SYMBOL_CACHE_FILE
+
+        # Firmware ELF file to take the symbol table from, if it matches the target
+        self.symbolElfFile = None
+
+        # Seconds of measurement history to keep, beyond RAW_HISTORY only decimated
+        self.historyLength = RAW_HISTORY
+
         
         self.paramSet = dict()
         self.workingParamSet = ''
@@ -193,12 +326,18 @@ class CalMeas():
         self.rasterPeriods = list()
         self.raster = list()
         self.rasterDataStructures = list()
+        self.rasterDtypes = list()
+        self.rasterSampleCount = list()
+        self.rasterTimebases = list()
 
         for r in range(self.NO_RASTERS):
             self.raster.append(list())
             self.rasterDataStructures.append(list())
+            self.rasterDtypes.append(None)
+            self.rasterSampleCount.append(0)
+            self.rasterTimebases.append(Timebase())
 
-        self._updatedSymbolValueCallback = None
+        self._updatedRasterCallback = None
 
 
     def importParamSet(self, name, setData):
@@ -238,10 +377,63 @@ class CalMeas():
         except Exception, e:
             return dict()
 
-    def useParamSet(self, useSet):
+    def planParamSet(self, useSet, readTarget=True):
+        '''Reads the target values of the symbols of a data set, compares them with the set
+           and returns the ParamSetPlan of what useParamSet has to write. Unless readTarget,
+           the set is compared with the target values last read, without any requests'''
+        useSet = str(useSet)
+
+        try:
+            setData = self.paramSet[useSet][SET_DATA_KEY]
+        except KeyError:
+            raise Exception('Not an existing data set "{}"'.format(useSet))
+
+        names = [name for name in setData.keys() if name in self.workingSymbols]
+
+        # Read before writing, not trusting the cache: the target may have been reset or
+        # changed a parameter itself. Values that can not be read, or have never been,
+        # are not in the cache, so they are written
+        if readTarget:
+            self.getSymbolTargetValues(names)
+
+        # Compared per data type as the bytes the target would hold, so that e.g. a float
+        # set value compares equal to its float32 target value
+        byType = dict()
+        for name in names:
+            tc = self.getTypeCode( self.workingSymbols[name].datatype.np_basetype )
+            byType.setdefault(tc, list()).append(name)
+
+        unchanged = list()
+        toWrite = dict()
+
+        for tc, group in byType.iteritems():
+            dtype = np.dtype(self.getBaseType(tc)[0])
+            utype = np.dtype('u{}'.format(dtype.itemsize))
+
+            cached = np.array([name in self.targetValueCache for name in group])
+            targetValues = np.array([self.targetValueCache.get(name, 0) for name in group]).astype(dtype)
+            setValues = np.array([self._parseValue(setData[name]) for name in group]).astype(dtype)
+
+            same = cached & (targetValues.view(utype) == setValues.view(utype))
+
+            for name, isSame in zip(group, same):
+                if isSame:
+                    unchanged.append(name)
+                else:
+                    toWrite[name] = setData[name]
+
+        return ParamSetPlan(useSet, unchanged, toWrite)
+
+    def useParamSet(self, useSet, plan=None):
+        '''Makes useSet the working data set and writes the values the target does not already
+           hold, according to plan or a new planParamSet. Returns the names that could not be written.'''
         useSet = str(useSet)
 
         if useSet in self.paramSet.keys():
+            if plan is None:
+                plan = self.planParamSet(useSet)
+
+            logging.info(str(plan))
 
             try:
                 for symbolName in self.paramSet[self.workingParamSet].keys():
@@ -255,31 +447,46 @@ class CalMeas():
 
             self.workingParamSet = str(useSet)
 
-            for symbolName, data in self.paramSet[useSet][SET_DATA_KEY].iteritems():
-                self.setSymbolTargetValue(symbolName, data)
+            # The changed values are downloaded in one batch
+            setData = self.paramSet[useSet][SET_DATA_KEY]
+            failed = self.setSymbolTargetValues(plan.toWrite, knownValues=dict((name, setData[name]) for name in plan.unchanged))
+
+            for symbolName in self.paramSet[useSet][SET_DATA_KEY].keys():
                 try:
                     self.workingSymbols[symbolName].isParameter = True
                 except Exception, e:
                     pass
 
+            if failed:
+                logging.warning('Could not write {} of data set "{}" to target'.format(', '.join(failed), useSet))
+
+            return failed
+
         else:
             raise Exception('Not an existing data set "{}"'.format(useSet))
 
 
     def addParam(self, symbolName, toSet=''):
+        self.addParams([symbolName], toSet)
+
+    def addParams(self, symbolNames, toSet=''):
+        # The target values of all symbols are read in one pipelined batch
         toSet = str(toSet)
         if toSet=='': 
             toSet = self.workingParamSet
 
-        val = self.getSymbolTargetValue(symbolName)
+        values = self.getSymbolTargetValues(symbolNames)
 
-        try:
-            self.paramSet[toSet][SET_DATA_KEY][symbolName] = val[0]
-        except Exception, e:
-            raise Exception('Not an existing data set "{}", or symbol name "{}"'.format(toSet, symbolName))
-        else:
-            if toSet==self.workingParamSet:
-                self.workingSymbols[symbolName].isParameter = True
+        for symbolName in symbolNames:
+            val = values.get(symbolName)
+
+            try:
+                self.paramSet[toSet][SET_DATA_KEY][symbolName] = val[0]
+            except Exception, e:
+                raise Exception('Not an existing data set "{}", or symbol name "{}"'.format(toSet, symbolName))
+            else:
+                if toSet==self.workingParamSet:
+                    self.workingSymbols[symbolName].isParameter = True
 
     def removeParam(self, symbolName, fromSet=''):
         fromSet = str(fromSet)
@@ -294,17 +501,15 @@ class CalMeas():
             if fromSet==self.workingParamSet:
                 self.workingSymbols[symbolName].isParameter = False
 
+    def clearTargetValueCache(self):
+        '''Forget the known target values, e.g. when the target may have been reset'''
+        self.targetValueCache.clear()
+
     def getSymbolTargetValue(self, symbolName):
         if symbolName in self.workingSymbols.keys():
-            symbolAddress = self.workingSymbols[symbolName].address
-            symbolType = self.workingSymbols[symbolName].datatype
-            tc = self.getTypeCode( symbolType.np_basetype )
-            c_type = self.getBaseType(tc)[0]
+            data = self.getSymbolTargetValues([symbolName])[symbolName]
 
-            self.comcmds.requestRead(symbolAddress, [c_type])
-            (addr, data) = self.comcmds.pollReadData(timeout=1)
-
-            if addr==data==None:
+            if data is None:
                 raise Exception('Could not get target value of "{}"'.format(symbolName))
 
             return data
@@ -312,6 +517,42 @@ class CalMeas():
         else:
             return None
 
+    def getSymbolTargetValues(self, symbolNames, timeout=1):
+        '''Reads the target values of many symbols. Symbols close to each other in memory
+           are read together as one range, and all ranges are requested before waiting
+           for any response. Returns a dict with the data of each known symbol, or None
+           for those that could not be read.'''
+        symbols = [self.workingSymbols[name] for name in set(symbolNames) if name in self.workingSymbols]
+
+        dtypes = list()
+        for symbol in symbols:
+            tc = self.getTypeCode( symbol.datatype.np_basetype )
+            dtypes.append(np.dtype(self.getBaseType(tc)[0]).newbyteorder('<'))
+
+        ranges, placement = planReadRanges([(symbol.address, dtype.itemsize) for symbol, dtype in zip(symbols, dtypes)])
+
+        requests = [self.comcmds.submitRead(address, size, timeout=timeout) for address, size in ranges]
+
+        rangeData = list()
+        for (address, size), request in zip(ranges, requests):
+            try:
+                rangeData.append(request.result())
+            except Exception, e:
+                logging.warning('Could not read target memory 0x{:x}-0x{:x}: {}'.format(address, address+size, e))
+                rangeData.append(None)
+
+        values = dict()
+
+        for symbol, dtype, (r, offset) in zip(symbols, dtypes, placement):
+            if rangeData[r] is not None:
+                values[symbol.name] = np.frombuffer(rangeData[r], dtype=dtype, count=1, offset=offset).tolist()
+                self.targetValueCache[symbol.name] = values[symbol.name][0]
+            else:
+                values[symbol.name] = None
+                self.targetValueCache.pop(symbol.name, None)
+
+        return values
+
     def setSymbolTargetValue(self, symbolName, value):
         if symbolName in self.workingSymbols.keys():
             logging.debug("Writing {} to {} on target...".format(value, symbolName))
@@ -321,28 +562,111 @@ class CalMeas():
             tc = self.getTypeCode( symbolType.np_basetype )
             c_type = self.getBaseType(tc)[0]
 
-            if isinstance(value, str):
-                try:
-                    setValue = int(value)
-                except ValueError:
-                    setValue = float(value)
-            else:
-                setValue = value
+            setValue = self._parseValue(value)
 
             self.comcmds.requestWrite(symbolAddress, c_type(setValue))
 
             # Todo, handle ack
+            self.targetValueCache.pop(symbolName, None)
 
             if self.workingParamSet!='':
                 self.paramSet[self.workingParamSet][SET_DATA_KEY][symbolName] = setValue
 
+    def setSymbolTargetValues(self, symbolValues, timeout=1, knownValues=None):
+        '''Writes the values of many symbols, a dict of symbol name and value, to the target.
+           Symbols next to each other in memory are written with one request. Each request
+           is read back to check that it was written. knownValues are values the target
+           already holds, they are only written again where that joins two requests into one.
+           Returns the names of the symbols that could not be written.'''
+        values = dict(knownValues or dict())
+        values.update(symbolValues)
+
+        names = list()
+        blocks = list()
+        targetValues = list()
+        required = list()
+
+        for symbolName, value in values.iteritems():
+            if symbolName in self.workingSymbols:
+                symbolType = self.workingSymbols[symbolName].datatype
+                tc = self.getTypeCode( symbolType.np_basetype )
+                c_type = self.getBaseType(tc)[0]
+
+                setValue = self._parseValue(value)
+                targetValue = c_type(setValue)
+                names.append(symbolName)
+                blocks.append(buffer(targetValue)[:])
+                targetValues.append(targetValue.value)
+                required.append(symbolName in symbolValues)
+
+        # Only adjacent symbols can share a write, the bytes in between are not known
+        ranges, placement = planReadRanges([(self.workingSymbols[name].address, len(b)) for name, b in zip(names, blocks)],
+                                           sizeMax=WRITE_CHUNK_SIZE_MAX, gapMax=0)
+
+        # Each range is cut down to span from its first to its last symbol that has to be written
+        spans = [None] * len(ranges)
+        for b, isRequired, (r, offset) in zip(blocks, required, placement):
+            if isRequired:
+                first, last = spans[r] or (offset, offset+len(b))
+                spans[r] = (min(first, offset), max(last, offset+len(b)))
+
+        rangeData = [bytearray(span[1]-span[0]) if span else None for span in spans]
+        written = [False] * len(names)
+        for i, (b, (r, offset)) in enumerate(zip(blocks, placement)):
+            if spans[r] and spans[r][0] <= offset < spans[r][1]:
+                rangeData[r][offset-spans[r][0]:offset-spans[r][0]+len(b)] = b
+                written[i] = True
+
+        requests = [None] * len(ranges)
+        for r, ((address, size), span, data) in enumerate(zip(ranges, spans, rangeData)):
+            if span:
+                requests[r] = self.comcmds.submitWrite(address+span[0], (ctypes.c_uint8 * len(data)).from_buffer(data), timeout)
+
+        readBack = list()
+        for request in requests:
+            try:
+                readBack.append(request.result())
+            except Exception, e:
+                readBack.append(None)
+
+        failed = list()
+        for symbolName, b, targetValue, isWritten, (r, offset) in zip(names, blocks, targetValues, written, placement):
+            if not isWritten:
+                continue
+
+            if self.workingParamSet!='':
+                self.paramSet[self.workingParamSet][SET_DATA_KEY][symbolName] = self._parseValue(values[symbolName])
+
+            offset -= spans[r][0]
+            if readBack[r] is None or readBack[r][offset:offset+len(b)] != b:
+                failed.append(symbolName)
+                self.targetValueCache.pop(symbolName, None)
+            else:
+                self.targetValueCache[symbolName] = targetValue
+
+        return failed
+
+    def _parseValue(self, value):
+        if isinstance(value, str):
+            try:
+                return int(value)
+            except ValueError:
+                return float(value)
+        else:
+            return value
+
 
     def startMeasurements(self):
         for r,p in enumerate(self.rasterPeriods):
+            self.rasterTimebases[r] = Timebase(p, int(RAW_HISTORY/p))
             for name,s in self.workingSymbols.iteritems():
                 if s.period_s==p:
                     self.addToRaster(r, name)
-                    s.initForSampling(10)
+                    s.initForSampling(self.rasterTimebases[r], int(self.historyLength/p))
+
+        for r in range(self.NO_RASTERS):
+            self.compileRasterDtype(r)
+            self.rasterSampleCount[r] = 0
 
         self.updateTargetRasters()
         self.isStarted = True
@@ -363,9 +687,25 @@ class CalMeas():
             for r in range(self.NO_RASTERS):
                 self.raster[r] = []
                 self.rasterDataStructures[r] = []
+                self.rasterDtypes[r] = None
         else:
             self.raster[rasterIndex] = []
             self.rasterDataStructures[rasterIndex] = []
+            self.rasterDtypes[rasterIndex] = None
+
+    def compileRasterDtype(self, rasterIndex):
+        '''Compile the layout of a raster frame payload into a numpy dtype,
+           so that a whole frame is decoded by a single np.frombuffer'''
+        names = [RASTER_INDEX_FIELD]
+        formats = [np.dtype(ctypes.c_uint8)]
+
+        for symbolName, c_type in zip(self.raster[rasterIndex], self.rasterDataStructures[rasterIndex]):
+            names.append(str(symbolName))
+            formats.append(np.dtype(c_type).newbyteorder('<'))
+
+        self.rasterDtypes[rasterIndex] = np.dtype({'names': names, 'formats': formats})
+
+        return self.rasterDtypes[rasterIndex]
 
     def disableTargetRasters(self, rasterIndex=None):
         if rasterIndex is None:
@@ -418,23 +758,24 @@ class CalMeas():
         for i in range(numberOfMeas):
             MeasMeta.append( [int(x.value) for x in f.getData(dataTypeStructure)] )
 
-        putResponseData(self._ResponseFifo, MeasMeta)
+        # The raw records identify the firmware symbol table, see requestTargetSymbols
+        putResponseData(self._ResponseFifo, (MeasMeta, f.GetDataBuffer()))
 
 
     def ID_SymbolName_Callback(self, f):
         logging.info('Response on ID CALMEAS_ID_SYMBOL_NAME')
 
-        name = f.DataBytesFormatted(formatting='c', spacing='')
+        name = f.GetDataBuffer()
 
-        putResponseData(self._ResponseFifo, name)
+        putResponseData(self._ResponseFifo, (CALMEAS_ID_SYMBOL_NAME, name))
 
 
     def ID_SymbolDesc_Callback(self, f):
         logging.info('Response on ID CALMEAS_ID_SYMBOL_DESC')
 
-        desc = f.DataBytesFormatted(formatting='c', spacing='')
+        desc = f.GetDataBuffer()
 
-        putResponseData(self._ResponseFifo, desc)
+        putResponseData(self._ResponseFifo, (CALMEAS_ID_SYMBOL_DESC, desc))
 
     def ID_All_Callback(self, f):
         logging.info('Response on ID CALMEAS_ID_ALL')
@@ -446,18 +787,69 @@ class CalMeas():
         #logging.info('Response on ID CALMEAS_ID_RASTER')
         #logging.debug(f.FrameBytesFormatted())
 
-        rasterIndex = f.getData([ctypes.c_uint8])[0].value
-        data = f.getData(self.rasterDataStructures[rasterIndex])
+        self.ingestRasterFrames([f])
+
+    def interfaceBatchCallback(self, frames):
+        rasterFrames = list()
+
+        for f in frames:
+            if f.mid==CALMEAS_ID_RASTER:
+                rasterFrames.append(f)
+            else:
+                self.interfaceCallback(f)
+
+        if rasterFrames:
+            self.ingestRasterFrames(rasterFrames)
+
+    def ingestRasterFrames(self, frames):
+        '''Decode any number of raster frames and append them raster by raster'''
+        payloads = [list() for r in range(self.NO_RASTERS)]
+
+        for f in frames:
+            payload = f.GetDataBuffer()
+
+            if len(payload) < 1:
+                logging.warning('Raster frame without raster index')
+                continue
+
+            rasterIndex = struct.unpack_from('<B', payload)[0]
+
+            try:
+                dtype = self.rasterDtypes[rasterIndex]
+            except IndexError:
+                logging.warning('Raster {} is not valid'.format(rasterIndex))
+                continue
+
+            if dtype is None:
+                continue
+
+            if len(payload) < dtype.itemsize:
+                logging.warning('Raster {} frame is {} bytes, expected {}'.format(rasterIndex, len(payload), dtype.itemsize))
+                continue
 
-        for i, symbolName in enumerate(self.raster[rasterIndex]):
-            val = data[i].value
-            self.workingSymbols[symbolName].setValue(val)
-            if self._updatedSymbolValueCallback is not None:
-                self._updatedSymbolValueCallback(self.workingSymbols[symbolName])
+            payloads[rasterIndex].append(payload[:dtype.itemsize])
 
+        for rasterIndex, rasterPayloads in enumerate(payloads):
+            if rasterPayloads:
+                block = np.frombuffer(''.join(rasterPayloads), dtype=self.rasterDtypes[rasterIndex])
+                self.appendRasterBlock(rasterIndex, block)
 
-    def setUpdatedSymbolValueCallback(self, callback):
-        self._updatedSymbolValueCallback = callback        
+    def appendRasterBlock(self, rasterIndex, block):
+        '''Append decoded raster frames column-wise to the symbols of the raster.
+           The raster updated callback gets the range of the appended samples.'''
+        self.rasterTimebases[rasterIndex].advance(len(block))
+
+        for symbolName in self.raster[rasterIndex]:
+            self.workingSymbols[symbolName].appendValues(block[symbolName])
+
+        start = self.rasterSampleCount[rasterIndex]
+        self.rasterSampleCount[rasterIndex] += len(block)
+
+        if self._updatedRasterCallback is not None:
+            self._updatedRasterCallback(rasterIndex, (start, self.rasterSampleCount[rasterIndex]))
+
+    def setUpdatedRasterCallback(self, callback):
+        self._updatedRasterCallback = callback
 
     def ID_RasterSet_Callback(self, f):
         logging.info('Response on ID CALMEAS_ID_RASTER_SET')
@@ -504,7 +896,13 @@ class CalMeas():
 
         return self.rasterPeriods
 
-    def requestTargetSymbols(self, timeout=1):
+    def requestTargetSymbols(self, timeout=1, fromMemory=False):
+        '''Gets the symbol table of the target. The names and descriptions are taken from the
+           symbolElfFile if its meta data is the same as the target's, or else from the symbol
+           cache for symbols whose meta data is unchanged since they were cached. The rest
+           are requested for a window of symbols at a time, or if fromMemory, read directly from
+           the target memory with a fallback to requests for the strings that could not be read.
+           Memory is only read if fromMemory, since whole blocks are read at each string address.'''
         targetSymbols = dict()
         self._ResponseFifo.queue.clear()
 
@@ -517,44 +915,172 @@ class CalMeas():
         self._comhandler.sendFrame(f)
 
         try:
-            meta = getResponseData(self._ResponseFifo, timeout)
+            meta, metaRaw = getResponseData(self._ResponseFifo, timeout)
         except Queue.Empty:
             raise Exception('Timeout trying to get meta data.')
 
-        for index, symbol in enumerate(meta):
-            logging.info("Getting symbol with index {}".format(index))
+        symbols = list()
 
+        for index, symbol in enumerate(meta):
             s = Symbol()
             s.index = index
-            c_basetype = self.getBaseType(symbol[0])[0]
             s.setDatatype( SymbolDataType(self.getBaseType(symbol[0])[1]) )
             s.nameAddress = symbol[1]
             s.address = symbol[2]
             s.descAddress = symbol[3]
+            symbols.append(s)
 
-            f.mid = CALMEAS_ID_SYMBOL_NAME
-            f.setData([ctypes.c_uint8(index)])
-            self._comhandler.sendFrame(f)
+        metaHash = hashlib.sha1(metaRaw).hexdigest()
+        names, descs = self._loadSymbolElf(metaRaw)
 
-            logging.debug('Waiting for name of {}'.format(index))
-            try:
-                s.name = getResponseData(self._ResponseFifo, timeout)
-            except Queue.Empty:
-                raise Exception('Timeout trying to get symbol names.')
+        if names is None:
+            names, descs = self._loadSymbolCache(metaHash, meta)
 
-            f.mid = CALMEAS_ID_SYMBOL_DESC
-            f.setData([ctypes.c_uint8(index)])
-            self._comhandler.sendFrame(f)
+        missing = [s.index for s in symbols if names[s.index] is None or descs[s.index] is None]
+        if missing and fromMemory:
+            missing = self._readMissingSymbolStrings(symbols, missing, names, descs, timeout)
 
-            logging.debug('Waiting for description of {}'.format(index))
-            try:
-                s.desc = str(getResponseData(self._ResponseFifo, timeout))
-            except Queue.Empty:
-                raise Exception('Timeout trying to get symbol description.')
+        if missing:
+            logging.info("Getting names and descriptions of {} symbols".format(len(missing)))
+            for index, name, desc in zip(missing, *self._requestSymbolStrings(missing, timeout)):
+                names[index] = name
+                descs[index] = desc
 
+        for s, name, desc in zip(symbols, names, descs):
+            s.name = name
+            s.desc = str(desc)
             targetSymbols[s.name] = s
 
+        self._saveSymbolCache(metaHash, meta, names, descs)
 
         self.targetSymbols = targetSymbols
 
+        # The target may have been reprogrammed since the values were cached
+        self.clearTargetValueCache()
+
         return self.targetSymbols
+
+    def _loadSymbolElf(self, metaRaw):
+        # The names and descriptions in the ELF file, if it is the image running on the target
+        if self.symbolElfFile is None:
+            return None, None
+
+        try:
+            elfRaw, elfMeta, names, descs = readSymbolTable(self.symbolElfFile)
+        except Exception, e:
+            logging.warning('Could not read symbols of {}: {}'.format(self.symbolElfFile, e))
+            return None, None
+
+        if elfRaw != metaRaw:
+            logging.warning('The target does not run {}'.format(self.symbolElfFile))
+            return None, None
+
+        return names, descs
+
+    def _loadSymbolCache(self, metaHash, meta):
+        # The cached names and descriptions of each symbol in meta, None where not cached.
+        # A symbol is recognized by its meta record, i.e. data type and addresses
+        names = [None] * len(meta)
+        descs = [None] * len(meta)
+
+        if self.symbolCacheFile is None:
+            return names, descs
+
+        try:
+            with open(self.symbolCacheFile, 'r') as f:
+                cache = json.load(f)
+        except IOError, e:
+            return names, descs
+        except Exception, e:
+            logging.warning('Could not load symbol cache {}: {}'.format(self.symbolCacheFile, e))
+            return names, descs
+
+        if cache.get('hash') == metaHash:
+            logging.info('Symbol table unchanged since it was cached')
+            return [str(entry['name']) for entry in cache['symbols']], [str(entry['desc']) for entry in cache['symbols']]
+
+        cached = dict((tuple(entry['meta']), entry) for entry in cache.get('symbols', list()))
+
+        for index, record in enumerate(meta):
+            entry = cached.get(tuple(record))
+            if entry is not None:
+                names[index] = str(entry['name'])
+                descs[index] = str(entry['desc'])
+
+        return names, descs
+
+    def _saveSymbolCache(self, metaHash, meta, names, descs):
+        if self.symbolCacheFile is None:
+            return
+
+        cache = {'hash': metaHash,
+                 'symbols': [{'meta': record, 'name': name, 'desc': desc} for record, name, desc in zip(meta, names, descs)]}
+
+        try:
+            if not os.path.isdir(os.path.dirname(self.symbolCacheFile)):
+                os.makedirs(os.path.dirname(self.symbolCacheFile))
+
+            with open(self.symbolCacheFile, 'w') as f:
+                json.dump(cache, f, indent=4, sort_keys=True)
+        except Exception, e:
+            logging.warning('Could not save symbol cache {}: {}'.format(self.symbolCacheFile, e))
+
+    def _requestSymbolStrings(self, indices, timeout):
+        # The target answers each kind of request in order, so the k:th name
+        # response is the name of the k:th symbol whose name was requested
+        names = list()
+        descs = list()
+        strings = {CALMEAS_ID_SYMBOL_NAME: names, CALMEAS_ID_SYMBOL_DESC: descs}
+
+        sent = 0
+        while len(names) < len(indices) or len(descs) < len(indices):
+            while sent < len(indices) and sent < min(len(names), len(descs)) + SYMBOL_REQUEST_WINDOW:
+                for mid in (CALMEAS_ID_SYMBOL_NAME, CALMEAS_ID_SYMBOL_DESC):
+                    f = ComFrame()
+                    f.interface = CALMEAS_INTERFACE
+                    f.mid = mid
+                    f.setData([ctypes.c_uint8(indices[sent])])
+                    self._comhandler.sendFrame(f)
+                sent += 1
+
+            try:
+                mid, string = getResponseData(self._ResponseFifo, timeout)
+            except Queue.Empty:
+                raise Exception('Timeout trying to get symbol names.')
+
+            strings[mid].append(string)
+
+        return names, descs
+
+    def _readMissingSymbolStrings(self, symbols, missing, names, descs, timeout):
+        # Names and descriptions are usually stored next to each other, so they are read together.
+        # Returns the indices of the symbols whose strings could still not be read
+        strings = self._readSymbolStrings([symbols[i].nameAddress for i in missing] +
+                                          [symbols[i].descAddress for i in missing], timeout)
+        for index, name, desc in zip(missing, strings[:len(missing)], strings[len(missing):]):
+            names[index] = name
+            descs[index] = desc
+
+        return [i for i in missing if names[i] is None or descs[i] is None]
+
+    def _readSymbolStrings(self, addresses, timeout):
+        # Null terminated strings, usually packed after each other in flash, so that a
+        # few range reads get them all. None for a string that could not be read or
+        # did not end within the bytes read
+        ranges, placement = planReadRanges([(address, SYMBOL_STRING_READ_SIZE) for address in addresses])
+
+        requests = [self.comcmds.submitRead(address, size, timeout=timeout) for address, size in ranges]
+
+        rangeData = list()
+        for request in requests:
+            try:
+                rangeData.append(request.result())
+            except Exception, e:
+                rangeData.append(None)
+
+        strings = list()
+        for r, offset in placement:
+            end = rangeData[r].find('\0', offset) if rangeData[r] is not None else -1
+            strings.append(rangeData[r][offset:end] if end >= 0 else None)
+
+        return strings
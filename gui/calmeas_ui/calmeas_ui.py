@@ -65,6 +65,9 @@ class CalMeas_UI(QtGui.QMainWindow):
         self.SerialController.Disconnected.connect(self.SynchController.disableInit)
         self.SerialController.Disconnected.connect(self.SynchController.disableSynch)
         self.SerialController.Disconnected.connect(self.MeasController.disable)
+        self.SerialController.Connected.connect(calmeas.clearTargetValueCache)
+        self.SerialController.Disconnected.connect(calmeas.clearTargetValueCache)
+        self.MeasController.MeasurementStopped.connect(calmeas.clearTargetValueCache)
 
         self.SynchController.InitializationSuccessful.connect(self.SymbolController.addSymbols)
         self.SynchController.InitializationSuccessful.connect(self.SynchController.enableSynch)
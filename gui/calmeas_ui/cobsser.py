@@ -1,6 +1,10 @@
 from multiprocessing import Process, Event, Queue
+from Queue import Empty
 import serial
 from serial.tools.list_ports import comports
+from shmring import ShmRing
+import select
+import os
 
 import logging
 logging.basicConfig(level=logging.DEBUG, datefmt='%H:%M:%S', 
@@ -13,6 +17,19 @@ STANDARD_BAUDRATES = ['50', '75', '110', '134', '150', '200', '300', '600', '120
 DEFAULT_BAUDRATE = '230400'
 DEFAULT_BAUDRATE_IDX = STANDARD_BAUDRATES.index(DEFAULT_BAUDRATE)
 
+# A blocking read returns as soon as data arrives, the timeout only bounds how long it takes
+# for the rx process to notice a stop request where it cannot be woken (i.e. not on posix)
+RX_READ_TIMEOUT = 0.1
+
+# Decoded frames are handed over to the rx queue in batches. A batch is put
+# as soon as the serial port is drained, or when it gets too large or too old.
+RX_BATCH_SIZE_MAX = 16384
+RX_BATCH_WINDOW = 0.005
+
+# Queued tx frames are encoded and written together, up to this many bytes per write. Kept below
+# the 256 byte rx ring of the stm32f4 example, a frame larger than this is written on its own
+TX_BATCH_SIZE_MAX = 255
+
 import time
 
 def _cobs_decode(in_bytes):
@@ -41,45 +58,82 @@ def _cobs_decode(in_bytes):
                 break
     return out_bytes
             
-def _cobs_encode(in_bytes):
-    # https://bitbucket.org/cmcqueen1975/cobs-python
-    final_zero = True
-    out_bytes = bytearray()
-    idx = 0
-    search_start_idx = 0
-
-    for in_char in in_bytes:
-        if in_char == 0:
-            final_zero = True
-            out_bytes.append(idx - search_start_idx + 1)
-            out_bytes.extend(in_bytes[search_start_idx:idx])
-            search_start_idx = idx + 1
-        else:
-            if idx - search_start_idx == 0xFD:
-                final_zero = False
-                out_bytes.append('\xFF')
-                out_bytes.extend(in_bytes[search_start_idx:idx+1])
-                search_start_idx = idx + 1
-        idx += 1
-    if idx != search_start_idx or final_zero:
-        out_bytes.append(idx - search_start_idx + 1)
-        out_bytes.extend(in_bytes[search_start_idx:idx])
+def _cobs_encode(in_bytes, out_bytes=None):
+    # Works on the zero free blocks between the zeros, so that no python code runs per byte.
+    # The encoded frame is appended to out_bytes if given
+    if out_bytes is None:
+        out_bytes = bytearray()
+    blocks = bytearray(in_bytes).split('\x00')
+
+    for n, block in enumerate(blocks):
+        idx = 0
+        while len(block) - idx >= 0xFE:
+            out_bytes.append(0xFF)
+            out_bytes.extend(block[idx:idx+0xFE])
+            idx += 0xFE
+
+        if idx < len(block) or idx == 0 or n < len(blocks)-1:
+            out_bytes.append(len(block) - idx + 1)
+            out_bytes.extend(block[idx:])
 
     out_bytes.append('\x00')
 
     return out_bytes
 
+class CobsDecoder():
+    '''Splits a received byte stream into COBS frames and decodes them.
+       Bytes of an incomplete frame are kept until the rest arrives.'''
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self._rxdata = bytearray()
+        # No frame delimiter exists before this offset
+        self._scan = 0
+
+    def feed(self, data):
+        self._rxdata.extend(data)
+
+        decoded_frames = list()
+        start = 0
+        end = self._rxdata.find('\x00', self._scan)
+
+        while end >= 0:
+            if end > start:
+                try:
+                    decoded_frames.append(_cobs_decode(self._rxdata[start:end]))
+                except Exception, e:
+                    logging.warning(e)
+
+            start = end+1
+            end = self._rxdata.find('\x00', start)
+
+        del self._rxdata[0:start]
+        self._scan = len(self._rxdata)
+
+        return decoded_frames
+
 class Serial_Handler(Process):
-    def __init__(self, direction, ser, fifo):
+    def __init__(self, direction, ser, fifo, trace=False):
         Process.__init__(self,name='CobsSer{0}Process'.format(direction))
         self.fifo = fifo
         self.ser = ser
+        self.trace = trace
         self.new_frame_cb = None
         self.direction = direction.lower()
         if self.direction not in ['tx','rx']:
             raise Exception('Direction must be tx or rx')
 
         self.exit = Event()
+
+        # Pipe written by stop, to wake the rx process from waiting for the serial port
+        self._wake = None
+
+    def start(self):
+        if self.direction=='rx' and os.name=='posix':
+            self._wake = os.pipe()
+        Process.start(self)
         
     def run(self):
         logging.info('Starting...')
@@ -94,77 +148,113 @@ class Serial_Handler(Process):
                 except Exception, e:
                     continue
                 else:
-                    try:
-                        #k = ['{:#x}']*len(d)
-                        #logging.debug("COBS: {}".format(' '.join(k).format(*d)))
+                    # An empty record only wakes the process, see CobsSer.stop_transmitt
+                    if not d:
+                        continue
 
+                    try:
+                        # What is queued by now goes out in few writes, still
+                        # with each frame in a COBS frame of its own
                         encoded_data = _cobs_encode(d)
 
-                        k = ['{:#x}']*len(encoded_data)
+                        while True:
+                            try:
+                                d = self.fifo.get_nowait()
+                            except Empty:
+                                break
+                            if not d:
+                                continue
+
+                            encoded_frame = _cobs_encode(d)
+                            if len(encoded_data) + len(encoded_frame) > TX_BATCH_SIZE_MAX:
+                                self._write(encoded_data)
+                                encoded_data = encoded_frame
+                            else:
+                                encoded_data.extend(encoded_frame)
 
-                        logging.debug("Writing to serial: {}".format(' '.join(k).format(*encoded_data)))
-                        self.ser.write(encoded_data)
+                        self._write(encoded_data)
                     except Exception, e:
                        logging.warning(str(e))
                        self.ser.close()
                        self.stop()
         else:
-            rxdata = bytearray()
-            while not self.exit.is_set():
+            decoder = CobsDecoder()
+            batch = bytearray()
+            batch_start = 0
 
-                time.sleep(0.001)
+            while not self.exit.is_set():
 
                 try:
+                    # Block until at least one byte arrives, or stop is called, then take the rest
+                    if self._wake is not None:
+                        readable = select.select([self.ser.fileno(), self._wake[0]], [], [], RX_READ_TIMEOUT)[0]
+                        if self.ser.fileno() not in readable:
+                            continue
+
+                    d = self.ser.read(1)
+                    if not d:
+                        continue
+
                     get_nbr = self.ser.inWaiting()
                     if get_nbr > 0:
-                        d = bytearray(self.ser.read(get_nbr))
-                        rxdata.extend(d)                    
+                        d += self.ser.read(get_nbr)
+
+                    for decoded_data in decoder.feed(d):
+                        if not batch:
+                            batch_start = time.time()
+                        batch.extend(decoded_data)
+
+                    if batch and (len(batch) >= RX_BATCH_SIZE_MAX or 
+                                  time.time() - batch_start >= RX_BATCH_WINDOW or 
+                                  self.ser.inWaiting() == 0):
+                        self.fifo.put(batch)
+                        batch = bytearray()
+                        if self.new_frame_cb is not None:
+                            self.new_frame_cb(self.fifo)
                    
                 except Exception, e:
                    logging.warning(e)
                    self.ser.close()
                    self.stop()
 
-                else:
-                    decoded_range = 0
-                    for i, rxbyte in enumerate(rxdata):
-                        #print "{} = {:#x}".format(i,rxbyte)
+        logging.info('Stopping...')
 
-                        if rxbyte == 0:
-                            try:
-                                decoded_data = _cobs_decode(rxdata[decoded_range:i])
-                            except Exception, e:
-                                logging.warning(e)
-                                #logging.debug((decoded_range, i))
-                                #encoded_data = rxdata[decoded_range:i]
-                                #k = ['{:#x}']*len(encoded_data)
-                                #logging.debug('({:#x})'.format(rxdata[decoded_range-1]))
-                                #logging.debug("Dump encoded: {}".format(' '.join(k).format(*encoded_data)))
-                                #logging.debug('({:#x})'.format(rxdata[i]))
-                            else:
-                                self.fifo.put(decoded_data)
-                                if self.new_frame_cb is not None:
-                                    self.new_frame_cb(self.fifo)
+    def _write(self, encoded_data):
+        if self.trace:
+            k = ['{:#x}']*len(encoded_data)
+            logging.debug("Writing to serial: {}".format(' '.join(k).format(*encoded_data)))
 
-                            decoded_range = i+1
-                    
-                    del rxdata[0:decoded_range]
-                    
-
-        logging.info('Stopping...')
+        self.ser.write(encoded_data)
 
     def stop(self):
         self.exit.set()
+        if self._wake is not None:
+            os.write(self._wake[1], '\0')
+
+    def close_wake(self):
+        # When the process has been joined
+        if self._wake is not None:
+            map(os.close, self._wake)
+            self._wake = None
 
 class CobsSer():
-    def __init__(self, port = '', baudrate = DEFAULT_BAUDRATE, tx_fifo_size=0, rx_fifo_size=0):
-        self.Tx_fifo = Queue(tx_fifo_size)
-        self.Rx_fifo = Queue(rx_fifo_size)
+    def __init__(self, port = '', baudrate = DEFAULT_BAUDRATE, tx_fifo_size=0, rx_fifo_size=0, use_shm=False, trace=False):
+        if use_shm:
+            # Shared memory rings instead of pickling through pipes, for sustained high baud rates.
+            # Requires the serial processes to be forked (i.e. not on Windows).
+            self.Tx_fifo = ShmRing()
+            self.Rx_fifo = ShmRing()
+        else:
+            self.Tx_fifo = Queue(tx_fifo_size)
+            self.Rx_fifo = Queue(rx_fifo_size)
 
         self.ser = serial.Serial()
         self.ser.port = port
         self.ser.baudrate = baudrate
-        #self.ser.timeout = 0.001
+        self.ser.timeout = RX_READ_TIMEOUT
+
+        # Log a dump of all written bytes, costly so only for diagnostics
+        self.trace = trace
 
         self.create_processes('rx')
         self.create_processes('tx')
@@ -212,7 +302,7 @@ class CobsSer():
 
     def create_processes(self, direction):
         if direction.lower()=='tx':
-            self.tx_process = Serial_Handler(direction, self.ser, self.Tx_fifo)
+            self.tx_process = Serial_Handler(direction, self.ser, self.Tx_fifo, self.trace)
             self.tx_process.daemon = True
         else:
             self.rx_process = Serial_Handler(direction, self.ser, self.Rx_fifo)
@@ -238,8 +328,11 @@ class CobsSer():
 
     def stop_transmitt(self):
         try:
-            self.tx_process.stop()
-            self.tx_process.join()
+            if self.tx_process.is_alive():
+                self.tx_process.stop()
+                # Wakes the process if it waits for a frame to send
+                self.Tx_fifo.put(bytearray())
+                self.tx_process.join()
             del self.tx_process
 
         except Exception, e:
@@ -248,8 +341,10 @@ class CobsSer():
 
     def stop_receive(self):
         try:
-            self.rx_process.stop()
-            self.rx_process.join()
+            if self.rx_process.is_alive():
+                self.rx_process.stop()
+                self.rx_process.join()
+            self.rx_process.close_wake()
             del self.rx_process
 
         except Exception, e:
@@ -3,9 +3,14 @@ logging.basicConfig(level=logging.DEBUG, datefmt='%H:%M:%S',
                     format='%(asctime)s,%(msecs)-3d %(levelname)-8s [%(threadName)s:%(filename)s:%(lineno)d] %(message)s')
 
 from comframe import ComFrame
+from comframe import FRAME_DATA_SIZE_MAX
 
+from collections import deque
+import numpy as np
+import threading
 import ctypes
 import Queue
+import time
 
 COM_INTERFACE = 0
 
@@ -13,6 +18,29 @@ COM_ID_ERROR = 0
 COM_ID_WRITE_TO = 1
 COM_ID_READ_FROM = 2
 
+# Max number of read requests sent to the target and waiting for their responses
+READ_WINDOW = 16
+
+# Max number of response bytes waiting to be sent back by the target. The stm32f4
+# example queues its responses, and the measurement stream, in an 8 kB tx buffer
+READ_BYTES_IN_FLIGHT_MAX = 4096
+
+# Time a read request may wait for its response, counted from when it is sent
+READ_TIMEOUT = 1.0
+
+# Max number of request bytes on the serial line sent to the target and not yet answered. The
+# stm32f4 example receives into a 256 byte DMA ring, emptied once per main loop of 1 ms or more.
+# When that happens is not known, but a response shows that the requests before it are handled
+REQUEST_BYTES_IN_FLIGHT_MAX = 255
+
+# Max number of data bytes in a write request. The stm32f4 example takes at most 253 bytes per COBS
+# packet, 242 beside the frame and address/length fields, but a write is also followed by a read
+# and both must fit in REQUEST_BYTES_IN_FLIGHT_MAX: 229+13 bytes for the write, 13 for the read
+WRITE_CHUNK_SIZE_MAX = 229
+
+# Reads of nearby memory are merged into one range when at most this many unused bytes lie between them
+READ_RANGE_GAP_MAX = 32
+
 def putResponseData(queue, data):
     queue.put(data)
 
@@ -31,33 +59,211 @@ def getResponseData(queue, timeout):
 
     return queue.get(True, timeout)
 
+def frameWireSize(frame):
+    '''Number of bytes a frame takes on the serial line, at most: the start byte and
+       frame, COBS encoded, and the packet delimiter'''
+    size = 1 + frame.frame_size_raw
+    return size + size//254 + 2
+
+def planReadRanges(blocks, sizeMax=FRAME_DATA_SIZE_MAX, gapMax=READ_RANGE_GAP_MAX):
+    '''Merges memory blocks, given as (address, size), into as few ranges as possible of
+       at most sizeMax bytes each. Returns the ranges as (address, size), and for
+       each block the index of the range holding it and its offset in that range.'''
+    ranges = list()
+    placement = [None] * len(blocks)
+
+    for i in sorted(range(len(blocks)), key=lambda i: blocks[i][0]):
+        address, size = blocks[i]
+
+        if ranges:
+            start, end = ranges[-1]
+            if address-end <= gapMax and max(end, address+size)-start <= sizeMax:
+                ranges[-1][1] = max(end, address+size)
+                placement[i] = (len(ranges)-1, address-start)
+                continue
+
+        ranges.append([address, address+size])
+        placement[i] = (len(ranges)-1, 0)
+
+    return [(start, end-start) for start, end in ranges], placement
+
+class ReadRequest():
+    '''A read request to the target, and later its response'''
+
+    def __init__(self, address, dataTypeStructure, responseCallback=None, timeout=READ_TIMEOUT):
+        self.address = address
+
+        if isinstance(dataTypeStructure, (int, long)):
+            # A number of bytes, read as a str
+            self.dataTypeStructure = None
+            self.dataByteSize = dataTypeStructure
+        else:
+            self.dataTypeStructure = list(dataTypeStructure)
+            self.dataByteSize = sum(map(ctypes.sizeof, self.dataTypeStructure))
+        self.responseCallback = responseCallback
+        self.timeout = timeout
+
+        # Set when the request is sent
+        self.deadline = None
+
+        # A write request sent just before the read, which then reads back what was written
+        self.writeFrame = None
+
+        # Bytes of the request frames on the serial line, set when the request is sent
+        self.requestByteSize = 0
+
+        self.data = None
+        self.error = None
+        self._done = threading.Event()
+
+        # Called when result() times out, so that the owner can give up on overdue requests
+        self._onTimeout = None
+
+    def isExpired(self, now):
+        return self.deadline is not None and now > self.deadline
+
+    def done(self):
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        '''Waits for the response and returns the read values.
+           Raises an exception if the target did not respond in time or responded with an error.'''
+        if timeout is None:
+            timeout = self.timeout
+
+        if not self._done.wait(timeout):
+            if self._onTimeout is not None:
+                self._onTimeout(self)
+            raise Exception('Timeout waiting for read of {} bytes from 0x{:x}'.format(self.dataByteSize, self.address))
+
+        if self.error is not None:
+            raise Exception(self.error)
+
+        return self.data
+
+    def _resolve(self, data=None, error=None):
+        self.data = data
+        self.error = error
+        self._done.set()
+
+        if error is None and self.responseCallback is not None:
+            self.responseCallback((self.address, data))
+
 class ComCommands():
-    def __init__(self, comhandler):
+    def __init__(self, comhandler, readWindow=READ_WINDOW):
         self._comhandler = comhandler
 
         self._comhandler.addInterfaceCallback(COM_INTERFACE, self.interfaceCallback)
 
-        # Strategy assumes response order 1,2... for requests 1,2...
-        # It is the callers responsibility to check if that is valid
-        self._readRequestsFifo = Queue.Queue()
+        # Responses carry no reference to their requests, so they are matched in order:
+        # response 1,2... belongs to request 1,2... At most readWindow requests are sent
+        # ahead of their responses, the rest wait in the backlog.
+        self.readWindow = readWindow
+        self._readsInFlight = deque()
+        self._readsBacklog = deque()
+        self._readLock = threading.RLock()
+
+        # Frames are queued in request order while _readLock is held, and sent after it is
+        # released, so that a full tx queue never blocks the rx callbacks needing the lock
+        self._txFrames = deque()
+        self._txLock = threading.Lock()
+
         self._readResponseFifo = Queue.Queue()
 
-    def requestRead(self, address, dataTypeStructure, responseCallback=None):
-        f = ComFrame()
-        f.interface = COM_INTERFACE
-        f.mid = COM_ID_READ_FROM
+    def submitRead(self, address, dataTypeStructure, responseCallback=None, timeout=READ_TIMEOUT):
+        '''Queues a read of the target memory at address, without waiting for it.
+           dataTypeStructure is a list of ctypes types, or a number of bytes to read raw.
+           Returns a ReadRequest to get the values from when they are in.'''
+        return self._submit(ReadRequest(address, dataTypeStructure, responseCallback, timeout))
 
-        dataByteSize = 0
-        for t in dataTypeStructure:
-            dataByteSize += ctypes.sizeof(t)
+    def _submit(self, request):
+        return self._submitAll([request])[0]
 
-        f.setData([ctypes.c_uint32(address), ctypes.c_uint16(dataByteSize)])
+    def _submitAll(self, requests):
+        for request in requests:
+            request._onTimeout = self._readTimedOut
 
-        self._readRequestsFifo.put([address, dataTypeStructure, responseCallback])
+        with self._readLock:
+            self._readsBacklog.extend(requests)
+            self._sendReads()
 
-        self._comhandler.sendFrame(f)
+        self._flushFrames()
 
-    def requestWrite(self, address, data):
+        return requests
+
+    def submitReads(self, reads, timeout=READ_TIMEOUT):
+        '''Queues many reads, given as (address, dataTypeStructure), at once'''
+        return self._submitAll([ReadRequest(address, dataTypeStructure, timeout=timeout) for address, dataTypeStructure in reads])
+
+    def _readTimedOut(self, request):
+        # Nobody waits for the request anymore. Overdue requests are given up on, so that
+        # they do not keep the read window full when no other traffic would expire them
+        with self._readLock:
+            try:
+                self._readsBacklog.remove(request)
+            except ValueError:
+                pass
+            else:
+                request._resolve(error='Read from 0x{:x} timed out before it was sent'.format(request.address))
+
+            self._sendReads()
+
+        self._flushFrames()
+
+    def _flushFrames(self):
+        # Sends the queued frames in order. Must not be called with _readLock held
+        with self._txLock:
+            while self._txFrames:
+                self._comhandler.sendFrame(self._txFrames.popleft())
+
+    def _expireReads(self, now, dataByteSize=None):
+        # A request is given up on when its response is overdue, unless
+        # the response at hand could be the late one
+        while self._readsInFlight and self._readsInFlight[0].isExpired(now) and \
+              self._readsInFlight[0].dataByteSize != dataByteSize:
+            request = self._readsInFlight.popleft()
+            logging.warning('Read of {} bytes from 0x{:x} timed out'.format(request.dataByteSize, request.address))
+            request._resolve(error='Read from 0x{:x} timed out'.format(request.address))
+
+    def _sendReads(self):
+        now = time.time()
+        self._expireReads(now)
+
+        while self._readsBacklog and len(self._readsInFlight) < self.readWindow:
+            request = self._readsBacklog[0]
+
+            f = ComFrame()
+            f.interface = COM_INTERFACE
+            f.mid = COM_ID_READ_FROM
+            f.setData([ctypes.c_uint32(request.address), ctypes.c_uint16(request.dataByteSize)])
+
+            frames = [f] if request.writeFrame is None else [request.writeFrame, f]
+            requestByteSize = sum(map(frameWireSize, frames))
+
+            # Both the target's tx buffer for the responses and its rx buffer for the
+            # requests must hold what is in flight. One request is always let through
+            if self._readsInFlight:
+                if sum(r.dataByteSize for r in self._readsInFlight)+request.dataByteSize > READ_BYTES_IN_FLIGHT_MAX or \
+                   sum(r.requestByteSize for r in self._readsInFlight)+requestByteSize > REQUEST_BYTES_IN_FLIGHT_MAX:
+                    break
+
+            self._readsBacklog.popleft()
+            request.deadline = now + request.timeout
+            request.requestByteSize = requestByteSize
+            self._readsInFlight.append(request)
+
+            self._txFrames.extend(frames)
+
+    def requestRead(self, address, dataTypeStructure, responseCallback=None):
+        # The response is also put to the fifo read by pollReadData
+        def putResponse(response):
+            self._readResponseFifo.put(response)
+            if responseCallback is not None:
+                responseCallback(response)
+
+        return self.submitRead(address, dataTypeStructure, putResponse)
+
+    def _writeFrame(self, address, data):
         f = ComFrame()
         f.interface = COM_INTERFACE
         f.mid = COM_ID_WRITE_TO
@@ -66,7 +272,102 @@ class ComCommands():
 
         f.setData([ctypes.c_uint32(address), ctypes.c_uint16(dataByteSize), data])
 
-        self._comhandler.sendFrame(f)
+        return f
+
+    def requestWrite(self, address, data):
+        # Sent as a write and read back, like submitWrite but without waiting for it, since
+        # the response is what shows that the target has taken the request from its rx buffer
+        self._submit(self._writeRequest(address, data, READ_TIMEOUT))
+
+    def submitWrite(self, address, data, timeout=READ_TIMEOUT):
+        '''Queues a write of data, a ctypes value or array, followed by a read back of the
+           written bytes. The target does not acknowledge writes, so the returned ReadRequest
+           serves as one: compare its result with the bytes of data. The write is sent
+           only when the read fits in the read window.'''
+        return self._submit(self._writeRequest(address, data, timeout))
+
+    def _writeRequest(self, address, data, timeout, readBackSize=None):
+        # Reads back readBackSize bytes, by default all that was written
+        if readBackSize is None:
+            readBackSize = ctypes.sizeof(data)
+
+        request = ReadRequest(address, readBackSize, timeout=timeout)
+        request.writeFrame = self._writeFrame(address, data)
+        return request
+
+    def readMemory(self, address, length, out=None, chunkSize=FRAME_DATA_SIZE_MAX, timeout=READ_TIMEOUT):
+        '''Reads length bytes of target memory from address, in pipelined requests of
+           at most chunkSize bytes. The bytes are put in out, a preallocated bytearray or
+           contiguous numpy array, or a new bytearray which is returned.
+           Raises an exception if any part could not be read.'''
+        if out is None:
+            out = bytearray(length)
+
+        if isinstance(out, np.ndarray):
+            # reshape would silently return a copy to read into
+            if not out.flags.c_contiguous:
+                raise Exception('Buffer to read into must be contiguous')
+            buf = out.reshape(-1).view(np.uint8)
+        else:
+            buf = np.frombuffer(out, dtype=np.uint8)
+
+        if len(buf) < length:
+            raise Exception('Buffer of {} bytes can not hold {} bytes'.format(len(buf), length))
+
+        t = time.time()
+
+        requests = self.submitReads([(address+offset, min(chunkSize, length-offset))
+                                     for offset in range(0, length, chunkSize)], timeout)
+
+        for offset, request in zip(range(0, length, chunkSize), requests):
+            data = request.result()
+            buf[offset:offset+len(data)] = np.frombuffer(data, dtype=np.uint8)
+
+        self._logThroughput('Read', address, length, time.time()-t)
+
+        return out
+
+    def writeMemory(self, address, data, verify=True, chunkSize=WRITE_CHUNK_SIZE_MAX, timeout=READ_TIMEOUT):
+        '''Writes data, a str, bytearray or numpy array, to the target memory at address, in
+           pipelined requests of at most chunkSize bytes. The target does not acknowledge writes,
+           so each part is followed by a read, which keeps the unanswered requests within the
+           read window and the target's rx buffer. Unless verify is False all of the part is
+           read back and compared, else the parts are only queued and not waited for.
+           Raises an exception if any part could not be verified.'''
+        if isinstance(data, np.ndarray):
+            data = data.tobytes()
+        data = bytearray(data)
+        length = len(data)
+
+        t = time.time()
+
+        offsets = range(0, length, chunkSize)
+        chunks = [(ctypes.c_uint8 * min(chunkSize, length-offset)).from_buffer(data, offset) for offset in offsets]
+
+        writes = [self._writeRequest(address+offset, chunk, timeout, None if verify else 1)
+                  for offset, chunk in zip(offsets, chunks)]
+        self._submitAll(writes)
+
+        requests = zip(offsets, writes) if verify else list()
+
+        failed = list()
+        for offset, request in requests:
+            try:
+                readBack = request.result()
+            except Exception, e:
+                readBack = None
+
+            if readBack is None or readBack != data[offset:offset+chunkSize]:
+                failed.append(address+offset)
+
+        if failed:
+            raise Exception('Could not verify write to 0x{}'.format(', 0x'.join('{:x}'.format(a) for a in failed)))
+
+        self._logThroughput('Wrote', address, length, time.time()-t)
+
+    def _logThroughput(self, action, address, length, t):
+        logging.info('{} {} bytes at 0x{:x} in {:.1f} ms, {:.1f} kB/s'.format(
+                     action, length, address, 1000*t, length/max(t, 1e-6)/1000))
 
     def pollReadData(self, block=True, timeout=None):
         try:
@@ -79,29 +380,50 @@ class ComCommands():
     def ID_Error_Callback(self, f):
         logging.info('Response on ID COM_ID_ERROR')
 
+        # The target reports the interface and id of the request that failed
+        try:
+            interface, mid = [x.value for x in f.getData([ctypes.c_uint8, ctypes.c_uint8])]
+        except Exception, e:
+            return
+
+        if interface==COM_INTERFACE and mid==COM_ID_READ_FROM:
+            with self._readLock:
+                self._expireReads(time.time())
+                if self._readsInFlight:
+                    request = self._readsInFlight.popleft()
+                    request._resolve(error='Target could not read from 0x{:x}'.format(request.address))
+                self._sendReads()
+
+            self._flushFrames()
+
     def ID_WriteTo_Callback(self, f):
         logging.info('Response on ID COM_ID_WRITE_TO')
 
     def ID_ReadFrom_Callback(self, f):
-        logging.info('Response on ID COM_ID_READ_FROM')
+        with self._readLock:
+            self._expireReads(time.time(), f.data_size)
 
-        try:
-            request = self._readRequestsFifo.get_nowait()
-        except Queue.Empty:
-            pass
-        else:
-            address = request[0]
-            data = f.getData(request[1])
+            if not self._readsInFlight:
+                logging.warning('Read response without a request')
+                return
+
+            request = self._readsInFlight[0]
+            if f.data_size != request.dataByteSize:
+                logging.warning('Read response of {} bytes, expected {}'.format(f.data_size, request.dataByteSize))
+                return
+
+            self._readsInFlight.popleft()
+            self._sendReads()
 
-            dataValues = list()
-            for d in data:
-                dataValues.append(d.value)
+        self._flushFrames()
+
+        if request.dataTypeStructure is None:
+            data = f.GetDataBuffer()
+        else:
+            data = [d.value for d in f.getData(request.dataTypeStructure)]
 
-            self._readResponseFifo.put((address, dataValues))
+        request._resolve(data)
 
-            if request[2] is not None:
-                request[2]((address, dataValues))
-        
     def setComHandler(self, comhandler):
         self._comhandler = comhandler
 
@@ -1,7 +1,11 @@
 import ctypes
+import struct
 import time
+import sys
 from array import array
 
+import numpy as np
+
 import logging
 logging.basicConfig(level=logging.DEBUG, datefmt='%H:%M:%S', 
                     format='%(asctime)s,%(msecs)-3d %(levelname)-8s [%(threadName)s:%(filename)s:%(lineno)d] %(message)s')
@@ -12,6 +16,10 @@ FRAME_HEADER_SIZE = 3
 FRAME_DATA_SIZE_MAX = 512
 FRAME_SIZE_RAW_MAX = FRAME_DATA_SIZE_MAX+FRAME_HEADER_SIZE
 
+# Max data size of the frames received from the target, COM_DATA_SIZE_MAX_TX of the stm32f4
+# example. Its meta data response holds 13 bytes for each of up to 256 symbols in one frame
+FRAME_RX_DATA_SIZE_MAX = 4096
+
 
 class Frame_Data(ctypes.Structure):
     _pack_ = 1
@@ -90,13 +98,141 @@ CRC8_TABLE = [
 CRC_LEN_TX = 1
 CRC_LEN_RX = 0
 
+# CRC8_TABLE applied to two bytes at once. Indexed by the 16 bit word of the two
+# bytes (first byte in the low bits) xor the crc:
+# CRC8_TABLE2[w ^ crc] == CRC8_TABLE[CRC8_TABLE[crc ^ (w & 0xFF)] ^ (w >> 8)]
+CRC8_TABLE2 = bytearray(CRC8_TABLE[CRC8_TABLE[x] ^ b] for b in range(256) for x in range(256))
+
+_CRC8_TABLE2_NP = np.array(CRC8_TABLE2, dtype=np.uint8)
+
+# crc8_check_blocks computes blocks with lengths within the same multiple of
+# CRC8_BATCH_ALIGN together, but one by one if there are less than CRC8_BATCH_MIN
+CRC8_BATCH_ALIGN = 16
+CRC8_BATCH_MIN = 16
+
 def crc8_block(data, crc_init = CRC8_INIT):
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    elif isinstance(data, (bytearray, buffer)):
+        data = str(data)
+    elif not isinstance(data, str):
+        data = str(bytearray(d&0xFF for d in data))
+
+    words = array('H')
+    words.fromstring(data[:len(data) & ~1])
+    if sys.byteorder == 'big':
+        words.byteswap()
+
     crc = crc_init
-    for d in data:
-        crc = CRC8_TABLE[crc ^ (d&0xFF)]
+    for w in words:
+        crc = CRC8_TABLE2[w ^ crc]
+
+    if len(data) & 1:
+        crc = CRC8_TABLE[crc ^ ord(data[-1])]
 
     return crc
 
+def crc8_check_blocks(buf, starts, ends):
+    '''Checks the crc of many blocks buf[start:end] of a bytearray in one call,
+       the last byte of each block being the crc8 of the rest (with CRC8_INIT).
+
+       Blocks of about the same length are computed together, with one numpy
+       step per two bytes for all of them. Returns a numpy array of bools.'''
+    starts = np.asarray(starts, dtype=np.intp)
+    lengths = np.asarray(ends, dtype=np.intp) - starts - 1
+    data = np.frombuffer(buf, dtype=np.uint8)
+    valid = np.zeros(len(starts), dtype=bool)
+
+    # Blocks without even a crc byte are not valid
+    buckets = np.where(lengths >= 0, (lengths + CRC8_BATCH_ALIGN - 1) // CRC8_BATCH_ALIGN, -1)
+
+    for bucket in np.unique(buckets[buckets >= 0]):
+        group = np.flatnonzero(buckets == bucket)
+
+        if len(group) < CRC8_BATCH_MIN:
+            for i in group:
+                n = lengths[i]
+                valid[i] = crc8_block(buf[starts[i]:starts[i]+n]) == buf[starts[i]+n]
+            continue
+
+        # Zeros in front do not change a crc starting from 0, so shorter blocks
+        # are right aligned in rows of whole words
+        n = lengths[group]
+        width = int(bucket) * CRC8_BATCH_ALIGN
+        columns = np.arange(width)
+        padding = (width - n)[:, np.newaxis]
+
+        blocks = data.take(starts[group, np.newaxis] - padding + columns, mode='clip')
+        blocks[columns < padding] = 0
+        words = np.ascontiguousarray(blocks.view('<u2').T)
+
+        crc = np.zeros(len(group), dtype=np.uint8)
+        for w in words:
+            crc = _CRC8_TABLE2_NP.take(w ^ crc)
+
+        valid[group] = crc == data[starts[group] + n]
+
+    return valid
+
+_STRUCT_CODES = { ctypes.c_uint8:  'B',
+                  ctypes.c_int8:   'b',
+                  ctypes.c_uint16: 'H',
+                  ctypes.c_int16:  'h',
+                  ctypes.c_uint32: 'I',
+                  ctypes.c_int32:  'i',
+                  ctypes.c_float:  'f',
+                  int:             'I',
+                  float:           'f' }
+
+_CTYPES = { int:   ctypes.c_uint32,
+            float: ctypes.c_float }
+
+_structCache = dict()
+
+_FRAME_HEADER = struct.Struct('<HB')
+_FRAME_START_CHR = chr(FRAME_START)
+
+def _GetStruct(dataTypeStructure, endian, header=''):
+    # Compiled once per field types, endian and header (struct codes preceding the fields)
+    key = (tuple(dataTypeStructure), endian, header)
+    try:
+        return _structCache[key]
+    except KeyError:
+        # The payload is little endian, 'big' means no swap (see ComFrame.getData)
+        fmt = '<' if endian=='big' else '>'
+        s = struct.Struct(fmt + header + ''.join(map(_StructCode, dataTypeStructure)))
+        _structCache[key] = s
+        return s
+
+def _StructCode(t):
+    # A ctypes array, e.g. (c_uint8 * n), is packed as a byte string
+    if issubclass(t, ctypes.Array):
+        return '{}s'.format(ctypes.sizeof(t))
+    return _STRUCT_CODES[t]
+
+def _FieldValues(data):
+    return [d.value if isinstance(d, ctypes._SimpleCData) else
+            ctypes.string_at(ctypes.addressof(d), ctypes.sizeof(d)) if isinstance(d, ctypes.Array) else d for d in data]
+
+def EncodeFrame(out, status, data, endian='big', crc_len = CRC_LEN_TX, offset=0):
+    '''Packs a complete frame, start byte included, into the bytearray out at offset.
+       data is a list of ctypes values, int or float, as for ComFrame.setData.
+       out is extended if it is too short. Returns the offset after the frame.'''
+    s = _GetStruct(map(type, data), endian, header='BHB')
+    data_size = s.size - 1 - FRAME_HEADER_SIZE
+    end = offset + s.size + crc_len
+
+    if len(out) < end:
+        out.extend(bytearray(end - len(out)))
+
+    s.pack_into(out, offset, FRAME_START, data_size, status, *_FieldValues(data))
+
+    if crc_len == 1:
+        out[end-1] = crc8_block(out[offset+FRAME_HEADER_SIZE:end-1])
+
+    return end
+
+
 class ComFrame(Frame_raw):
     
     def __init__(self, frameBytes=None):
@@ -179,59 +315,23 @@ class ComFrame(Frame_raw):
             #     print "frame_size_raw = {:#x} ({})".format(int(self.frame_size_raw), int(self.frame_size_raw))
 
     def setData(self, data, calculate_length=True, endian='big', crc_len = CRC_LEN_TX):
-        data.reverse()
-
-        if endian=='big':
-            swap16 = lambda x: x
-            swap32 = lambda x: x
-            swapFloat = lambda x: x
-        else:
-            swap16 = _ByteSwap16
-            swap32 = _ByteSwap32
-            swapFloat = _ByteSwapFloat
-
-        fd = Frame_Data_Fields()
-
-        for i,d in enumerate(data):
-            if type(d)==int:
-                data[i] = ctypes.c_uint32(d)
-            elif type(d)==float:
-                data[i] = ctypes.c_float(d)
-
-        totaldatabytelength = 0
-
-        for b in data:
-
-            entrysize = ctypes.sizeof(type(b))
-
-            fd.raw[entrysize:] = fd.raw[:-entrysize]
-
-            totaldatabytelength += entrysize
-
-            if type(b)==ctypes.c_uint8:
-                fd.var_uint8[0] = b
-            elif type(b)==ctypes.c_int8:
-                fd.var_int8[0] = b
-            elif type(b)==ctypes.c_uint16:
-                fd.var_uint16[0] = ctypes.c_uint16(swap16(b.value))
-            elif type(b)==ctypes.c_int16:
-                fd.var_int16[0] = ctypes.c_int16(swap16(b.value))
-            elif type(b)==ctypes.c_uint32:
-                fd.var_uint32[0] = ctypes.c_uint32(swap32(b.value))
-            elif type(b)==ctypes.c_int32:
-                fd.var_int32[0] = ctypes.c_int32(swap32(b.value))
-            elif type(b)==ctypes.c_float:
-                fd.var_float[0] = ctypes.c_float(swapFloat(b.value))
+        # Header and data are packed in one go by a struct compiled for the field types
+        s = _GetStruct(map(type, data), endian, header='HB')
+        totaldatabytelength = s.size - FRAME_HEADER_SIZE
 
         if calculate_length:
-            self.data_size = ctypes.c_uint16(swap16(totaldatabytelength))
+            data_size = totaldatabytelength
             self.frame_size_raw = FRAME_HEADER_SIZE + totaldatabytelength + crc_len
+        else:
+            data_size = self.data_size if endian=='big' else _ByteSwap16(self.data_size)
+            # The old data beyond the new one reads as zeros
+            ctypes.memset(ctypes.addressof(self.data), 0, FRAME_DATA_SIZE_MAX)
 
-        if crc_len == 1:
-            crc = crc8_block([self.status])
-            fd.raw[totaldatabytelength] = ctypes.c_uint8(crc8_block(fd.raw[:totaldatabytelength], crc))
+        s.pack_into(self, 0, data_size, self.status, *_FieldValues(data))
 
-        self.data = fd
+        if crc_len == 1:
+            statusAndData = ctypes.string_at(ctypes.addressof(self._status), 1+totaldatabytelength)
+            self.data.raw[totaldatabytelength] = crc8_block(bytearray(statusAndData))
 
     def getData(self, dataTypeStructure, endian='big'):
         data = list()
@@ -280,18 +380,15 @@ class ComFrame(Frame_raw):
         if with_start:
             bytes.append(FRAME_START)
 
-        for i in range(self.frame_size_raw):
-            bytes.append(self.raw[i])
+        bytes.extend(ctypes.string_at(ctypes.addressof(self), self.frame_size_raw))
 
         return bytes
 
     def GetDataBytesRaw(self):
-        bytes = bytearray()
+        return bytearray(ctypes.string_at(ctypes.addressof(self.data), self.data_size))
 
-        for i in range(self.data_size):
-            bytes.append(self.data.raw[i])
-
-        return bytes
+    def GetDataBuffer(self):
+        return ctypes.string_at(ctypes.addressof(self.data), self.data_size)
 
     def FrameBytesFormatted(self, formatting='x', spacing=' '):
         bytes = self.GetFrameBytesRaw()
@@ -307,3 +404,80 @@ class ComFrame(Frame_raw):
 
     def Validity(self):
         return self._isValid
+
+
+class FrameView(object):
+    '''A read-only view of a received frame, start byte included.
+
+       Unlike ComFrame nothing is copied: the payload is a memoryview into the
+       buffer the frame was parsed from. Has the parts of the ComFrame interface
+       that are used on received frames.'''
+
+    __slots__ = ('timestamp', 'interface', 'mid', 'status', 'data_size', 'payload',
+                 '_frame', '_readOffset', '_crc_len', '_crcChecked')
+
+    def __init__(self, frameBytes, crc_len = CRC_LEN_RX, timestamp = None, crc_checked = False):
+        self._frame = memoryview(frameBytes)
+        self._crc_len = crc_len
+        self._crcChecked = crc_checked
+        self._readOffset = 0
+        self.timestamp = time.time() if timestamp is None else timestamp
+
+        if len(self._frame) > FRAME_HEADER_SIZE:
+            self.data_size, self.status = _FRAME_HEADER.unpack_from(self._frame, 1)
+        else:
+            self.data_size = 0
+            self.status = 0
+
+        self.interface = self.status & 0x0F
+        self.mid = self.status >> 4
+        self.payload = self._frame[1+FRAME_HEADER_SIZE:1+FRAME_HEADER_SIZE+self.data_size]
+
+    @property
+    def frame_size_raw(self):
+        return len(self._frame) - 1
+
+    def Validity(self):
+        frame_size_raw = len(self._frame) - 1
+
+        isValid = (FRAME_HEADER_SIZE <= frame_size_raw <= FRAME_HEADER_SIZE+FRAME_RX_DATA_SIZE_MAX+self._crc_len) and \
+                  (self._frame[0] == _FRAME_START_CHR) and \
+                  (self.data_size == frame_size_raw-FRAME_HEADER_SIZE-self._crc_len)
+
+        if isValid and self._crc_len == 1 and not self._crcChecked:
+            crc = crc8_block(bytearray(self._frame[FRAME_HEADER_SIZE:-1]))
+            isValid = ord(self._frame[-1]) == crc
+
+        return isValid
+
+    def getData(self, dataTypeStructure, endian='big'):
+        # Like ComFrame.getData, each call continues where the previous one ended
+        s = _GetStruct(dataTypeStructure, endian)
+        values = s.unpack_from(self.payload, self._readOffset)
+        self._readOffset += s.size
+
+        return [_CTYPES.get(t, t)(v) for t, v in zip(dataTypeStructure, values)]
+
+    def GetFrameBytesRaw(self, with_start=False):
+        if with_start:
+            return bytearray(self._frame)
+        else:
+            return bytearray(self._frame[1:])
+
+    def GetDataBytesRaw(self):
+        return bytearray(self.payload)
+
+    def GetDataBuffer(self):
+        return self.payload.tobytes()
+
+    def FrameBytesFormatted(self, formatting='x', spacing=' '):
+        bytes = self.GetFrameBytesRaw()
+        frame_str = ['{:#'+formatting+'}'] * len(bytes)
+
+        return spacing.join(frame_str).format(*bytes)
+
+    def DataBytesFormatted(self, formatting='x', spacing=' '):
+        bytes = self.GetDataBytesRaw()
+        frame_str = ['{:#'+formatting+'}'] * len(bytes)
+
+        return spacing.join(frame_str).format(*bytes)
@@ -1,110 +1,262 @@
 from comframe import FRAME_START
+from comframe import FRAME_HEADER_SIZE
+from comframe import FRAME_RX_DATA_SIZE_MAX
 from comframe import CRC_LEN_RX
-from comframe import ComFrame
+from comframe import FrameView
+from comframe import crc8_block
+from comframe import crc8_check_blocks
+from comframe import CRC8_BATCH_MIN
 
 from threading import Thread
 import Queue
+import time
+import numpy as np
 
 import logging
 logging.basicConfig(level=logging.DEBUG, datefmt='%H:%M:%S', 
                     format='%(asctime)s,%(msecs)-3d %(levelname)-8s [%(threadName)s:%(filename)s:%(lineno)d] %(message)s')
 
+# The rx queue wakes the handler thread when data arrives, the timeout
+# only bounds how long it takes for the thread to notice a stop request
+RX_QUEUE_TIMEOUT = 0.1
+
+# Max number of additional queued rx batches to parse together with the first one
+RX_QUEUE_DRAIN_MAX = 64
+
+_FRAME_START_CHR = chr(FRAME_START)
+
 class ComHandler():
 
-    def __init__(self):
+    def __init__(self, framed=False):
+        self.framed = framed
         self.ResetParser()
+        self.ResetRxCounters()
 
         self._interfaces = dict()
+        self._batchInterfaces = dict()
         self._queue_rx = None
         self._queue_tx = None
         self._frameQueue_tx = Queue.Queue(1000)
         self.crc_len = CRC_LEN_RX
 
-    def _WaitForStart(self, b):
-        if b==FRAME_START:
-            self.new_frame = bytearray()
-            self.new_frame.append(b)
-            return self._GetSize_1
+    def setFramedInput(self, framed):
+        # Framed input means that every rx chunk holds whole frames only, e.g. when the
+        # target puts exactly one frame in each COBS packet. The frames are then walked
+        # header by header instead of searching for start bytes and carrying partial
+        # frames between chunks. The stm32f4 example splits its byte stream into COBS
+        # packets regardless of frame boundaries, so it needs the default stream parsing.
+        self.framed = framed
+        self.ResetParser()
+
+    def _DropBytes(self, n):
+        # Noise is counted rather than logged per byte, a warning is
+        # logged once the stream is back in sync
+        if self._synced:
+            self._synced = False
+            self.resyncEvents += 1
+            self._resyncDroppedBytes = 0
+
+        self.droppedBytes += n
+        self._resyncDroppedBytes += n
+
+    def _Synced(self):
+        self._synced = True
+        logging.warning('Resynchronized rx stream after dropping {} bytes'.format(self._resyncDroppedBytes))
+
+    def _ScanFrames(self, buf, pos):
+        # Start offsets of the frames following back to back from pos, as far as they are complete.
+        # Run for every rx chunk, so the globals and methods are looked up once
+        starts = list()
+        append = starts.append
+        n = len(buf)
+        frame_overhead = 1 + FRAME_HEADER_SIZE + self.crc_len
+        last = n - frame_overhead
+        start, size_max = FRAME_START, FRAME_RX_DATA_SIZE_MAX
+
+        while pos <= last and buf[pos] == start:
+            data_size = buf[pos+1] | buf[pos+2] << 8
+            end = pos + frame_overhead + data_size
+            if data_size > size_max or end > n:
+                break
+
+            append(pos)
+            pos = end
+
+        return starts, pos
+
+    def _CheckCrc(self, buf, starts, end):
+        # Crc over status and data, of all frames in one go
+        ends = starts[1:] + [end]
+        return crc8_check_blocks(buf, np.add(starts, FRAME_HEADER_SIZE), ends), ends
+
+    def _ParseChecked(self, buf, view, frames):
+        # With crc the usual case, frames following each other without noise
+        # in between, is checked in one batch instead of frame by frame
+        starts, end = self._ScanFrames(buf, 0)
+        if len(starts) < CRC8_BATCH_MIN:
+            return 0
+
+        valid, ends = self._CheckCrc(buf, starts, end)
+        nbrValid = len(valid) if valid.all() else int(valid.argmin())
+        if nbrValid == 0:
+            return 0
+
+        if not self._synced:
+            self._Synced()
+
+        frames.extend(view[starts[i]:ends[i]] for i in range(nbrValid))
+
+        return ends[nbrValid-1]
+
+    def _ParseChained(self, buf, view, frames):
+        # Without crc the usual case, frames following each other without noise in
+        # between, is trusted as a whole: every frame is followed by the next one
+        starts, end = self._ScanFrames(buf, 0)
+        if end < len(buf) and buf[end] != FRAME_START:
+            # The last frame is left to be checked, followed by what it is
+            end = starts.pop() if starts else 0
+        if not starts:
+            return 0
+
+        if not self._synced:
+            self._Synced()
+
+        ends = starts[1:] + [end]
+        frames.extend(map(view.__getitem__, map(slice, starts, ends)))
+
+        return end
+
+    def _ParseStream(self, bytes):
+        if self._pending:
+            buf = self._pending + bytes
         else:
-            logging.warning('{} is not start'.format(b))
-            return self._WaitForStart
-
-    def _GetSize_1(self, b):
-        self.new_frame.append(b)
-        return self._GetSize_2
-
-    def _GetSize_2(self, b):
-        self.new_frame.append(b)
-        b_h = int(self.new_frame[-1]) << 8
-        b_l = int(self.new_frame[-2])
-        self.expected_data_len = b_h | b_l
-
-        return self._GetHeader
-
-    def _GetHeader(self, b):
-        self.new_frame.append(b)
-        if self.expected_data_len==0:
-            if self.crc_len > 0:
-                return self._GetCrc
-            else:
-                self.full_frames.append(self.new_frame)
-                return self._WaitForStart
+            buf = bytearray(bytes)
+
+        # The frames are views into buf, so it must not be resized from here on
+        view = memoryview(buf)
+        frames = list()
+        n = len(buf)
+        frame_overhead = 1 + FRAME_HEADER_SIZE + self.crc_len
+        check_crc = self.crc_len == 1
+
+        if check_crc:
+            pos = self._ParseChecked(buf, view, frames)
         else:
-            self.data_cntr = 0
-            return self._GetData
-            
-    def _GetData(self, b):
-        self.new_frame.append(b)
-        self.data_cntr += 1
-        if self.data_cntr==self.expected_data_len:
-            if self.crc_len > 0:
-                return self._GetCrc
+            pos = self._ParseChained(buf, view, frames)
+
+        # Searches frame by frame from where the fast path above stopped
+        while pos < n:
+            start = buf.find(_FRAME_START_CHR, pos)
+            if start < 0:
+                start = n
+
+            if start > pos:
+                self._DropBytes(start-pos)
+                pos = start
+
+            if pos+frame_overhead > n:
+                break
+
+            data_size = buf[pos+1] | buf[pos+2] << 8
+            end = pos + frame_overhead + data_size
+
+            if data_size > FRAME_RX_DATA_SIZE_MAX:
+                # Not a start byte, look for the next one
+                self._DropBytes(1)
+                pos += 1
+                continue
+
+            if end > n:
+                break
+
+            # A frame is trusted if its crc is correct, or without crc if it is
+            # followed by the start of the next frame (or the end of the data so far)
+            if check_crc:
+                plausible = crc8_block(buf[pos+FRAME_HEADER_SIZE:end-1]) == buf[end-1]
             else:
-                self.full_frames.append(self.new_frame)
-                return self._WaitForStart
-        else:
-            return self._GetData
-
-    def _GetCrc(self, b):
-        self.new_frame.append(b)
-        self.crc_len -= 1
-        if self.crc_len==0:
-            self.crc_len = CRC_LEN_RX
-            self.full_frames.append(self.new_frame)
-            return self._WaitForStart
+                plausible = end == n or buf[end] == FRAME_START
+
+            if not plausible:
+                self._DropBytes(1)
+                pos += 1
+                continue
+
+            if not self._synced:
+                self._Synced()
+
+            frames.append(view[pos:end])
+            pos = end
+
+        self._pending = buf[pos:]
+
+        return frames
+
+    def _ParseFramed(self, bytes):
+        buf = bytearray(bytes)
+        view = memoryview(buf)
+        frames = list()
+
+        starts, pos = self._ScanFrames(buf, 0)
+        ends = starts[1:] + [pos]
+
+        if self.crc_len == 1 and starts:
+            valid, ends = self._CheckCrc(buf, starts, pos)
+            for i in np.flatnonzero(~valid):
+                self._DropBytes(ends[i] - starts[i])
         else:
-            return self._GetCrc
+            valid = [True] * len(starts)
 
-    def ParseBytes(self, bytes):
-        # Search for start byte etc
-        # bytes are either partial or full or a combination of frames
-        self.full_frames = list()
+        for start, end, isValid in zip(starts, ends, valid):
+            if isValid:
+                if not self._synced:
+                    self._Synced()
+                frames.append(view[start:end])
+
+        if pos < len(buf):
+            # The rest of the chunk can not be trusted
+            self._DropBytes(len(buf)-pos)
 
-        for b in bytes:
-            self.state_machine = self.state_machine(b)
+        return frames
 
-        return self.full_frames
+    def ParseBytes(self, bytes):
+        # bytes are either partial or full or a combination of frames.
+        # Returns memoryviews of the complete frames, each including the start byte
+        if self.framed:
+            return self._ParseFramed(bytes)
+        else:
+            return self._ParseStream(bytes)
 
     def ResetParser(self):
-        self.full_frames = list()
-        self.state_machine = self._WaitForStart
-        self.new_frame = bytearray()
-        self.crc_len = CRC_LEN_RX
+        self._pending = bytearray()
+        self._synced = True
+        self._resyncDroppedBytes = 0
+
+    def ResetRxCounters(self):
+        self.droppedBytes = 0
+        self.resyncEvents = 0
+
+    def addInterfaceCallback(self, interface, callback=None, batch=False):
+        # A batch callback gets a list of all frames on the interface parsed in one go
+        if batch:
+            interfaces = self._batchInterfaces
+        else:
+            interfaces = self._interfaces
 
-    def addInterfaceCallback(self, interface, callback=None):
-        if int(interface) not in self._interfaces.keys():
-            self._interfaces[int(interface)] = list()
+        if int(interface) not in interfaces.keys():
+            interfaces[int(interface)] = list()
         
-        self._interfaces[int(interface)].append(callback)
+        interfaces[int(interface)].append(callback)
 
     def removeInterfaceCallback(self, interface, callback):
-        try:
-            self._interfaces[int(interface)].remove(callback)
-        except Exception, e:
-            pass
+        for interfaces in (self._interfaces, self._batchInterfaces):
+            try:
+                interfaces[int(interface)].remove(callback)
+            except Exception, e:
+                pass
 
     def disableInterface(self, interface):
-        del self._interfaces[int(interface)]
+        self._interfaces.pop(int(interface), None)
+        self._batchInterfaces.pop(int(interface), None)
 
     def setByteQueue_Rx(self, queue):
         self._queue_rx = queue
@@ -121,12 +273,23 @@ class ComHandler():
         except Queue.Empty:
             pass
         else:
+            # Take whatever else is queued so that it is all parsed in one pass
+            bytes = bytearray(bytes)
+            for i in range(RX_QUEUE_DRAIN_MAX):
+                try:
+                    bytes.extend(self._queue_rx.get_nowait())
+                except Queue.Empty:
+                    break
 
             #logging.debug("Parsing recieved bytes")
             full_frames = self.ParseBytes(bytes)
+            timestamp = time.time()
+
+            batches = dict()
 
             for framebytes in full_frames:
-                frame = ComFrame(framebytes)
+                # The parser has already checked the crc
+                frame = FrameView(framebytes, self.crc_len, timestamp, crc_checked=True)
                 interface = int(frame.interface)
 
                 #print "{}".format(frame.FrameBytesFormatted())
@@ -138,12 +301,20 @@ class ComHandler():
                             if callback_handle is not None:
                                 callback_handle(frame)
 
-                    else:
+                    if interface in self._batchInterfaces.keys():
+                        batches.setdefault(interface, list()).append(frame)
+
+                    if interface not in self._interfaces.keys() and interface not in self._batchInterfaces.keys():
                         logging.warning('Interface 0x{0:x} is not an enabled interface'.format(interface))
 
                 else:
                     logging.warning('Skipped invalid frame on interface 0x{0:x}'.format(interface))
 
+            for interface, frames in batches.iteritems():
+                for callback_handle in self._batchInterfaces[interface]:
+                    if callback_handle is not None:
+                        callback_handle(frames)
+
     def putFrame(self, frame):
         if self._frameQueue_tx is not None:
             #logging.debug("Putting to tx frame queue")
@@ -168,9 +339,9 @@ class ComHandler():
             self.handler_Tx()
 
 class ComHandlerThread(Thread, ComHandler):
-    def __init__(self):
+    def __init__(self, framed=False):
         Thread.__init__(self, name=type(self).__name__)
-        ComHandler.__init__(self)
+        ComHandler.__init__(self, framed)
 
         self.setDaemon(True)
 
@@ -185,7 +356,7 @@ class ComHandlerThread(Thread, ComHandler):
         
         while not self._quit:
             try:
-                self.handler_Rx(block=True, timeout=0.001)
+                self.handler_Rx(block=True, timeout=RX_QUEUE_TIMEOUT)
             except Exception, e:
                 logging.warning(str(e))
 
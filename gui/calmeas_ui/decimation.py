@@ -0,0 +1,211 @@
+import numpy as np
+
+from ringbuffer import RingBuffer
+
+# Number of samples, or buckets of a level, aggregated into one bucket of the next coarser level.
+# A power of two, see _pairwise
+DECIMATION_FACTOR = 8
+
+# Samples collected before the levels are updated. Updating costs about the same for a
+# few samples as for many, and the rx thread appends blocks of a few samples at a time.
+# The samples not yet in a level are still part of its envelope
+DECIMATION_BATCH = DECIMATION_FACTOR*512
+
+# Min number of buckets of each level, about the width in pixels of a plot. The
+# coarsest level covers all of the history in at most this many buckets
+DECIMATION_LEVEL_SIZE_MIN = 2000
+
+# Columns of the buckets of a level
+MIN, MAX, MEAN = range(3)
+
+_BUCKET = np.dtype((np.float64, 3))
+
+
+def _pairwise(ufunc, values):
+    '''ufunc of each DECIMATION_FACTOR consecutive values, applied to every other value
+       until one is left of each. Much faster than ufunc.reduce over the short rows'''
+    width = DECIMATION_FACTOR
+    while width > 1:
+        values = ufunc(values[0::2], values[1::2])
+        width //= 2
+    return values
+
+def _decimate(mins, maxs, means):
+    '''Aggregate each DECIMATION_FACTOR consecutive values into one bucket. The ufuncs
+       are used directly, ndarray.min and friends cost more than the reduction itself
+       for the few values of a block'''
+    n = len(means) // DECIMATION_FACTOR
+    shape = (n, DECIMATION_FACTOR)
+    end = n*DECIMATION_FACTOR
+
+    coarse = np.empty((n, 3))
+    coarse[:, MIN] = _pairwise(np.minimum, mins[:end])
+    coarse[:, MAX] = _pairwise(np.maximum, maxs[:end])
+    coarse[:, MEAN] = np.add.reduce(means[:end].reshape(shape), axis=1)
+    coarse[:, MEAN] /= DECIMATION_FACTOR
+
+    return coarse
+
+class DecimationLevel():
+    '''The min, max and mean of consecutive buckets of factor samples'''
+
+    def __init__(self, factor, size):
+        self.factor = factor
+        self.buckets = RingBuffer(size, dtype=_BUCKET)
+
+        # The latest buckets that do not yet make a whole bucket of the next level
+        self._pending = np.empty((0, 3))
+
+    def __len__(self):
+        return len(self.buckets)
+
+    def extend(self, buckets):
+        '''Append new buckets. Returns the buckets of the next level they complete, if any'''
+        self.buckets.extend(buckets)
+
+        pending = np.concatenate((self._pending, buckets))
+        if len(pending) < DECIMATION_FACTOR:
+            self._pending = pending
+            return None
+
+        coarse = _decimate(pending[:, MIN], pending[:, MAX], pending[:, MEAN])
+        self._pending = pending[len(coarse)*DECIMATION_FACTOR:]
+
+        return coarse
+
+    def latest(self, n):
+        '''The n latest buckets as columns MIN, MAX and MEAN, oldest first'''
+        return self.buckets.latest(n)
+
+class DecimationPyramid():
+    '''Levels of min/max/mean aggregates of a sample stream, each DECIMATION_FACTOR
+       times coarser than the one below. Every level holds the same number of buckets,
+       so the coarser levels reach further back. The levels are kept up to date block
+       by block, and a plot of any part of the history needs about as many points as
+       it has pixels.'''
+
+    def __init__(self, length, size=DECIMATION_LEVEL_SIZE_MIN):
+        # length is the number of samples of history to keep
+        self.levels = list()
+        self.count = 0
+
+        size = max(size, DECIMATION_LEVEL_SIZE_MIN)
+        factor = DECIMATION_FACTOR
+
+        while True:
+            self.levels.append(DecimationLevel(factor, size))
+            if size*factor >= length and DECIMATION_LEVEL_SIZE_MIN*factor >= length:
+                break
+            factor *= DECIMATION_FACTOR
+
+        # The latest samples that do not yet make a whole bucket
+        self._pending = np.empty(0)
+
+        # Samples not yet passed on to the levels, and how many have been
+        self._batch = np.empty(DECIMATION_BATCH)
+        self._batchFill = 0
+        self._decimated = 0
+
+    def extend(self, values):
+        n = len(values)
+        self.count += n
+
+        fill = self._batchFill
+        if fill + n < DECIMATION_BATCH:
+            # The usual case, kept short
+            self._batch[fill:fill+n] = values
+            self._batchFill = fill + n
+            return
+
+        pos = 0
+        if self._batchFill == 0 and len(values) >= DECIMATION_BATCH:
+            # Large blocks are passed on as they are
+            pos = len(values) - len(values) % DECIMATION_BATCH
+            self._update(np.asarray(values[:pos], dtype=np.float64))
+
+        while pos < len(values):
+            n = min(len(values)-pos, DECIMATION_BATCH-self._batchFill)
+            self._batch[self._batchFill:self._batchFill+n] = values[pos:pos+n]
+            self._batchFill += n
+            pos += n
+
+            if self._batchFill == DECIMATION_BATCH:
+                self._update(self._batch)
+                self._batchFill = 0
+
+    def _update(self, values):
+        self._decimated += len(values)
+
+        pending = np.concatenate((self._pending, values))
+        if len(pending) < DECIMATION_FACTOR:
+            self._pending = pending
+            return
+
+        buckets = _decimate(pending, pending, pending)
+        self._pending = pending[len(buckets)*DECIMATION_FACTOR:]
+
+        for level in self.levels:
+            buckets = level.extend(buckets)
+            if buckets is None:
+                break
+
+    def levelFor(self, nbrSamples, nbrPoints):
+        '''The finest level that covers the latest nbrSamples samples in at most nbrPoints
+           buckets, else the coarsest level'''
+        for level in self.levels:
+            if len(level)*level.factor >= nbrSamples and nbrSamples <= nbrPoints*level.factor:
+                return level
+
+        return self.levels[-1]
+
+    def _pendingEnvelope(self, level):
+        '''The min and max of the samples after the latest bucket of level, in buckets of
+           level.factor samples of which the latest may be partial, and the number of samples'''
+        # Oldest first: the buckets of the finer levels that do not yet make a bucket of
+        # the next level, the samples that do not yet make a bucket, and the batch
+        finer = self.levels[:self.levels.index(level)][::-1]
+        raw = np.concatenate((self._pending, self._batch[:self._batchFill]))
+
+        mins = np.concatenate([l._pending[:, MIN] for l in finer] + [raw])
+        maxs = np.concatenate([l._pending[:, MAX] for l in finer] + [raw])
+        sizes = np.concatenate([np.repeat(l.factor, len(l._pending)) for l in finer] + [np.ones(len(raw), dtype=np.int64)])
+
+        # The finer buckets never cross a bucket of level
+        starts = np.cumsum(sizes) - sizes
+        count = int(sizes.sum())
+        if count == 0:
+            return np.empty(0), np.empty(0), 0
+
+        first = np.arange(0, count, level.factor)
+        groups = np.searchsorted(starts, first)
+
+        return np.minimum.reduceat(mins, groups), np.maximum.reduceat(maxs, groups), count
+
+    def envelope(self, level, nbrSamples, nbrPoints=None):
+        '''The min and max of the buckets of level covering the latest nbrSamples samples,
+           oldest first, and where they are in number of samples before the latest sample.
+           Neighbouring buckets are merged as needed for at most nbrPoints of them'''
+        pendingMins, pendingMaxs, pending = self._pendingEnvelope(level)
+
+        n = max(int(np.ceil(float(nbrSamples - pending)/level.factor)) + 1, 0)
+        n = min(n, len(level))
+        buckets = level.latest(n)
+
+        # Each of the latest buckets is placed at the middle of its samples
+        ends = np.minimum(np.arange(len(pendingMins))*level.factor + level.factor, pending)
+        pendingOffsets = pending - (np.arange(len(pendingMins))*level.factor + ends + 1)/2.0
+
+        offsets = np.concatenate((pending + level.factor * np.arange(n-1, -1, -1) + (level.factor-1)/2.0, pendingOffsets))
+        mins = np.concatenate((buckets[:, MIN], pendingMins))
+        maxs = np.concatenate((buckets[:, MAX], pendingMaxs))
+
+        if nbrPoints is not None and len(offsets) > nbrPoints:
+            # Merged from the latest bucket, the oldest may take fewer
+            step = int(np.ceil(float(len(offsets))/nbrPoints))
+            first = np.arange(len(offsets)-step, -step, -step)[::-1].clip(0)
+            last = np.append(first[1:], len(offsets)) - 1
+            offsets = (offsets[first] + offsets[last])/2.0
+            mins = np.minimum.reduceat(mins, first)
+            maxs = np.maximum.reduceat(maxs, first)
+
+        return offsets, mins, maxs
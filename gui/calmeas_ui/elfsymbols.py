@@ -0,0 +1,103 @@
+import struct
+
+# The calmeas_meta_t records of the target, see calmeas.h, are put between these linker symbols
+META_START_SYMBOL = '_smeas_meta'
+META_END_SYMBOL = '_emeas_meta'
+
+# Packed calmeas_meta_t: type code, name pointer, symbol address and description pointer
+META_RECORD = struct.Struct('<BIII')
+
+_ELF_MAGIC = '\x7fELF'
+_ELFCLASS32 = 1
+_ELFDATA2LSB = 1
+
+_SHT_SYMTAB = 2
+_SHT_NOBITS = 8
+_SHF_ALLOC = 0x2
+
+_ELF_HEADER = struct.Struct('<16sHHIIIIIHHHHHH')
+_SECTION_HEADER = struct.Struct('<IIIIIIIIII')
+_SYMBOL = struct.Struct('<IIIBBH')
+
+class ElfFile():
+    '''The parts of a 32 bit little endian ELF file, like the stm32f4 example firmware,
+       needed to read the memory image and look up symbols'''
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._data = f.read()
+
+        ident = self._data[:16]
+        if ident[:4] != _ELF_MAGIC or ord(ident[4]) != _ELFCLASS32 or ord(ident[5]) != _ELFDATA2LSB:
+            raise Exception('"{}" is not a 32 bit little endian ELF file'.format(path))
+
+        header = _ELF_HEADER.unpack_from(self._data)
+        shoff, shentsize, shnum = header[6], header[11], header[12]
+
+        self._sections = [_SECTION_HEADER.unpack_from(self._data, shoff + i*shentsize) for i in range(shnum)]
+
+        self._symbols = dict()
+        for section in self._sections:
+            if section[1] == _SHT_SYMTAB:
+                self._readSymbols(section)
+
+    def _readSymbols(self, symtab):
+        strtab = self._sections[symtab[6]]
+        offset, size, entsize = symtab[4], symtab[5], symtab[9]
+
+        for pos in range(offset, offset+size, entsize):
+            nameOffset, value = _SYMBOL.unpack_from(self._data, pos)[:2]
+            start = strtab[4] + nameOffset
+            name = self._data[start:self._data.index('\0', start)]
+            if name:
+                self._symbols[name] = value
+
+    def symbolAddress(self, name):
+        try:
+            return self._symbols[name]
+        except KeyError:
+            raise Exception('Symbol "{}" not found in ELF file'.format(name))
+
+    def read(self, address, size):
+        '''The size bytes at address as they are when the image is loaded'''
+        for section in self._sections:
+            flags, addr, offset, secSize = section[2], section[3], section[4], section[5]
+
+            if flags & _SHF_ALLOC and section[1] != _SHT_NOBITS and addr <= address and address+size <= addr+secSize:
+                start = offset + address - addr
+                return self._data[start:start+size]
+
+        raise Exception('No data at 0x{:x} in ELF file'.format(address))
+
+    def readString(self, address):
+        '''The null terminated string at address'''
+        for section in self._sections:
+            flags, addr, offset, secSize = section[2], section[3], section[4], section[5]
+
+            if flags & _SHF_ALLOC and section[1] != _SHT_NOBITS and addr <= address < addr+secSize:
+                start = offset + address - addr
+                end = self._data.find('\0', start, offset+secSize)
+                if end >= 0:
+                    return self._data[start:end]
+
+        raise Exception('No string at 0x{:x} in ELF file'.format(address))
+
+def readSymbolTable(path):
+    '''Reads the calmeas symbol table of a firmware ELF file. Returns the raw meta records,
+       as the target sends them on CALMEAS_ID_META, the records as [typecode, nameAddress,
+       address, descAddress] and the names and descriptions of the symbols.'''
+    elf = ElfFile(path)
+
+    start = elf.symbolAddress(META_START_SYMBOL)
+    end = elf.symbolAddress(META_END_SYMBOL)
+
+    # Like the target, whatever follows the last whole record is ignored
+    size = end - start
+    raw = elf.read(start, size - size % META_RECORD.size)
+
+    meta = [list(META_RECORD.unpack_from(raw, pos)) for pos in range(0, len(raw), META_RECORD.size)]
+
+    names = [elf.readString(record[1]) for record in meta]
+    descs = [elf.readString(record[3]) for record in meta]
+
+    return raw, meta, names, descs
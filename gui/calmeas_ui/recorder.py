@@ -0,0 +1,263 @@
+from threading import Thread, Lock
+import numpy as np
+import Queue
+import struct
+import json
+import mmap
+import csv
+import os
+
+import logging
+logging.basicConfig(level=logging.DEBUG, datefmt='%H:%M:%S',
+                    format='%(asctime)s,%(msecs)-3d %(levelname)-8s [%(threadName)s:%(filename)s:%(lineno)d] %(message)s')
+
+RECORDING_DIR = os.path.join(os.path.expanduser('~'), '.calmeas', 'recordings')
+
+# Size of the chunks the samples of a raster are collected in before they are written
+RECORDER_CHUNK_BYTES = 1 << 18
+
+# Number of chunks of each raster. When all of them wait to be written, the samples
+# are dropped rather than waiting for the writer, so memory use does not grow with
+# the length of a recording and the rx thread never waits for the disk
+RECORDER_CHUNKS_PER_RASTER = 4
+
+# Rows converted at a time when saving a recording as CSV
+RECORDER_CSV_ROWS = 10000
+
+# Name of the leading time field of the samples of a raster
+RECORDING_TIME_FIELD = '__time__'
+
+RECORDING_MAGIC = 'CALMEASREC1\n'
+
+# Each record of a recording file is a header followed by its data, either the
+# JSON layout of the samples of a raster, or a chunk of samples of a raster
+_RECORD = struct.Struct('<cBI')
+_RECORD_LAYOUT = 'L'
+_RECORD_CHUNK = 'C'
+
+
+class Recorder(Thread):
+    '''Streams the samples of each raster to an append-only file while measuring.
+
+       The samples are copied into preallocated chunks, one row per sample with
+       the time and a column per symbol. Full chunks are written by the recorder
+       thread. Each raster has a fixed number of chunks, so memory use is bounded
+       regardless of how long the recording is, and what has been recorded is on
+       disk if the application is stopped. Samples that do not fit while the writer
+       is behind, or after a write has failed, are counted in droppedSamples.'''
+
+    def __init__(self, path):
+        Thread.__init__(self, name=type(self).__name__)
+        self.setDaemon(True)
+
+        self.path = path
+        self.nbrSamples = 0
+        self.droppedSamples = 0
+        self.failed = False
+
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+
+        self._file = open(path, 'wb')
+        self._file.write(RECORDING_MAGIC)
+
+        self._writeQueue = Queue.Queue()
+        self._lock = Lock()
+        self._closed = False
+
+        # Per raster: the chunks not in use, the one being filled and how far it is filled
+        self._free = dict()
+        self._chunk = dict()
+        self._fill = dict()
+
+    def _addRaster(self, rasterIndex, names, dtypes):
+        dtype = np.dtype({'names': [RECORDING_TIME_FIELD] + [str(name) for name in names],
+                          'formats': [np.dtype(np.float64)] + [np.dtype(t).newbyteorder('<') for t in dtypes]})
+
+        self._writeQueue.put((_RECORD_LAYOUT, rasterIndex, json.dumps(dtype.descr)))
+
+        size = max(1, RECORDER_CHUNK_BYTES // dtype.itemsize)
+        self._free[rasterIndex] = Queue.Queue()
+        for i in range(RECORDER_CHUNKS_PER_RASTER-1):
+            self._free[rasterIndex].put(np.empty(size, dtype=dtype))
+
+        self._chunk[rasterIndex] = np.empty(size, dtype=dtype)
+        self._fill[rasterIndex] = 0
+
+    def append(self, rasterIndex, times, names, columns):
+        '''Record a block of samples of a raster, the time stamps and a column
+           of samples of each symbol. The symbols of a raster must not change
+           during a recording.'''
+        with self._lock:
+            if self._closed:
+                return
+
+            if self.failed:
+                self.droppedSamples += len(times)
+                return
+
+            if rasterIndex not in self._chunk:
+                self._addRaster(rasterIndex, names, [column.dtype for column in columns])
+
+            pos = 0
+            while pos < len(times):
+                chunk = self._chunk[rasterIndex]
+                if chunk is None:
+                    # All chunks are waiting to be written, see if one is back
+                    try:
+                        chunk = self._free[rasterIndex].get_nowait()
+                    except Queue.Empty:
+                        self.droppedSamples += len(times)-pos
+                        break
+
+                    self._chunk[rasterIndex] = chunk
+                    self._fill[rasterIndex] = 0
+
+                fill = self._fill[rasterIndex]
+                n = min(len(times)-pos, len(chunk)-fill)
+
+                chunk[RECORDING_TIME_FIELD][fill:fill+n] = times[pos:pos+n]
+                for name, column in zip(names, columns):
+                    chunk[name][fill:fill+n] = column[pos:pos+n]
+
+                pos += n
+                self._fill[rasterIndex] = fill+n
+
+                if fill+n == len(chunk):
+                    self._writeQueue.put((_RECORD_CHUNK, rasterIndex, chunk, len(chunk)))
+                    self._chunk[rasterIndex] = None
+
+            self.nbrSamples += pos
+
+    def close(self):
+        '''Write what is left and wait for the recorder thread to finish'''
+        with self._lock:
+            if self._closed:
+                return
+
+            self._closed = True
+
+            for rasterIndex, chunk in self._chunk.iteritems():
+                if chunk is not None and self._fill[rasterIndex] > 0:
+                    self._writeQueue.put((_RECORD_CHUNK, rasterIndex, chunk, self._fill[rasterIndex]))
+
+            self._writeQueue.put(None)
+
+        self.join()
+
+    def run(self):
+        logging.info('Recording to {}'.format(self.path))
+
+        while True:
+            item = self._writeQueue.get()
+
+            if item is None:
+                break
+
+            if self.failed:
+                # Nothing more is written after a failed write, the file would be inconsistent
+                if item[0] == _RECORD_CHUNK:
+                    self._free[item[1]].put(item[2])
+                continue
+
+            try:
+                if item[0] == _RECORD_LAYOUT:
+                    kind, rasterIndex, layout = item
+                    self._file.write(_RECORD.pack(kind, rasterIndex, len(layout)))
+                    self._file.write(layout)
+                else:
+                    kind, rasterIndex, chunk, n = item
+                    try:
+                        self._file.write(_RECORD.pack(kind, rasterIndex, n))
+                        self._file.write(chunk[:n].tostring())
+                    finally:
+                        self._free[rasterIndex].put(chunk)
+
+                # Written through, so that a crash loses at most the chunks not yet written
+                self._file.flush()
+            except Exception, e:
+                logging.error('Recording to {} failed, the rest of the measurement is not recorded: {}'.format(self.path, e))
+                self.failed = True
+
+        try:
+            self._file.close()
+        except Exception, e:
+            logging.error('Could not close recording {}: {}'.format(self.path, e))
+
+        if self.droppedSamples > 0:
+            logging.warning('Dropped {} samples of recording {}'.format(self.droppedSamples, self.path))
+
+        logging.info('Stopped recording to {}'.format(self.path))
+
+def readRecording(path):
+    '''The samples of each raster in a recording file, as a dict of raster index to a list of chunks.
+       The chunks are structured arrays with RECORDING_TIME_FIELD and one field per symbol,
+       mapped from the file rather than read into memory.'''
+    rasters = dict()
+    dtypes = dict()
+
+    with open(path, 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    if data[:len(RECORDING_MAGIC)] != RECORDING_MAGIC:
+        raise Exception('"{}" is not a calmeas recording'.format(path))
+
+    pos = len(RECORDING_MAGIC)
+    while pos + _RECORD.size <= len(data):
+        kind, rasterIndex, length = _RECORD.unpack_from(data, pos)
+        pos += _RECORD.size
+
+        if kind == _RECORD_LAYOUT:
+            dtypes[rasterIndex] = np.dtype([(str(name), str(t)) for name, t in json.loads(data[pos:pos+length])])
+            rasters[rasterIndex] = list()
+            pos += length
+        else:
+            size = length*dtypes[rasterIndex].itemsize
+            if pos + size > len(data):
+                # The last chunk of a recording that was not closed may be partly written
+                break
+
+            rasters[rasterIndex].append(np.frombuffer(data, dtype=dtypes[rasterIndex], count=length, offset=pos))
+            pos += size
+
+    return rasters
+
+def _rows(chunks, start, stop):
+    # Rows start to stop of a raster split into chunks, fewer (or none) past the end
+    rows = [chunks[0][:0]]
+    for chunk in chunks:
+        if start < len(chunk) and stop > 0:
+            rows.append(chunk[max(start, 0):stop])
+        start -= len(chunk)
+        stop -= len(chunk)
+
+    return np.concatenate(rows)
+
+def recordingToCsv(path, csvPath):
+    '''Save a recording as CSV, with a time and a value column for each symbol.
+       Converted a block of rows at a time, so that it works for any length of recording'''
+    rasters = readRecording(path)
+    chunks = [rasters[r] for r in sorted(rasters.keys()) if rasters[r]]
+
+    header = list()
+    for rasterChunks in chunks:
+        for name in rasterChunks[0].dtype.names[1:]:
+            header.extend(['{}_time'.format(name), '{}'.format(name)])
+
+    nbrRows = max([sum(map(len, rasterChunks)) for rasterChunks in chunks] + [0])
+
+    with open(csvPath, 'w') as f:
+        headerWriter = csv.writer(f, quoting=csv.QUOTE_ALL, delimiter=',')
+        writer = csv.writer(f, quoting=csv.QUOTE_NONE, delimiter=',')
+
+        headerWriter.writerow(tuple(header))
+
+        for start in range(0, nbrRows, RECORDER_CSV_ROWS):
+            columns = list()
+            for rasterChunks in chunks:
+                rows = _rows(rasterChunks, start, start+RECORDER_CSV_ROWS)
+                for name in rows.dtype.names[1:]:
+                    columns.extend([rows[RECORDING_TIME_FIELD], rows[name]])
+
+            for r in map(None, *columns): # Transpose, shorter columns are padded
+                writer.writerow(r)
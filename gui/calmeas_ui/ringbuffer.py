@@ -0,0 +1,67 @@
+import numpy as np
+
+
+class RingBuffer():
+    '''A fixed size circular sample buffer with O(1) append.
+       Like the shifted arrays it replaces, it is always full (initially with zeros)'''
+
+    def __init__(self, size, dtype=np.float64):
+        self._buf = np.zeros(size, dtype=dtype)
+        self._head = 0
+
+    def __len__(self):
+        return len(self._buf)
+
+    @property
+    def dtype(self):
+        return self._buf.dtype
+
+    def append(self, value):
+        self._buf[self._head] = value
+        self._head += 1
+        if self._head == len(self._buf):
+            self._head = 0
+
+    def extend(self, values):
+        '''Append a block of samples in one vectorized step'''
+        size = len(self._buf)
+        if size == 0:
+            return
+
+        values = np.asarray(values)[-size:]
+        n = len(values)
+
+        first = min(n, size - self._head)
+        self._buf[self._head:self._head+first] = values[:first]
+        self._buf[:n-first] = values[first:]
+
+        self._head = (self._head + n) % size
+
+    def latest(self, n):
+        '''The n most recently appended samples, oldest first'''
+        n = min(n, len(self._buf))
+        start = self._head - n
+        if start >= 0:
+            return self._buf[start:self._head]
+        else:
+            return np.concatenate((self._buf[start:], self._buf[:self._head]))
+
+    def last(self):
+        '''The most recently appended sample'''
+        return self._buf[self._head-1]
+
+    def segments(self):
+        '''Zero-copy views of the samples, oldest first.
+           Returns one view, or two if the buffer has wrapped'''
+        if self._head == 0:
+            return (self._buf[:],)
+        else:
+            return (self._buf[self._head:], self._buf[:self._head])
+
+    def view(self):
+        '''All samples ordered oldest first. Zero-copy unless the buffer has wrapped'''
+        segments = self.segments()
+        if len(segments) == 1:
+            return segments[0]
+        else:
+            return np.concatenate(segments)
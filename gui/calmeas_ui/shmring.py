@@ -0,0 +1,125 @@
+from multiprocessing import Event
+import threading
+import ctypes
+import struct
+import mmap
+import time
+import Queue
+
+SHM_RING_SIZE = 1 << 20
+
+_LENGTH = struct.Struct('<I')
+
+class ShmRing():
+    '''A single producer, single consumer byte ring in shared memory.
+
+       Can be used instead of a multiprocessing.Queue between two processes
+       created by fork, e.g. CobsSer.Rx_fifo. Each put is a length prefixed
+       record copied into an anonymous shared mmap, so nothing is pickled or
+       sent through a pipe. The head and tail byte counters live in the same
+       mmap and are only written by the producer and consumer respectively,
+       an event wakes a blocked consumer.
+
+       Threads within the producer (or consumer) process are serialized by
+       a local lock, so the ring is single producer per process.'''
+
+    _HEAD_OFFSET = 0
+    _TAIL_OFFSET = 64
+    _DATA_OFFSET = 128
+
+    # Sleep between checks for free space when the producer blocks on a full ring
+    _FULL_POLL_INTERVAL = 0.0005
+
+    def __init__(self, size=SHM_RING_SIZE):
+        self._size = size
+        self._mm = mmap.mmap(-1, self._DATA_OFFSET + size)
+
+        self._head = ctypes.c_uint64.from_buffer(self._mm, self._HEAD_OFFSET)
+        self._tail = ctypes.c_uint64.from_buffer(self._mm, self._TAIL_OFFSET)
+
+        self._event = Event()
+        self._put_lock = threading.Lock()
+        self._get_lock = threading.Lock()
+
+    def _write(self, counter, data):
+        pos = self._DATA_OFFSET + counter % self._size
+        first = min(len(data), self._DATA_OFFSET + self._size - pos)
+        self._mm[pos:pos+first] = data[:first]
+        if first < len(data):
+            self._mm[self._DATA_OFFSET:self._DATA_OFFSET+len(data)-first] = data[first:]
+
+    def _read(self, counter, n):
+        pos = self._DATA_OFFSET + counter % self._size
+        first = min(n, self._DATA_OFFSET + self._size - pos)
+        data = self._mm[pos:pos+first]
+        if first < n:
+            data += self._mm[self._DATA_OFFSET:self._DATA_OFFSET+n-first]
+        return data
+
+    def put(self, data, block=True, timeout=None):
+        need = _LENGTH.size + len(data)
+        if need > self._size:
+            raise ValueError('Record of {} bytes does not fit in ring of {} bytes'.format(len(data), self._size))
+
+        with self._put_lock:
+            head = self._head.value
+
+            if timeout is not None:
+                deadline = time.time() + timeout
+
+            while self._size - (head - self._tail.value) < need:
+                if not block or (timeout is not None and time.time() >= deadline):
+                    raise Queue.Full
+                time.sleep(self._FULL_POLL_INTERVAL)
+
+            self._write(head, _LENGTH.pack(len(data)) + str(data))
+
+            # Publish the record only when all of it is written
+            self._head.value = head + need
+
+        # A consumer clears the event and checks head again before it waits,
+        # so an event that is already set needs no new (costly) set
+        if not self._event.is_set():
+            self._event.set()
+
+    def put_nowait(self, data):
+        return self.put(data, block=False)
+
+    def get(self, block=True, timeout=None):
+        '''Returns the oldest record as a str'''
+        with self._get_lock:
+            tail = self._tail.value
+
+            if timeout is not None:
+                deadline = time.time() + timeout
+
+            while self._head.value == tail:
+                if not block:
+                    raise Queue.Empty
+
+                self._event.clear()
+
+                # Data might have been put just before the event was cleared
+                if self._head.value != tail:
+                    break
+
+                if timeout is None:
+                    self._event.wait()
+                else:
+                    remaining = deadline - time.time()
+                    if remaining <= 0 or not self._event.wait(remaining):
+                        if self._head.value == tail:
+                            raise Queue.Empty
+
+            n = _LENGTH.unpack(self._read(tail, _LENGTH.size))[0]
+            data = self._read(tail + _LENGTH.size, n)
+
+            self._tail.value = tail + _LENGTH.size + n
+
+        return data
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def empty(self):
+        return self._head.value == self._tail.value
@@ -7,6 +7,7 @@ pg.setConfigOptions(antialias=True)
 pg.setConfigOption('background', 'w')
 
 from PyQt4 import QtCore, QtGui
+import numpy as np
 
 from visualWidgets.VisualBase import VisualBase
 
@@ -68,15 +69,12 @@ class YTPlotter(VisualBase):
 
         self._colorCntr = 0
         self._stacking = 0
-        self._displayRange = 10
-        self._time = dict()
 
     def addSymbols(self, symbolNames):
         for symbolName in symbolNames:
             if symbolName not in self.symbols():
                 plotItem = YTPlotterItem(self, symbolName)
                 if self._calmeas.isStarted:
-                    self._setTimeVector(symbolName)
                     plotItem.enable()
 
     def removeSymbols(self, symbolNames):
@@ -87,20 +85,8 @@ class YTPlotter(VisualBase):
                 self.mainplot.removeItem(item)
                 root.removeChild(item)
 
-    def _setTimeVector(self, symbolName):
-        try:
-            p = self.getSymbolPeriod(symbolName)
-        except Exception, e:
-            pass
-        else:
-            if p>0.0:
-                self._time[symbolName] = [-p*x for x in range(int(self._displayRange/p)-1,-1,-1)]
-            else:
-                self._time[symbolName] = [0]*len(super(YTPlotter, self).getSymbolTime(symbolName))
-
     def start(self):
         for item in self._items():
-            self._setTimeVector(item.symbolName)
             item.enable()
 
         self._timer.start(self.updateInterval)
@@ -109,9 +95,12 @@ class YTPlotter(VisualBase):
         self._timer.stop()
 
     def update(self):
-        tmax = None
+        # How far back from the latest sample is in view, and in how many pixels
+        span = -self.mainplot.viewRange()[0][0]
+        nbrPoints = max(self.view.width(), 1)
+
         for item in self._items():
-            item.updateCurve()
+            item.updateCurve(span, nbrPoints)
 
     def symbols(self):
         return [item.symbolName for item in self._items()]
@@ -166,8 +155,24 @@ class YTPlotter(VisualBase):
         self.update()
 
     def getSymbolTime(self, symbolName):
-        '''A helper for getting the time buffer of a symbol'''
-        return self._time[symbolName]
+        '''The time relative to the latest sample, shared by all symbols in the same raster'''
+        return self.getSymbol(symbolName).timebase.relative()
+
+    def getSymbolEnvelope(self, symbolName, span, nbrPoints):
+        '''The min/max envelope of the decimated history of a symbol, span seconds back from
+           the latest sample in at most nbrPoints buckets. None if the raw samples cover the span'''
+        symbol = self.getSymbol(symbolName)
+        p = symbol.period_s
+
+        if symbol.decimated is None or p<=0.0 or span<=len(symbol.timebase)*p:
+            return None
+
+        nbrSamples = int(span/p)
+        level = symbol.decimated.levelFor(nbrSamples, nbrPoints)
+        offsets, mins, maxs = symbol.decimated.envelope(level, nbrSamples, nbrPoints)
+
+        # Each bucket is drawn as a vertical line from its min to its max
+        return np.repeat(-p*offsets, 2), np.column_stack((mins, maxs)).ravel()
 
 
 class YTPlotterItem( QtGui.QTreeWidgetItem ):
@@ -204,16 +209,19 @@ class YTPlotterItem( QtGui.QTreeWidgetItem ):
         self.plotData.setPen(pg.mkPen(None))
         self._enabled = False
 
-    def updateCurve(self):
+    def updateCurve(self, span, nbrPoints):
         if self._enabled:
             try:
+                envelope = self._YTPlotter.getSymbolEnvelope(self.symbolName, span, nbrPoints)
                 data = self._YTPlotter.getSymbolData(self.symbolName)
                 time = self._YTPlotter.getSymbolTime(self.symbolName)
             except Exception, e:
                 # symbolName might not exist anymore
                 pass
             else:
-                if self._useStepMode:
+                if envelope is not None:
+                    self.plotData.setData(y=envelope[1], x=envelope[0], stepMode=False)
+                elif self._useStepMode:
                     self.plotData.setData(y=data[1:], x=time, stepMode=self._useStepMode)
                 else:
                     self.plotData.setData(y=data, x=time, stepMode=self._useStepMode)
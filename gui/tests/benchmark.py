@@ -0,0 +1,1027 @@
+#!/bin/env python
+
+# Throughput benchmarks of the host side protocol handling, against copies of the
+# implementations they replaced. The behavior itself is covered by the test_*.py modules,
+# run them with: python -m unittest discover gui/tests
+# Usage: python benchmark.py [benchmark name ...]
+
+import logging
+logging.basicConfig(level=logging.INFO, datefmt='%H:%M:%S',
+                    format='%(asctime)s,%(msecs)-3d %(levelname)-8s [%(threadName)s:%(filename)s:%(lineno)d] %(message)s')
+import os
+import sys
+import shutil
+import copy
+import csv
+import tempfile
+import time
+import random
+import threading
+import multiprocessing
+import struct
+import ctypes
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'calmeas_ui'))
+
+from simtarget import SimTarget
+from cobsser import _cobs_encode, _cobs_decode, CobsDecoder, CobsSer
+from comhandler import ComHandler, ComHandlerThread
+from comframe import ComFrame, FrameView, EncodeFrame, Frame_Data_Fields
+from comframe import crc8_block, crc8_check_blocks, CRC8_TABLE, CRC8_INIT
+from comframe import FRAME_START, FRAME_HEADER_SIZE, CRC_LEN_RX, CRC_LEN_TX
+from shmring import ShmRing
+from ringbuffer import RingBuffer
+from decimation import DecimationPyramid
+from recorder import Recorder, recordingToCsv, RECORDER_CHUNKS_PER_RASTER, RECORDER_CHUNK_BYTES
+from comcommands import ComCommands, COM_INTERFACE, COM_ID_READ_FROM, COM_ID_WRITE_TO, READ_WINDOW
+from calmeas import CalMeas, Symbol, SymbolDataType, Timebase, SET_DATA_KEY, RAW_HISTORY
+from calmeas import CALMEAS_INTERFACE, CALMEAS_ID_META, CALMEAS_ID_SYMBOL_NAME, CALMEAS_ID_SYMBOL_DESC
+import Queue
+
+
+def _legacy_cobs_encode(in_bytes):
+    # The per byte encoder that _cobs_encode replaced
+    final_zero = True
+    out_bytes = bytearray()
+    idx = 0
+    search_start_idx = 0
+
+    for in_char in in_bytes:
+        if in_char == 0:
+            final_zero = True
+            out_bytes.append(idx - search_start_idx + 1)
+            out_bytes.extend(in_bytes[search_start_idx:idx])
+            search_start_idx = idx + 1
+        else:
+            if idx - search_start_idx == 0xFD:
+                final_zero = False
+                out_bytes.append('\xFF')
+                out_bytes.extend(in_bytes[search_start_idx:idx+1])
+                search_start_idx = idx + 1
+        idx += 1
+    if idx != search_start_idx or final_zero:
+        out_bytes.append(idx - search_start_idx + 1)
+        out_bytes.extend(in_bytes[search_start_idx:idx])
+
+    out_bytes.append('\x00')
+
+    return out_bytes
+
+def _legacy_cobs_split(rxdata):
+    # The per byte frame splitter that CobsDecoder replaced
+    decoded_frames = list()
+    decoded_range = 0
+    for i, rxbyte in enumerate(rxdata):
+        if rxbyte == 0:
+            try:
+                decoded_frames.append(_cobs_decode(rxdata[decoded_range:i]))
+            except Exception, e:
+                logging.warning(e)
+            decoded_range = i+1
+
+    del rxdata[0:decoded_range]
+
+    return decoded_frames
+
+class _LegacyFrameParser():
+    # The per byte state machine that ComHandler.ParseBytes replaced
+    def __init__(self):
+        self.full_frames = list()
+        self.state_machine = self._WaitForStart
+        self.new_frame = bytearray()
+        self.crc_len = CRC_LEN_RX
+
+    def _WaitForStart(self, b):
+        if b==FRAME_START:
+            self.new_frame = bytearray()
+            self.new_frame.append(b)
+            return self._GetSize_1
+        else:
+            logging.warning('{} is not start'.format(b))
+            return self._WaitForStart
+
+    def _GetSize_1(self, b):
+        self.new_frame.append(b)
+        return self._GetSize_2
+
+    def _GetSize_2(self, b):
+        self.new_frame.append(b)
+        b_h = int(self.new_frame[-1]) << 8
+        b_l = int(self.new_frame[-2])
+        self.expected_data_len = b_h | b_l
+
+        return self._GetHeader
+
+    def _GetHeader(self, b):
+        self.new_frame.append(b)
+        if self.expected_data_len==0:
+            if self.crc_len > 0:
+                return self._GetCrc
+            else:
+                self.full_frames.append(self.new_frame)
+                return self._WaitForStart
+        else:
+            self.data_cntr = 0
+            return self._GetData
+            
+    def _GetData(self, b):
+        self.new_frame.append(b)
+        self.data_cntr += 1
+        if self.data_cntr==self.expected_data_len:
+            if self.crc_len > 0:
+                return self._GetCrc
+            else:
+                self.full_frames.append(self.new_frame)
+                return self._WaitForStart
+        else:
+            return self._GetData
+
+    def _GetCrc(self, b):
+        self.new_frame.append(b)
+        self.crc_len -= 1
+        if self.crc_len==0:
+            self.crc_len = CRC_LEN_RX
+            self.full_frames.append(self.new_frame)
+            return self._WaitForStart
+        else:
+            return self._GetCrc
+
+    def ParseBytes(self, bytes):
+        self.full_frames = list()
+
+        for b in bytes:
+            self.state_machine = self.state_machine(b)
+
+        return self.full_frames
+
+
+def _legacy_set_data(f, data, crc_len=CRC_LEN_TX):
+    # The shifting encoder that ComFrame.setData replaced, without byte swapping
+    data.reverse()
+
+    fd = Frame_Data_Fields()
+
+    for i,d in enumerate(data):
+        if type(d)==int:
+            data[i] = ctypes.c_uint32(d)
+        elif type(d)==float:
+            data[i] = ctypes.c_float(d)
+
+    totaldatabytelength = 0
+
+    for b in data:
+
+        entrysize = ctypes.sizeof(type(b))
+
+        fd.raw[entrysize:] = fd.raw[:-entrysize]
+
+        totaldatabytelength += entrysize
+
+        if type(b)==ctypes.c_uint8:
+            fd.var_uint8[0] = b
+        elif type(b)==ctypes.c_int8:
+            fd.var_int8[0] = b
+        elif type(b)==ctypes.c_uint16:
+            fd.var_uint16[0] = b
+        elif type(b)==ctypes.c_int16:
+            fd.var_int16[0] = b
+        elif type(b)==ctypes.c_uint32:
+            fd.var_uint32[0] = b
+        elif type(b)==ctypes.c_int32:
+            fd.var_int32[0] = b
+        elif type(b)==ctypes.c_float:
+            fd.var_float[0] = b
+
+    f.data_size = ctypes.c_uint16(totaldatabytelength)
+    f.frame_size_raw = FRAME_HEADER_SIZE + totaldatabytelength + crc_len
+
+    if crc_len == 1:
+        crc = _legacy_crc8_block([f.status])
+        fd.raw[totaldatabytelength] = ctypes.c_uint8(_legacy_crc8_block(fd.raw[:totaldatabytelength], crc))
+
+    f.data = fd
+
+def _legacy_crc8_block(data, crc_init = CRC8_INIT):
+    # The byte by byte crc8_block that the two byte table replaced
+    crc = crc_init
+    for d in data:
+        crc = CRC8_TABLE[crc ^ (d&0xFF)]
+
+    return crc
+
+def _legacy_frame_bytes(f):
+    bytes = bytearray()
+    bytes.append(FRAME_START)
+    for i in range(f.frame_size_raw):
+        bytes.append(f.raw[i])
+    return bytes
+
+
+def _random_frames(nbr, size_max=300, seed=0):
+    rnd = random.Random(seed)
+    frames = list()
+    for n in range(nbr):
+        frame = bytearray(rnd.randint(0, 255) for i in range(rnd.randint(1, size_max)))
+        frames.append(frame)
+    return frames
+
+def _chunks(data, size):
+    return [data[i:i+size] for i in range(0, len(data), size)]
+
+def _report(name, nbytes, t_ref, t_new):
+    logging.info('{:<28} reference {:8.2f} MB/s, new {:8.2f} MB/s, speedup {:5.1f}x'.format(
+                 name, nbytes/t_ref/1e6, nbytes/t_new/1e6, t_ref/t_new))
+
+def _timed(fcn, *args):
+    t = time.time()
+    result = fcn(*args)
+    return result, time.time()-t
+
+
+def bench_cobs(nbr_frames=5000, read_size=200):
+    frames = _random_frames(nbr_frames)
+    nbytes = sum(map(len, frames))
+
+    encoded_ref, t_ref = _timed(lambda: [_legacy_cobs_encode(f) for f in frames])
+    encoded_new, t_new = _timed(lambda: [_cobs_encode(f) for f in frames])
+    assert encoded_ref == encoded_new
+    _report('COBS encode', nbytes, t_ref, t_new)
+
+    # The serial port delivers the stream in arbitrary chunks
+    stream = bytearray().join(encoded_new)
+    reads = _chunks(stream, read_size)
+
+    def split_ref():
+        rxdata = bytearray()
+        decoded = list()
+        for d in reads:
+            rxdata.extend(d)
+            decoded.extend(_legacy_cobs_split(rxdata))
+        return decoded
+
+    def split_new():
+        decoder = CobsDecoder()
+        decoded = list()
+        for d in reads:
+            decoded.extend(decoder.feed(d))
+        return decoded
+
+    decoded_ref, t_ref = _timed(split_ref)
+    decoded_new, t_new = _timed(split_new)
+    assert decoded_ref == decoded_new == frames
+    _report('COBS split and decode', len(stream), t_ref, t_new)
+
+
+def bench_encode(nbr_frames=5000):
+    # Tx frames like the ones sent by ComCommands.requestWrite and CalMeas.setTargetRaster
+    rnd = random.Random(0)
+    requests = list()
+    for n in range(nbr_frames):
+        if n % 2:
+            requests.append([ctypes.c_uint32(rnd.randint(0, 2**32-1)), ctypes.c_uint16(4), ctypes.c_float(rnd.random())])
+        else:
+            requests.append([ctypes.c_uint8(rnd.randint(0, 2))] + [ctypes.c_uint8(i) for i in range(rnd.randint(1, 64))])
+
+    def encode_ref():
+        encoded = list()
+        for data in requests:
+            f = ComFrame()
+            _legacy_set_data(f, list(data))
+            encoded.append(_legacy_frame_bytes(f))
+        return encoded
+
+    def encode_new():
+        encoded = list()
+        for data in requests:
+            f = ComFrame()
+            f.setData(list(data))
+            encoded.append(f.GetFrameBytesRaw(with_start=True))
+        return encoded
+
+    def encode_into():
+        out = bytearray()
+        end = 0
+        for data in requests:
+            end = EncodeFrame(out, 0, data, offset=end)
+        return out
+
+    encoded_ref, t_ref = _timed(encode_ref)
+    encoded_new, t_new = _timed(encode_new)
+    encoded_into, t_into = _timed(encode_into)
+    assert encoded_ref == encoded_new
+    assert bytearray().join(encoded_ref) == encoded_into
+    nbytes = sum(map(len, encoded_ref))
+    _report('Frame encode', nbytes, t_ref, t_new)
+    _report('Frame encode, one buffer', nbytes, t_ref, t_into)
+
+
+def bench_crc(nbr_frames=20000, read_size=16384):
+    rnd = random.Random(0)
+    blocks = [bytearray(rnd.getrandbits(8) for i in range(rnd.choice((21, 65, 254)))) for n in range(2000)]
+    nbytes = sum(map(len, blocks))
+
+    crcs_ref, t_ref = _timed(lambda: [_legacy_crc8_block(b) for b in blocks])
+    crcs_new, t_new = _timed(lambda: [crc8_block(b) for b in blocks])
+    assert crcs_ref == crcs_new
+    _report('CRC8 per block', nbytes, t_ref, t_new)
+
+    # Blocks with the crc appended, back to back in one buffer like received frames
+    buf = bytearray()
+    starts, ends = list(), list()
+    for b, crc in zip(blocks, crcs_ref):
+        starts.append(len(buf))
+        buf.extend(b)
+        buf.append(crc)
+        ends.append(len(buf))
+
+    valid, t_batch = _timed(crc8_check_blocks, buf, starts, ends)
+    assert valid.all()
+    _report('CRC8 batch check', nbytes, t_ref, t_batch)
+
+    # Rx parsing with and without crc on the frames
+    frames = _random_com_frames(nbr_frames, size_max=64)
+    withCrc = list()
+    for f in frames:
+        f = bytearray(f)
+        f.append(crc8_block(f[FRAME_HEADER_SIZE:]))
+        withCrc.append(f)
+
+    def parse(crc_len, frames):
+        parser = ComHandler()
+        parser.crc_len = crc_len
+        parsed = list()
+        for d in _chunks(bytearray().join(frames), read_size):
+            parsed.extend(parser.ParseBytes(d))
+        return parsed
+
+    parsed, t_ref = _timed(parse, 0, frames)
+    assert len(parsed) == len(frames)
+    parsed, t_new = _timed(parse, 1, withCrc)
+    assert parsed == withCrc
+    logging.info('Frame parse, {} byte reads: without crc {:6.2f} MB/s, with crc {:6.2f} MB/s'.format(
+                 read_size, len(bytearray().join(frames))/t_ref/1e6, len(bytearray().join(withCrc))/t_new/1e6))
+
+
+def _random_com_frames(nbr, size_max=64, seed=0):
+    # Raw rx frames, start byte included, as sent by the target
+    rnd = random.Random(seed)
+    frames = list()
+    for n in range(nbr):
+        data = bytearray(rnd.randint(0, 255) for i in range(rnd.randint(0, size_max) + CRC_LEN_RX))
+        frame = bytearray(struct.pack('<BHB', FRAME_START, len(data)-CRC_LEN_RX, rnd.randint(0, 255)))
+        frames.append(frame + data)
+    return frames
+
+def _corrupted(frames, nbr_glitches, seed=0):
+    # Line glitches: bursts of random bytes, some of which cut a frame short
+    rnd = random.Random(seed)
+    frames = [bytearray(f) for f in frames]
+    for i in rnd.sample(range(len(frames)), nbr_glitches):
+        burst = bytearray(rnd.randint(0, 255) for n in range(rnd.randint(1, 256)))
+        if rnd.random() < 0.5:
+            frames[i] = frames[i][:rnd.randint(1, len(frames[i]))] + burst
+        else:
+            frames[i] = burst + frames[i]
+    return bytearray().join(frames)
+
+def bench_frames(nbr_frames=20000, read_size=200, repeat=5):
+    frames = _random_com_frames(nbr_frames)
+    stream = bytearray().join(frames)
+    reads = _chunks(stream, read_size)
+
+    def parse(parser, reads):
+        parsed = list()
+        for d in reads:
+            parsed.extend(parser.ParseBytes(d))
+        return parsed
+
+    def best(parserType, reads, *args):
+        # Of a few runs, each with a new parser, as a single run varies by up to 30 %
+        t = float('inf')
+        for n in range(repeat):
+            parsed, t_run = _timed(parse, parserType(*args), reads)
+            t = min(t, t_run)
+        return parsed, t
+
+    parsed_ref, t_ref = best(_LegacyFrameParser, reads)
+    parsed_new, t_new = best(ComHandler, reads)
+    assert parsed_ref == parsed_new == frames
+    _report('Frame parse', len(stream), t_ref, t_new)
+
+    # Chunks of whole frames, i.e. one frame per COBS packet batched by the rx process
+    batches = [bytearray().join(frames[i:i+8]) for i in range(0, len(frames), 8)]
+    parsed_framed, t_framed = best(ComHandler, batches, True)
+    assert parsed_framed == frames
+    _report('Frame parse, framed input', len(stream), t_ref, t_framed)
+
+
+def bench_frameview(nbr_frames=20000):
+    # Cost per received frame of wrapping the parsed bytes and reading its header and payload
+    frames = _random_com_frames(nbr_frames)
+    views = ComHandler().ParseBytes(bytearray().join(frames))
+
+    def unpack(frameType, frames):
+        for framebytes in frames:
+            f = frameType(framebytes)
+            if f.Validity():
+                f.interface, f.mid, f.GetDataBuffer()
+
+    # ComFrame strips the start byte off its argument
+    copies = [bytearray(f) for f in frames]
+    _, t_ref = _timed(unpack, ComFrame, copies)
+    _, t_new = _timed(unpack, FrameView, views)
+    logging.info('Received frame: ComFrame {:5.2f} us, FrameView {:5.2f} us, speedup {:5.1f}x'.format(
+                 1e6*t_ref/nbr_frames, 1e6*t_new/nbr_frames, t_ref/t_new))
+
+class _CountingLogHandler(logging.Handler):
+    # Formats and counts the log records, but writes them nowhere
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.count = 0
+
+    def emit(self, record):
+        self.format(record)
+        self.count += 1
+
+def bench_resync(nbr_frames=20000, nbr_glitches=200, read_size=200, repeat=5):
+    frames = _random_com_frames(nbr_frames)
+    corrupted = _corrupted(frames, nbr_glitches)
+    sent = set(str(bytearray(f)) for f in frames)
+
+    def parse(parser, stream):
+        parsed = list()
+        for d in _chunks(stream, read_size):
+            parsed.extend(parser.ParseBytes(d))
+        return parsed
+
+    root = logging.getLogger()
+    handlers = root.handlers
+
+    for parserType in (_LegacyFrameParser, ComHandler):
+        t = float('inf')
+        for n in range(repeat):
+            counter = _CountingLogHandler()
+            root.handlers = [counter]
+            parser = parserType()
+            parsed, t_run = _timed(parse, parser, corrupted)
+            t = min(t, t_run)
+        root.handlers = handlers
+
+        received = set(str(bytearray(f)) for f in parsed)
+        logging.info('{:<18} {} glitches: parsed in {:6.1f} ms, {:5} log records, frames lost {:5}, bogus frames {:3}'.format(
+                     parserType.__name__, nbr_glitches, 1000*t, counter.count, len(sent-received), len(received-sent)))
+
+    # The bursts are 128 bytes on average, plus whatever is left of a frame that was cut short
+    logging.info('ComHandler dropped {} bytes in {} resync events, {:.0f} bytes per event'.format(
+                 parser.droppedBytes, parser.resyncEvents, parser.droppedBytes/float(parser.resyncEvents)))
+
+
+def _cpu_time(pid=None):
+    # User and system time in seconds of a process, all threads included
+    with open('/proc/{}/stat'.format(pid or os.getpid())) as f:
+        fields = f.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / float(os.sysconf('SC_CLK_TCK'))
+
+def bench_latency(nbr_frames=500, idle_time=3.0):
+    # The target is replaced by a pseudo terminal, so that the whole chain
+    # serial port -> rx process -> rx queue -> com handler thread is measured
+    master, slave = os.openpty()
+
+    cobsser = CobsSer()
+    cobsser.connect(os.ttyname(slave), '2000000')
+    cobsser.start_receive()
+
+    comhandler = ComHandlerThread()
+    comhandler.setByteQueue_Rx(cobsser.Rx_fifo)
+
+    received = threading.Event()
+    t_received = list()
+
+    def on_frame(f):
+        t_received.append(time.time())
+        received.set()
+
+    comhandler.addInterfaceCallback(15, on_frame)
+    comhandler.start()
+
+    f = ComFrame()
+    f.interface = 15
+    f.setData([0, 1, 2], crc_len=CRC_LEN_RX)
+    encoded = _cobs_encode(f.GetFrameBytesRaw(with_start=True))
+
+    time.sleep(0.5)
+
+    latencies = list()
+    for n in range(nbr_frames):
+        received.clear()
+        del t_received[:]
+        t = time.time()
+        os.write(master, encoded)
+        if received.wait(1.0):
+            latencies.append(t_received[0] - t)
+        time.sleep(random.uniform(0, 0.005))
+
+    t_rx = _cpu_time(cobsser.rx_process.pid)
+    t_host = _cpu_time()
+    time.sleep(idle_time)
+    cpu_rx = (_cpu_time(cobsser.rx_process.pid) - t_rx) / idle_time
+    cpu_host = (_cpu_time() - t_host) / idle_time
+
+    comhandler.stop()
+    comhandler.join()
+    cobsser.disconnect()
+    os.close(master)
+
+    latencies.sort()
+    logging.info('Latency over {} frames: median {:.3f} ms, 99th percentile {:.3f} ms, lost {}'.format(
+                 nbr_frames, 1000*latencies[len(latencies)/2], 1000*latencies[int(len(latencies)*0.99)], 
+                 nbr_frames-len(latencies)))
+    logging.info('Idle CPU load: rx process {:.1f} %, com handler process {:.1f} %'.format(100*cpu_rx, 100*cpu_host))
+
+
+def bench_tx(nbr_frames=2000):
+    # Write requests through the tx process to a pseudo terminal, like a dataset download
+    master, slave = os.openpty()
+
+    cobsser = CobsSer()
+    cobsser.connect(os.ttyname(slave), '2000000')
+    cobsser.start_transmitt()
+
+    frames = list()
+    for n in range(nbr_frames):
+        out = bytearray()
+        EncodeFrame(out, 0x01, [ctypes.c_uint32(0x20000000 + 4*n), ctypes.c_uint16(4), ctypes.c_float(n)])
+        frames.append(out)
+    nbytes = len(bytearray().join(_cobs_encode(f) for f in frames))
+
+    time.sleep(0.5)
+
+    t = time.time()
+    for f in frames:
+        cobsser.Tx_fifo.put(f)
+
+    received = 0
+    while received < nbytes:
+        received += len(os.read(master, 65536))
+    t = time.time() - t
+
+    cobsser.disconnect()
+    os.close(master)
+
+    logging.info('Tx of {} frames: {:.1f} ms, {:.1f} us/frame'.format(nbr_frames, 1000*t, 1e6*t/nbr_frames))
+
+
+def _ipc_producer(fifo, frames, batch_size):
+    for i in range(0, len(frames), batch_size):
+        batch = bytearray()
+        for frame in frames[i:i+batch_size]:
+            batch.extend(frame)
+        fifo.put(batch)
+
+def bench_ipc(nbr_frames=50000, frame_size=20, batch_size=64):
+    # Cost per frame of moving decoded frames from the rx process to the com handler
+    frames = [bytearray(frame_size) for n in range(nbr_frames)]
+    nbytes = nbr_frames*frame_size
+    times = list()
+
+    cases = [(multiprocessing.Queue, 1), (multiprocessing.Queue, batch_size), 
+             (ShmRing, 1), (ShmRing, batch_size)]
+
+    for fifoType, size in cases:
+        fifo = fifoType()
+        producer = multiprocessing.Process(target=_ipc_producer, args=(fifo, frames, size))
+
+        t = time.time()
+        producer.start()
+        received = 0
+        while received < nbytes:
+            received += len(fifo.get())
+        times.append(time.time() - t)
+        producer.join()
+
+    for (fifoType, size), t in zip(cases, times):
+        logging.info('IPC {:<8} {:2} frames per put: {:6.2f} us/frame, speedup {:5.1f}x'.format(
+                     fifoType.__name__, size, 1e6*t/nbr_frames, times[0]/t))
+
+
+def bench_reads(nbr_symbols=200, round_trip=0.002):
+    # Reading the target value of many symbols, e.g. when a dataset is created from the target
+    rnd = random.Random(0)
+    memory = bytearray(rnd.getrandbits(8) for i in range(4096))
+    types = [(ctypes.c_uint8, np.uint8), (ctypes.c_int16, np.int16), (ctypes.c_uint32, np.uint32), (ctypes.c_float, np.float)]
+
+    target = SimTarget(memory, round_trip)
+    calmeas = CalMeas(target)
+    comcmds = calmeas.comcmds
+    target.start()
+
+    reads = list()
+    for n in range(nbr_symbols):
+        c_type, np_type = rnd.choice(types)
+        symbol = Symbol('symbol{}'.format(n))
+        symbol.address = ctypes.sizeof(c_type)*rnd.randint(0, 4096/ctypes.sizeof(c_type)-1)
+        symbol.setDatatype(SymbolDataType(np_type))
+        calmeas.workingSymbols[symbol.name] = symbol
+        reads.append((symbol.address, [c_type]))
+
+    def sequential():
+        values = list()
+        for address, dataTypeStructure in reads:
+            comcmds.requestRead(address, dataTypeStructure)
+            values.append(comcmds.pollReadData(timeout=1)[1])
+        return values
+
+    def pipelined():
+        return [request.result() for request in comcmds.submitReads(reads)]
+
+    def ranges():
+        values = calmeas.getSymbolTargetValues(calmeas.workingSymbols.keys())
+        return [values['symbol{}'.format(n)] for n in range(nbr_symbols)]
+
+    values_ref, t_ref = _timed(sequential)
+    values_new, t_new = _timed(pipelined)
+    nbrRequests = target.nbrRequests
+    values_ranges, t_ranges = _timed(ranges)
+    assert values_ref == values_new == values_ranges
+    logging.info('Read {} symbols, {:.1f} ms round trip: one at a time {:6.1f} ms, pipelined {:6.1f} ms, speedup {:5.1f}x'.format(
+                 nbr_symbols, 1000*round_trip, 1000*t_ref, 1000*t_new, t_ref/t_new))
+    logging.info('Read {} symbols as {} memory ranges: {:6.1f} ms, speedup {:5.1f}x'.format(
+                 nbr_symbols, target.nbrRequests-nbrRequests, 1000*t_ranges, t_ref/t_ranges))
+
+def bench_memory(length=65536, round_trip=0.002, baudrate=2000000):
+    # Dumping and restoring a block of target memory over a simulated serial link
+    rnd = random.Random(0)
+    memory = bytearray(length)
+    image = bytearray(rnd.getrandbits(8) for i in range(length))
+
+    target = SimTarget(memory, round_trip, baudrate)
+    comcmds = ComCommands(target)
+    target.start()
+
+    # The payload in both directions, a limit for the throughput
+    line_rate = baudrate/10.0
+
+    for readWindow in (1, READ_WINDOW):
+        comcmds.readWindow = readWindow
+
+        memory[:] = bytearray(length)
+        _, t_write = _timed(comcmds.writeMemory, 0, image)
+        assert memory == image
+
+        out = np.zeros(length, dtype=np.uint8)
+        _, t_read = _timed(comcmds.readMemory, 0, length, out)
+        assert out.tobytes() == image and target.overruns == 0
+
+        logging.info('{} kB, window {:2}, {:.1f} ms round trip: write and verify {:6.1f} kB/s, read {:6.1f} kB/s, line {:.1f} kB/s'.format(
+                     length/1024, readWindow, 1000*round_trip, length/t_write/1000, length/t_read/1000, line_rate/1000))
+
+
+def bench_dataset(nbr_params=500, round_trip=0.002, baudrate=2000000):
+    # Switching data set, with the parameters laid out like the fields of calibration structs
+    rnd = random.Random(0)
+    memory = bytearray(16384)
+    types = [(ctypes.c_uint8, np.uint8), (ctypes.c_int16, np.int16), (ctypes.c_uint32, np.uint32), (ctypes.c_float, np.float)]
+
+    target = SimTarget(memory, round_trip, baudrate)
+    calmeas = CalMeas(target)
+    target.start()
+
+    address = 0
+    dataSet = dict()
+    for n in range(nbr_params):
+        if n % 10 == 0:
+            # Arrays and structs of fields of one type, with other variables in between some of them
+            c_type, np_type = rnd.choice(types)
+            address += rnd.choice((0, 0, 4, 16))
+        address += -address % ctypes.sizeof(c_type)
+        symbol = Symbol('param{}'.format(n))
+        symbol.address = address
+        symbol.setDatatype(SymbolDataType(np_type))
+        calmeas.workingSymbols[symbol.name] = symbol
+        dataSet[symbol.name] = rnd.randint(0, 100) if c_type != ctypes.c_float else rnd.random()
+        address += ctypes.sizeof(c_type)
+
+    def one_by_one():
+        for name, value in dataSet.iteritems():
+            calmeas.setSymbolTargetValue(name, value)
+        # Nothing is acknowledged, wait until the target has handled all writes
+        while not target.idle():
+            time.sleep(0.0005)
+
+    _, t_ref = _timed(one_by_one)
+    image = bytearray(memory)
+    nbrRequests = target.nbrRequests
+
+    memory[:] = bytearray(len(memory))
+    failed, t_new = _timed(calmeas.setSymbolTargetValues, dataSet)
+    assert not failed and memory == image
+
+    logging.info('Data set of {} parameters: one write each {:6.1f} ms, unverified; batched {:6.1f} ms in {} writes, verified; speedup {:5.1f}x'.format(
+                 nbr_params, 1000*t_ref, 1000*t_new, (target.nbrRequests-nbrRequests)/2, t_ref/t_new))
+
+    # Switching to a set where one in ten values differ from what the target holds
+    changed = dict(dataSet)
+    for name in rnd.sample(sorted(dataSet.keys()), nbr_params/10):
+        changed[name] = dataSet[name] + 1
+    calmeas.importParamSet('changed', {SET_DATA_KEY: changed})
+
+    plan, t_plan = _timed(calmeas.planParamSet, 'changed')
+    cached, t_cached = _timed(calmeas.planParamSet, 'changed', False)
+    assert cached.toWrite == plan.toWrite
+    nbrRequests = target.nbrRequests
+    failed, t_diff = _timed(calmeas.useParamSet, 'changed', plan)
+    assert not failed and len(plan.toWrite) == nbr_params/10
+    assert calmeas.getSymbolTargetValues(changed.keys()) == dict((name, [calmeas.targetValueCache[name]]) for name in changed)
+
+    logging.info('Switch data set, {}: plan {:5.2f} ms, from the cache {:5.2f} ms, download {:6.1f} ms in {} writes'.format(
+                 plan, 1000*t_plan, 1000*t_cached, 1000*t_diff, (target.nbrRequests-nbrRequests)/2))
+
+    # A target reset is noticed, although the values are cached
+    memory[:] = bytearray(len(memory))
+    plan = calmeas.planParamSet('changed')
+    assert sorted(plan.toWrite.keys()) == sorted(name for name in changed if changed[name] != 0)
+
+
+def bench_symbols(nbr_symbols=200, round_trip=0.002, baudrate=2000000):
+    # Initialization: getting the symbol table of the target
+    rnd = random.Random(0)
+    memory = bytearray(65536)
+    typecodes = [0x01, 0x81, 0x02, 0x82, 0x04, 0x84, 0x94]
+
+    # The strings are packed in flash, the symbols in ram
+    strings = bytearray()
+    symbols = list()
+    for n in range(nbr_symbols):
+        nameAddress = len(strings)
+        strings += 'module_signal_{}\0'.format(n)
+        descAddress = len(strings)
+        strings += 'Description of signal {}{}\0'.format(n, ' in some unit' * rnd.randint(0, 3))
+        symbols.append((rnd.choice(typecodes), nameAddress, 0x8000 + 4*n, descAddress))
+    memory[:len(strings)] = strings
+
+    target = SimTarget(memory, round_trip, baudrate, symbols)
+    calmeas = CalMeas(target)
+    calmeas.symbolCacheFile = None
+    target.start()
+
+    def one_at_a_time():
+        # Like requestTargetSymbols used to: the meta data, then each name and
+        # description request waited for before the next one is sent
+        strings = list()
+        for mid, index in [(CALMEAS_ID_META, None)] + [(mid, index) for index in range(nbr_symbols)
+                           for mid in (CALMEAS_ID_SYMBOL_NAME, CALMEAS_ID_SYMBOL_DESC)]:
+            f = ComFrame()
+            f.interface = CALMEAS_INTERFACE
+            f.mid = mid
+            f.setData([] if index is None else [ctypes.c_uint8(index)])
+            target.sendFrame(f)
+            strings.append(calmeas._ResponseFifo.get(True, 1))
+        return strings
+
+    _, t_ref = _timed(one_at_a_time)
+    symbols_new, t_new = _timed(calmeas.requestTargetSymbols)
+    nbrRequests = target.nbrRequests
+    symbols_mem, t_mem = _timed(calmeas.requestTargetSymbols, 1, True)
+
+    assert sorted(symbols_new.keys()) == sorted(symbols_mem.keys()) == ['module_signal_{}'.format(n) for n in sorted(range(nbr_symbols), key=str)]
+    assert [s.desc for s in symbols_new.values()] == [s.desc for s in symbols_mem.values()]
+
+    logging.info('Symbol table of {} symbols, {:.1f} ms round trip: one at a time {:6.1f} ms, windowed {:6.1f} ms, speedup {:5.1f}x'.format(
+                 nbr_symbols, 1000*round_trip, 1000*t_ref, 1000*t_new, t_ref/t_new))
+    logging.info('Symbol table read from memory: {:6.1f} ms in {} requests, speedup {:5.1f}x'.format(
+                 1000*t_mem, target.nbrRequests-nbrRequests, t_ref/t_mem))
+
+    # Initializing again with the symbol cache, first with the same and then with a changed firmware
+    calmeas.symbolCacheFile = os.path.join(tempfile.mkdtemp(), 'symbols.json')
+    calmeas.requestTargetSymbols()
+
+    for nbrChanged in (0, 10):
+        for i in range(nbrChanged):
+            typecode, nameAddress, address, descAddress = symbols[i]
+            symbols[i] = (typecode, nameAddress, address + 0x1000, descAddress)
+
+        nbrRequests = target.nbrRequests
+        symbols_cached, t_cached = _timed(calmeas.requestTargetSymbols)
+        assert sorted(symbols_cached.keys()) == sorted(symbols_new.keys())
+
+        logging.info('Symbol table with cache, {:2} symbols changed: {:6.1f} ms in {} requests, speedup {:5.1f}x'.format(
+                     nbrChanged, 1000*t_cached, target.nbrRequests-nbrRequests, t_ref/t_cached))
+
+    shutil.rmtree(os.path.dirname(calmeas.symbolCacheFile))
+
+
+def bench_init(nbr_symbols=1000):
+    # Initialization: creating the symbols of the target and copying them to the working symbols
+    typecodes = [0x01, 0x81, 0x02, 0x82, 0x04, 0x84, 0x94]
+    calmeas = CalMeas(ComHandler())
+
+    def make_symbols():
+        symbols = dict()
+        for n in range(nbr_symbols):
+            s = Symbol()
+            s.index = n
+            s.setDatatype(SymbolDataType(calmeas.getBaseType(typecodes[n % len(typecodes)])[1]))
+            s.name = 'symbol{}'.format(n)
+            symbols[s.name] = s
+        return symbols
+
+    def reference():
+        # Like before, a sample buffer of 10000 samples for each symbol, copied along with the symbols
+        symbols = make_symbols()
+        for s in symbols.itervalues():
+            s.initForSampling(Timebase(0.001, 10000))
+        return copy.deepcopy(symbols)
+
+    def new():
+        symbols = make_symbols()
+        return dict((name, s.copyMeta()) for name, s in symbols.iteritems())
+
+    symbols_ref, t_ref = _timed(reference)
+    symbols_new, t_new = _timed(new)
+
+    assert sorted(symbols_ref.keys()) == sorted(symbols_new.keys())
+    assert all(symbols_ref[name].info() == symbols_new[name].info() for name in symbols_ref)
+
+    nbytes_ref = sum(s.dataBuffer._buf.nbytes + s.timebase.timeBuffer._buf.nbytes for s in symbols_ref.itervalues())
+    nbytes_new = sum(s.dataBuffer._buf.nbytes + s.timebase.timeBuffer._buf.nbytes for s in symbols_new.itervalues())
+
+    logging.info('Initialization of {} symbols: reference {:6.1f} ms, {:.1f} MB samples, new {:6.1f} ms, {:.1f} MB samples, speedup {:5.1f}x'.format(
+                 nbr_symbols, 1000*t_ref, nbytes_ref/1e6, 1000*t_new, nbytes_new/1e6, t_ref/t_new))
+
+
+def bench_raster(nbr_symbols=50, nbr_blocks=2000, block_size=10, period=0.001):
+    # Appending decoded raster blocks to the symbols of a raster
+    calmeas = CalMeas(ComHandler())
+
+    timebase = Timebase(period, int(10/period))
+    calmeas.rasterTimebases[0] = timebase
+
+    for n in range(nbr_symbols):
+        s = Symbol('symbol{}'.format(n))
+        s.setDatatype(SymbolDataType(np.float))
+        s.setPeriod(period)
+        calmeas.workingSymbols[s.name] = s
+        calmeas.addToRaster(0, s.name)
+        s.initForSampling(timebase)
+
+    block = np.zeros(block_size, dtype=calmeas.compileRasterDtype(0))
+
+    def reference():
+        # Like before, a time buffer for each symbol advanced along with its samples
+        timebases = dict((name, Timebase(period, len(timebase))) for name in calmeas.raster[0])
+        for i in range(nbr_blocks):
+            for name in calmeas.raster[0]:
+                timebases[name].advance(len(block))
+                calmeas.workingSymbols[name].appendValues(block[name])
+        return timebases
+
+    def new():
+        for i in range(nbr_blocks):
+            calmeas.appendRasterBlock(0, block)
+
+    timebases, t_ref = _timed(reference)
+    _, t_new = _timed(new)
+
+    assert all(np.array_equal(tb.view(), timebase.view()) for tb in timebases.itervalues())
+
+    logging.info('Raster of {} symbols, {} blocks: reference {:6.1f} ms, {:.1f} MB time stamps, new {:6.1f} ms, {:.1f} MB time stamps, speedup {:5.1f}x'.format(
+                 nbr_symbols, nbr_blocks, 1000*t_ref, nbr_symbols*timebase.timeBuffer._buf.nbytes/1e6,
+                 1000*t_new, timebase.timeBuffer._buf.nbytes/1e6, t_ref/t_new))
+
+
+def bench_history(history=3600, period=0.001, block_size=100, nbr_points=2000):
+    # An hour long measurement history of a 1 kHz symbol, zoomed out to all of it
+    length = int(history/period)
+    raw = int(RAW_HISTORY/period)
+    values = np.sin(np.arange(length)/1000.0)
+
+    full = RingBuffer(length)
+    decimated = DecimationPyramid(length, raw)
+
+    def reference():
+        # All raw samples kept, and all of them plotted
+        for i in range(0, length, block_size):
+            full.extend(values[i:i+block_size])
+
+    def new():
+        for i in range(0, length, block_size):
+            decimated.extend(values[i:i+block_size])
+
+    _, t_ref = _timed(reference)
+    _, t_new = _timed(new)
+
+    level = decimated.levelFor(length, nbr_points)
+    (_, mins, maxs), t_env = _timed(decimated.envelope, level, length, nbr_points)
+    _, t_view = _timed(full.view)
+
+    assert np.isclose(mins.min(), values.min()) and np.isclose(maxs.max(), values.max()) and len(mins) <= nbr_points
+
+    nbytes_ref = full._buf.nbytes
+    nbytes_new = sum(l.buckets._buf.nbytes for l in decimated.levels)
+
+    logging.info('History of {} samples in blocks of {}: reference {:6.1f} ms, {:.1f} MB, new {:6.1f} ms, {:.1f} MB in {} levels'.format(
+                 length, block_size, 1000*t_ref, nbytes_ref/1e6, 1000*t_new, nbytes_new/1e6, len(decimated.levels)))
+    logging.info('Zoomed out to all of it: reference {} points in {:.2f} ms, new {} points in {:.2f} ms'.format(
+                 length, 1000*t_view, 2*len(mins), 1000*t_env))
+
+    # The rx thread appends blocks of a few samples at a time
+    for size in (1, 5, 100):
+        nbr = 100000 - 100000 % size
+        full = RingBuffer(raw)
+        decimated = DecimationPyramid(length, raw)
+        blocks = [values[i:i+size] for i in range(0, nbr, size)]
+
+        _, t_ref = _timed(lambda: [full.extend(block) for block in blocks])
+        _, t_new = _timed(lambda: [decimated.extend(block) for block in blocks])
+
+        logging.info('Blocks of {:3} samples: raw samples only {:.2f} us/sample, with history {:.2f} us/sample'.format(
+                     size, 1e6*t_ref/nbr, 1e6*t_new/nbr))
+
+
+def bench_recorder(nbr_symbols=20, nbr_blocks=5000, block_size=10, period=0.001):
+    # Logging a measurement of one raster and saving it as CSV
+    dtypes = [np.uint8, np.int16, np.uint32, np.float32]
+    names = ['symbol{}'.format(n) for n in range(nbr_symbols)]
+    blocks = [(period*np.arange(i*block_size, (i+1)*block_size),
+               [np.arange(i*block_size, (i+1)*block_size).astype(dtypes[n % len(dtypes)]) for n in range(nbr_symbols)])
+              for i in range(nbr_blocks)]
+
+    tmpdir = tempfile.mkdtemp()
+
+    def reference():
+        # Like before, the blocks of each symbol kept in lists until the log is saved
+        logBuffer = dict()
+        for times, values in blocks:
+            for name, v in zip(names, values):
+                logBuffer.setdefault(name, list()).append((times.copy(), v.copy()))
+        return logBuffer
+
+    def reference_csv(logBuffer, fname):
+        with open(fname, 'w') as f:
+            headerWriter = csv.writer(f, quoting=csv.QUOTE_ALL, delimiter=',')
+            writer = csv.writer(f, quoting=csv.QUOTE_NONE, delimiter=',')
+
+            columns = list()
+            header = list()
+            for name in names:
+                header.extend(['{}_time'.format(name), '{}'.format(name)])
+                [time, values] = zip(*logBuffer[name])
+                columns.extend([np.concatenate(time), np.concatenate(values)])
+
+            rows = map(list,map(None,*columns))
+
+            headerWriter.writerow(tuple(header))
+
+            for r in rows:
+                writer.writerow(tuple(r))
+
+    def new():
+        recorder = Recorder(os.path.join(tmpdir, 'log.rec'))
+        recorder.start()
+        for times, values in blocks:
+            recorder.append(0, times, names, values)
+        recorder.close()
+        return recorder
+
+    logBuffer, t_ref = _timed(reference)
+    recorder, t_new = _timed(new)
+
+    nbytes_ref = sum(t.nbytes + v.nbytes for name in names for t, v in logBuffer[name])
+    nbytes_new = RECORDER_CHUNKS_PER_RASTER * RECORDER_CHUNK_BYTES
+
+    _, t_csv_ref = _timed(reference_csv, logBuffer, os.path.join(tmpdir, 'ref.csv'))
+    _, t_csv_new = _timed(recordingToCsv, recorder.path, os.path.join(tmpdir, 'new.csv'))
+
+    with open(os.path.join(tmpdir, 'ref.csv')) as f_ref, open(os.path.join(tmpdir, 'new.csv')) as f_new:
+        assert f_ref.read() == f_new.read()
+
+    logging.info('Recording {} symbols x {} samples: reference {:6.1f} ms, {:.1f} MB in memory, new {:6.1f} ms, at most {:.1f} MB in memory, {:.1f} MB on disk'.format(
+                 nbr_symbols, nbr_blocks*block_size, 1000*t_ref, nbytes_ref/1e6, 1000*t_new, nbytes_new/1e6, os.path.getsize(recorder.path)/1e6))
+    logging.info('Saving as CSV: reference {:6.1f} ms, new {:6.1f} ms'.format(1000*t_csv_ref, 1000*t_csv_new))
+
+    shutil.rmtree(tmpdir)
+
+
+BENCHMARKS = {'cobs': bench_cobs,
+              'crc': bench_crc,
+              'dataset': bench_dataset,
+              'encode': bench_encode,
+              'frames': bench_frames,
+              'frameview': bench_frameview,
+              'history': bench_history,
+              'init': bench_init,
+              'ipc': bench_ipc,
+              'raster': bench_raster,
+              'recorder': bench_recorder,
+              'reads': bench_reads,
+              'resync': bench_resync,
+              'symbols': bench_symbols,
+              'tx': bench_tx,
+              'latency': bench_latency,
+              'memory': bench_memory}
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or sorted(BENCHMARKS.keys())
+    for name in names:
+        BENCHMARKS[name]()
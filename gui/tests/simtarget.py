@@ -0,0 +1,115 @@
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'calmeas_ui'))
+
+import threading
+import ctypes
+import struct
+import time
+import math
+import Queue
+from collections import deque
+
+from comframe import EncodeFrame, CRC_LEN_RX
+from comhandler import ComHandler
+from comcommands import COM_INTERFACE, COM_ID_READ_FROM, COM_ID_WRITE_TO, frameWireSize
+from calmeas import CALMEAS_ID_META, CALMEAS_ID_SYMBOL_NAME, CALMEAS_ID_SYMBOL_DESC
+
+# RX_BUF_LEN of the stm32f4 example, the DMA ring the requests are received into
+TARGET_RX_BUF_LEN = 256
+
+# The stm32f4 example empties its rx ring, and handles the requests in it, once per main loop
+TARGET_SERVICE_PERIOD = 0.001
+
+
+class SimTarget(threading.Thread, ComHandler):
+    '''Stands in for ComHandlerThread and the target: requests are handled in order on a memory
+       image, and the responses are parsed and passed on to the callbacks as by ComHandlerThread.
+       Each frame arrives round_trip/2 seconds after it was sent, plus the time it takes on a
+       serial line of baudrate (10 bits per byte) if given. The calmeas symbol table is given
+       as (typecode, nameAddress, address, descAddress) of each symbol.
+
+       Like the stm32f4 example, the frames are received into a ring of rx_buffer bytes,
+       and the requests that have arrived are taken from it and handled every service_period
+       seconds. A frame that does not fit in the ring is lost, and counted in overruns.'''
+
+    def __init__(self, memory, round_trip, baudrate=None, symbols=(),
+                 rx_buffer=TARGET_RX_BUF_LEN, service_period=TARGET_SERVICE_PERIOD):
+        threading.Thread.__init__(self, name=type(self).__name__)
+        ComHandler.__init__(self)
+        self.setDaemon(True)
+        self.memory = memory
+        self.symbols = symbols
+        self.round_trip = round_trip
+        self.byte_time = 10.0/baudrate if baudrate else 0.0
+        self.requests = Queue.Queue()
+        self.nbrRequests = 0
+        self._txFree = 0.0
+        self._rxFree = 0.0
+
+        self.setByteQueue_Rx(Queue.Queue())
+
+        self.rx_buffer = rx_buffer
+        self.service_period = service_period
+        self.overruns = 0
+        # When the frames in the rx ring are handled, and their sizes
+        self._rxRing = deque()
+
+    def sendFrame(self, f):
+        self.nbrRequests += 1
+        size = frameWireSize(f)
+        start = max(time.time(), self._txFree) + self.round_trip/2
+        self._txFree = max(time.time(), self._txFree) + self.byte_time*size
+        arrival = self._txFree + self.round_trip/2
+
+        while self._rxRing and self._rxRing[0][0] <= start:
+            self._rxRing.popleft()
+
+        # The ring is full with one byte less than its size, the DMA would overwrite unread bytes
+        if sum(n for t, n in self._rxRing) + size >= self.rx_buffer:
+            self.overruns += 1
+            return
+
+        # Handled by the first main loop after it has arrived
+        handled = (math.floor(arrival/self.service_period) + 1)*self.service_period
+        self._rxRing.append((handled, size))
+        self.requests.put((handled, f.interface, f.mid, f.GetDataBytesRaw()))
+
+    def idle(self):
+        '''True when all requests sent so far have been handled'''
+        return self.requests.qsize() == 0 and self._txFree <= time.time()
+
+    def _string(self, address):
+        return str(self.memory[address:self.memory.index('\0', address)])
+
+    def _respond(self, arrival, interface, mid, data):
+        self._rxFree = max(arrival, self._rxFree) + self.byte_time*(len(data)+6)
+        delay = self._rxFree + self.round_trip/2 - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+        out = bytearray()
+        EncodeFrame(out, interface | mid << 4, [(ctypes.c_uint8 * len(data)).from_buffer_copy(data)], crc_len=CRC_LEN_RX)
+        self._queue_rx.put(out)
+        self.handler_Rx(block=False)
+
+    def run(self):
+        while True:
+            handled, interface, mid, request = self.requests.get()
+
+            if interface == COM_INTERFACE:
+                address, size = struct.unpack_from('<IH', request)
+
+                if mid == COM_ID_WRITE_TO:
+                    self.memory[address:address+size] = request[6:6+size]
+                else:
+                    self._respond(handled, interface, COM_ID_READ_FROM, self.memory[address:address+size])
+
+            elif mid == CALMEAS_ID_META:
+                self._respond(handled, interface, mid, ''.join(struct.pack('<BIII', *symbol) for symbol in self.symbols))
+
+            elif mid == CALMEAS_ID_SYMBOL_NAME:
+                self._respond(handled, interface, mid, self._string(self.symbols[request[0]][1]))
+
+            elif mid == CALMEAS_ID_SYMBOL_DESC:
+                self._respond(handled, interface, mid, self._string(self.symbols[request[0]][3]))
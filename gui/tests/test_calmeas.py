@@ -0,0 +1,145 @@
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'calmeas_ui'))
+
+import unittest
+import tempfile
+import shutil
+import numpy as np
+
+from simtarget import SimTarget
+from calmeas import CalMeas, Symbol, SymbolDataType, SET_DATA_KEY
+
+
+class SymbolCacheTest(unittest.TestCase):
+
+    NBR_SYMBOLS = 20
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+        memory = bytearray(16384)
+        strings = bytearray()
+        self.symbols = list()
+        for n in range(self.NBR_SYMBOLS):
+            nameAddress = len(strings)
+            strings += 'signal_{}\0'.format(n)
+            descAddress = len(strings)
+            strings += 'Description {}\0'.format(n)
+            self.symbols.append((0x04, nameAddress, 0x2000 + 4*n, descAddress))
+        memory[:len(strings)] = strings
+
+        self.target = SimTarget(memory, 0.0, symbols=self.symbols)
+        self.calmeas = CalMeas(self.target)
+        self.calmeas.symbolCacheFile = os.path.join(self.dir, 'symbols.json')
+        self.target.start()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _request(self):
+        # The symbols, and the number of requests it took to get them
+        nbrRequests = self.target.nbrRequests
+        symbols = self.calmeas.requestTargetSymbols()
+        return symbols, self.target.nbrRequests - nbrRequests
+
+    def _check(self, symbols):
+        self.assertEqual(sorted(symbols.keys()), sorted('signal_{}'.format(n) for n in range(self.NBR_SYMBOLS)))
+        for n in range(self.NBR_SYMBOLS):
+            symbol = symbols['signal_{}'.format(n)]
+            self.assertEqual((symbol.desc, symbol.address), ('Description {}'.format(n), self.symbols[n][2]))
+
+    def test_unchanged(self):
+        symbols, nbrRequests = self._request()
+        self._check(symbols)
+        self.assertEqual(nbrRequests, 1 + 2*self.NBR_SYMBOLS)
+
+        symbols, nbrRequests = self._request()
+        self._check(symbols)
+        self.assertEqual(nbrRequests, 1)
+
+    def test_changed(self):
+        # Only the symbols whose meta data changed are requested again
+        self._request()
+
+        for n in (3, 7):
+            typecode, nameAddress, address, descAddress = self.symbols[n]
+            self.symbols[n] = (typecode, nameAddress, address + 0x100, descAddress)
+
+        symbols, nbrRequests = self._request()
+        self._check(symbols)
+        self.assertEqual(nbrRequests, 1 + 2*2)
+
+    def test_new_symbols(self):
+        # A symbol added to the firmware is requested, the others come from the cache
+        self._request()
+
+        typecode, nameAddress, address, descAddress = self.symbols[0]
+        self.symbols.append((typecode, nameAddress, 0xf00, descAddress))
+
+        symbols, nbrRequests = self._request()
+        self.assertEqual(nbrRequests, 1 + 2)
+        self.assertEqual(symbols['signal_0'].address, 0xf00)
+
+    def test_corrupt_cache(self):
+        self._request()
+        with open(self.calmeas.symbolCacheFile, 'w') as f:
+            f.write('{"hash": ')
+
+        symbols, nbrRequests = self._request()
+        self._check(symbols)
+        self.assertEqual(nbrRequests, 1 + 2*self.NBR_SYMBOLS)
+
+    def test_without_cache(self):
+        self.calmeas.symbolCacheFile = None
+        self._request()
+
+        symbols, nbrRequests = self._request()
+        self._check(symbols)
+        self.assertEqual(nbrRequests, 1 + 2*self.NBR_SYMBOLS)
+        self.assertFalse(os.path.exists(os.path.join(self.dir, 'symbols.json')))
+
+class ManySymbolsTest(SymbolCacheTest):
+    # The meta data of all of them comes in one frame of 13 bytes per symbol, one more is added
+    NBR_SYMBOLS = 255
+
+class ParamSetTest(unittest.TestCase):
+
+    def setUp(self):
+        self.memory = bytearray(256)
+        self.target = SimTarget(self.memory, 0.0)
+        self.calmeas = CalMeas(self.target)
+        self.target.start()
+
+        for n in range(4):
+            symbol = Symbol('param{}'.format(n))
+            symbol.address = 4*n
+            symbol.setDatatype(SymbolDataType(np.float))
+            self.calmeas.workingSymbols[symbol.name] = symbol
+        self.calmeas.importParamSet('set', {SET_DATA_KEY: dict(('param{}'.format(n), 0.5*n) for n in range(4))})
+
+    def test_plan(self):
+        self.calmeas.setSymbolTargetValue('param1', 0.5)
+
+        plan = self.calmeas.planParamSet('set')
+        self.assertEqual(sorted(plan.unchanged), ['param0', 'param1'])
+        self.assertEqual(sorted(plan.toWrite.keys()), ['param2', 'param3'])
+
+        self.assertFalse(self.calmeas.useParamSet('set', plan))
+        self.assertEqual(self.calmeas.planParamSet('set').toWrite, dict())
+
+    def test_plan_from_cache(self):
+        # Nothing is read, values never read are written
+        nbrRequests = self.target.nbrRequests
+        plan = self.calmeas.planParamSet('set', readTarget=False)
+        self.assertEqual(self.target.nbrRequests, nbrRequests)
+        self.assertEqual(sorted(plan.toWrite.keys()), ['param{}'.format(n) for n in range(4)])
+
+        # A reset target is only noticed when read
+        self.assertFalse(self.calmeas.useParamSet('set'))
+        self.memory[:] = bytearray(len(self.memory))
+        self.assertEqual(self.calmeas.planParamSet('set', readTarget=False).toWrite, dict())
+        self.assertEqual(sorted(self.calmeas.planParamSet('set').toWrite.keys()), ['param1', 'param2', 'param3'])
+
+if __name__ == '__main__':
+    unittest.main()
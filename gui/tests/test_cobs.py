@@ -0,0 +1,70 @@
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'calmeas_ui'))
+
+import unittest
+import random
+
+from cobsser import _cobs_encode, _cobs_decode, CobsDecoder
+
+
+def _frames(nbr, size_max, seed=0):
+    rnd = random.Random(seed)
+    frames = list()
+    for n in range(nbr):
+        # Runs without zeros as long as a COBS block and longer, and frames of zeros only
+        zeros = rnd.choice((0.0, 0.01, 0.5, 1.0))
+        frames.append(bytearray(0 if rnd.random() < zeros else rnd.randint(1, 255) for i in range(rnd.randint(1, size_max))))
+    return frames
+
+class CobsTest(unittest.TestCase):
+
+    def test_roundtrip(self):
+        for frame in _frames(500, 600):
+            encoded = _cobs_encode(frame)
+            self.assertEqual(encoded[-1], 0)
+            self.assertNotIn(0, encoded[:-1])
+            self.assertEqual(_cobs_decode(encoded[:-1]), frame)
+
+    def test_block_boundaries(self):
+        for size in (253, 254, 255, 508, 509):
+            frame = bytearray([1]) * size
+            encoded = _cobs_encode(frame)
+            self.assertEqual(len(encoded), size + (size+253)//254 + 1)
+            self.assertEqual(_cobs_decode(encoded[:-1]), frame)
+
+    def test_encode_appends(self):
+        out = bytearray('\x01\x01\x00')
+        self.assertIs(_cobs_encode(bytearray('ab'), out), out)
+        self.assertEqual(out, bytearray('\x01\x01\x00\x03ab\x00'))
+
+    def test_split_any_chunks(self):
+        frames = _frames(200, 300)
+        stream = bytearray().join(_cobs_encode(f) for f in frames)
+        rnd = random.Random(1)
+
+        decoder = CobsDecoder()
+        decoded = list()
+        pos = 0
+        while pos < len(stream):
+            n = rnd.randint(1, 100)
+            decoded.extend(decoder.feed(stream[pos:pos+n]))
+            pos += n
+
+        self.assertEqual(decoded, frames)
+
+    def test_resync(self):
+        # A packet cut short by noise is dropped, the packets after the next delimiter are decoded
+        frames = _frames(3, 50)
+        stream = _cobs_encode(frames[0]) + _cobs_encode(frames[1])[:-10] + bytearray('\x09\x01\x00') + _cobs_encode(frames[2])
+
+        decoded = CobsDecoder().feed(stream)
+
+        self.assertEqual(decoded, [frames[0], frames[2]])
+
+    def test_decode_errors(self):
+        self.assertRaises(Exception, _cobs_decode, bytearray('\x05\x01'))
+        self.assertRaises(Exception, _cobs_decode, bytearray('\x03\x00\x01'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,112 @@
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'calmeas_ui'))
+
+import unittest
+import random
+import ctypes
+import numpy as np
+
+from simtarget import SimTarget
+import comcommands
+from comcommands import ComCommands, planReadRanges
+
+
+class PlanReadRangesTest(unittest.TestCase):
+
+    def test_merge(self):
+        # Given out of order, overlapping, within and beyond the gap
+        blocks = [(40, 4), (0, 4), (2, 4), (8, 2), (100, 1)]
+
+        ranges, placement = planReadRanges(blocks, sizeMax=64, gapMax=4)
+
+        self.assertEqual(ranges, [(0, 10), (40, 4), (100, 1)])
+        self.assertEqual(placement, [(1, 0), (0, 0), (0, 2), (0, 8), (2, 0)])
+
+    def test_size_max(self):
+        blocks = [(4*n, 4) for n in range(10)]
+
+        ranges, placement = planReadRanges(blocks, sizeMax=16, gapMax=0)
+
+        self.assertEqual(ranges, [(0, 16), (16, 16), (32, 8)])
+        self.assertEqual(placement, [(n//4, 4*(n % 4)) for n in range(10)])
+
+    def test_gap(self):
+        self.assertEqual(planReadRanges([(0, 1), (2, 1)], gapMax=0)[0], [(0, 1), (2, 1)])
+        self.assertEqual(planReadRanges([(0, 1), (1, 1)], gapMax=0)[0], [(0, 2)])
+        self.assertEqual(planReadRanges([], gapMax=0), ([], []))
+
+class MemoryTest(unittest.TestCase):
+
+    def setUp(self):
+        rnd = random.Random(0)
+        self.image = bytearray(rnd.getrandbits(8) for i in range(5000))
+        self.memory = bytearray(8192)
+        self.target = SimTarget(self.memory, 0.0)
+        self.comcmds = ComCommands(self.target)
+        self.target.start()
+
+    def test_write_read(self):
+        self.comcmds.writeMemory(100, self.image)
+        self.assertEqual(self.memory[100:100+len(self.image)], self.image)
+
+        self.assertEqual(self.comcmds.readMemory(100, len(self.image)), self.image)
+
+        out = np.zeros(len(self.image)//4 + 1, dtype=np.uint32)
+        self.comcmds.readMemory(100, len(self.image), out)
+        self.assertEqual(out.tobytes()[:len(self.image)], self.image)
+
+    def test_write_unverified(self):
+        self.comcmds.writeMemory(0, self.image, verify=False)
+        self.comcmds.readMemory(0, 1)
+        self.assertEqual(self.memory[:len(self.image)], self.image)
+
+    def test_read_into(self):
+        self.assertRaises(Exception, self.comcmds.readMemory, 0, 16, np.zeros(16, dtype=np.uint8)[::2])
+        self.assertRaises(Exception, self.comcmds.readMemory, 0, 16, bytearray(8))
+
+    def test_reads(self):
+        self.memory[:8] = bytearray('\x01\x02\x03\x04\x05\x06\x07\x08')
+        requests = self.comcmds.submitReads([(0, [ctypes.c_uint8, ctypes.c_uint8]), (4, 2), (4, [ctypes.c_uint32])])
+
+        self.assertEqual([request.result() for request in requests], [[1, 2], '\x05\x06', [0x08070605]])
+
+    def test_write_read_back(self):
+        request = self.comcmds.submitWrite(16, ctypes.c_uint16(0x1234))
+        self.assertEqual(request.result(), '\x34\x12')
+
+class SerialLineTest(unittest.TestCase):
+    # The frames are timed as on the 2 Mbaud line of the stm32f4 example, and
+    # received into its 256 byte rx ring, which is emptied once per ms
+
+    def setUp(self):
+        rnd = random.Random(0)
+        self.image = bytearray(rnd.getrandbits(8) for i in range(5000))
+        self.memory = bytearray(8192)
+        self.target = SimTarget(self.memory, 0.002, 2000000)
+        self.comcmds = ComCommands(self.target)
+        self.target.start()
+
+    def test_bulk_write(self):
+        self.comcmds.writeMemory(100, self.image)
+        self.comcmds.writeMemory(200, self.image[::-1], verify=False)
+        self.assertEqual(self.comcmds.readMemory(100, 100 + len(self.image)),
+                         self.image[:100] + self.image[::-1])
+        self.assertEqual(self.target.overruns, 0)
+
+    def test_reads(self):
+        self.comcmds.submitReads([(4*n, 4) for n in range(100)])[-1].result()
+        self.assertEqual(self.target.overruns, 0)
+
+    def test_overrun_without_budget(self):
+        # Not held back by the rx ring, the requests overrun it and the writes are lost
+        budget = comcommands.REQUEST_BYTES_IN_FLIGHT_MAX
+        comcommands.REQUEST_BYTES_IN_FLIGHT_MAX = 4096
+        try:
+            self.assertRaises(Exception, self.comcmds.writeMemory, 100, self.image, timeout=0.1)
+        finally:
+            comcommands.REQUEST_BYTES_IN_FLIGHT_MAX = budget
+        self.assertGreater(self.target.overruns, 0)
+
+if __name__ == '__main__':
+    unittest.main()
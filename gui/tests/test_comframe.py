@@ -0,0 +1,98 @@
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'calmeas_ui'))
+
+import unittest
+import random
+import ctypes
+
+from comframe import ComFrame, FrameView, EncodeFrame
+from comframe import crc8_block, crc8_check_blocks, CRC8_TABLE, CRC8_INIT
+from comframe import FRAME_START, CRC8_BATCH_MIN
+
+
+def _crc8(data, crc=CRC8_INIT):
+    # The definition, a byte at a time
+    for d in bytearray(data):
+        crc = CRC8_TABLE[crc ^ d]
+    return crc
+
+def _blocks(nbr, seed=0):
+    rnd = random.Random(seed)
+    return [bytearray(rnd.getrandbits(8) for i in range(rnd.randint(0, 300))) for n in range(nbr)]
+
+class CrcTest(unittest.TestCase):
+
+    def test_block(self):
+        for block in _blocks(300):
+            self.assertEqual(crc8_block(block), _crc8(block))
+
+    def test_block_input_types(self):
+        block = _blocks(1, seed=1)[0]
+        crc = _crc8(block)
+        self.assertEqual(crc8_block(str(block)), crc)
+        self.assertEqual(crc8_block(memoryview(block)), crc)
+        self.assertEqual(crc8_block(list(block)), crc)
+        self.assertEqual(crc8_block(block[7:], _crc8(block[:7])), crc)
+
+    def test_check_blocks(self):
+        # Enough blocks of similar length to be checked in batches, and a few one by one
+        blocks = _blocks(10*CRC8_BATCH_MIN) + [bytearray(), bytearray('\x01')]
+        buf = bytearray()
+        starts, ends = list(), list()
+        for n, block in enumerate(blocks):
+            starts.append(len(buf))
+            buf.extend(block)
+            buf.append(_crc8(block) ^ (n % 3 == 0))
+            ends.append(len(buf))
+
+        valid = crc8_check_blocks(buf, starts, ends)
+
+        self.assertEqual(list(valid), [n % 3 != 0 for n in range(len(blocks))])
+
+    def test_check_blocks_without_crc(self):
+        self.assertEqual(list(crc8_check_blocks(bytearray(4), [0, 2], [0, 4])), [False, True])
+
+class FrameTest(unittest.TestCase):
+
+    def _data(self):
+        return [ctypes.c_uint32(0x20001234), ctypes.c_uint16(4), ctypes.c_float(1.5),
+                ctypes.c_int8(-2), (ctypes.c_uint8 * 3)(1, 0, 2)]
+
+    def test_encode(self):
+        f = ComFrame()
+        f.interface = 2
+        f.mid = 5
+        f.setData(self._data())
+
+        out = bytearray('xy')
+        end = EncodeFrame(out, 2 | 5 << 4, self._data(), offset=2)
+
+        self.assertEqual(end, len(out))
+        self.assertEqual(out[2:], f.GetFrameBytesRaw(with_start=True))
+        self.assertEqual(out[2], FRAME_START)
+        self.assertEqual(out[-1], _crc8(out[5:-1]))
+
+    def test_view(self):
+        out = bytearray()
+        EncodeFrame(out, 2 | 5 << 4, self._data(), crc_len=0)
+
+        f = FrameView(out, crc_len=0)
+
+        self.assertTrue(f.Validity())
+        self.assertEqual((f.interface, f.mid, f.data_size), (2, 5, 14))
+        self.assertEqual([d.value for d in f.getData([ctypes.c_uint32, ctypes.c_uint16])], [0x20001234, 4])
+        self.assertEqual(f.getData([ctypes.c_float])[0].value, 1.5)
+        self.assertEqual(f.GetDataBuffer()[-4:], '\xfe\x01\x00\x02')
+
+    def test_view_crc(self):
+        out = bytearray()
+        EncodeFrame(out, 1, self._data(), crc_len=1)
+        self.assertTrue(FrameView(out, crc_len=1).Validity())
+
+        out[6] ^= 1
+        self.assertFalse(FrameView(out, crc_len=1).Validity())
+        self.assertFalse(FrameView(out[:-1], crc_len=1).Validity())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,130 @@
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'calmeas_ui'))
+
+import unittest
+import random
+import struct
+import Queue
+
+from comhandler import ComHandler
+from comframe import FRAME_START, FRAME_RX_DATA_SIZE_MAX, crc8_block
+
+
+def _frames(nbr, crc_len, size_max=64, seed=0):
+    # Raw rx frames, start byte included, as sent by the target
+    rnd = random.Random(seed)
+    frames = list()
+    for n in range(nbr):
+        data = bytearray(rnd.getrandbits(8) for i in range(rnd.randint(0, size_max)))
+        frame = bytearray(struct.pack('<BHB', FRAME_START, len(data), rnd.getrandbits(8))) + data
+        if crc_len:
+            frame.append(crc8_block(frame[3:]))
+        frames.append(frame)
+    return frames
+
+def _parse(parser, stream, seed=0):
+    # The serial port delivers the stream in arbitrary chunks
+    rnd = random.Random(seed)
+    parsed = list()
+    pos = 0
+    while pos < len(stream):
+        n = rnd.randint(1, 300)
+        parsed.extend(bytearray(f) for f in parser.ParseBytes(stream[pos:pos+n]))
+        pos += n
+    return parsed
+
+class ParseTest(unittest.TestCase):
+
+    def _parser(self, crc_len, framed=False):
+        parser = ComHandler(framed)
+        parser.crc_len = crc_len
+        return parser
+
+    def test_stream(self):
+        for crc_len in (0, 1):
+            frames = _frames(2000, crc_len)
+            self.assertEqual(_parse(self._parser(crc_len), bytearray().join(frames)), frames)
+
+    def test_framed(self):
+        for crc_len in (0, 1):
+            frames = _frames(200, crc_len)
+            parser = self._parser(crc_len, framed=True)
+            parsed = list()
+            for i in range(0, len(frames), 7):
+                parsed.extend(bytearray(f) for f in parser.ParseBytes(bytearray().join(frames[i:i+7])))
+            self.assertEqual(parsed, frames)
+
+    def test_framed_drops_bad_frames(self):
+        frames = _frames(20, 1)
+        frames[3][-1] ^= 1
+        parser = self._parser(1, framed=True)
+
+        parsed = [bytearray(f) for f in parser.ParseBytes(bytearray().join(frames) + bytearray('s\x05'))]
+
+        self.assertEqual(parsed, frames[:3] + frames[4:])
+        self.assertEqual(parser.droppedBytes, len(frames[3]) + 2)
+
+    def test_resync(self):
+        # Bursts of noise, some cutting a frame short. Each frame not hit is received, and
+        # with crc nothing else is. Without crc a frame is only trusted when followed by
+        # the start of the next one, so the frames followed by noise are lost as well
+        rnd = random.Random(1)
+        for crc_len in (0, 1):
+            frames = _frames(2000, crc_len)
+            hit = set(rnd.sample(range(len(frames)), 50))
+            stream = bytearray()
+            for i, frame in enumerate(frames):
+                if i in hit:
+                    burst = bytearray(rnd.getrandbits(8) for n in range(rnd.randint(1, 256)))
+                    frame = frame[:rnd.randint(1, len(frame))] + burst if i % 2 else burst + frame
+                stream.extend(frame)
+
+            parser = self._parser(crc_len)
+            parsed = set(str(f) for f in _parse(parser, stream))
+            sent = [str(f) for i, f in enumerate(frames) if i not in hit and (crc_len or i+1 not in hit)]
+
+            self.assertTrue(parsed.issuperset(sent))
+            if crc_len:
+                self.assertTrue(parsed.issubset(str(f) for f in frames))
+            self.assertGreater(parser.resyncEvents, 0)
+
+    def test_large(self):
+        # E.g. the meta data of 256 symbols, in one frame
+        frames = _frames(3, 0)
+        large = bytearray(struct.pack('<BHB', FRAME_START, 13*256, 0)) + bytearray(range(256))*13
+        stream = frames[0] + large + frames[1] + frames[2]
+
+        self.assertEqual(_parse(self._parser(0), stream), [frames[0], large, frames[1], frames[2]])
+
+    def test_too_large(self):
+        # A size beyond FRAME_RX_DATA_SIZE_MAX can only be noise
+        frames = _frames(3, 0)
+        large = bytearray(struct.pack('<BHB', FRAME_START, FRAME_RX_DATA_SIZE_MAX+1, 0)) + bytearray(FRAME_RX_DATA_SIZE_MAX+1)
+
+        parsed = _parse(self._parser(0), frames[0] + large + frames[1] + frames[2])
+
+        self.assertEqual(parsed[0], frames[0])
+        self.assertEqual(parsed[-2:], frames[1:])
+
+class CallbackTest(unittest.TestCase):
+
+    def test_callbacks(self):
+        handler = ComHandler()
+        handler.crc_len = 0
+        rx = Queue.Queue()
+        handler.setByteQueue_Rx(rx)
+
+        single, batches = list(), list()
+        handler.addInterfaceCallback(1, single.append)
+        handler.addInterfaceCallback(2, batches.append, batch=True)
+
+        for status in (0x11, 0x02, 0x32, 0x03):
+            rx.put(bytearray(struct.pack('<BHBB', FRAME_START, 1, status, status)))
+        handler.handler_Rx(block=False)
+
+        self.assertEqual([(f.interface, f.mid) for f in single], [(1, 1)])
+        self.assertEqual([[(f.interface, f.mid) for f in batch] for batch in batches], [[(2, 0), (2, 3)]])
+
+if __name__ == '__main__':
+    unittest.main()
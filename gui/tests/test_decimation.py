@@ -0,0 +1,82 @@
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'calmeas_ui'))
+
+import unittest
+import numpy as np
+
+from decimation import DecimationPyramid, DECIMATION_FACTOR, DECIMATION_BATCH
+
+
+class EnvelopeTest(unittest.TestCase):
+
+    def _pyramid(self, values, blockSize, length=100000, size=2000):
+        pyramid = DecimationPyramid(length, size)
+        for i in range(0, len(values), blockSize):
+            pyramid.extend(values[i:i+blockSize])
+        return pyramid
+
+    def test_envelope(self):
+        # Each bucket holds the min and max of the samples it covers, and is placed at their middle
+        values = np.random.RandomState(0).randn(3*DECIMATION_BATCH + 123)
+        for blockSize in (1, 7, 100, DECIMATION_BATCH, 3000):
+            pyramid = self._pyramid(values, blockSize)
+            self.assertEqual(pyramid.count, len(values))
+
+            for level in pyramid.levels[:2]:
+                offsets, mins, maxs = pyramid.envelope(level, 500)
+                self.assertGreaterEqual(offsets[0], 500 - level.factor)
+
+                for offset, lo, hi in zip(offsets, mins, maxs):
+                    # The latest bucket may cover fewer samples
+                    width = min(level.factor, int(2*offset + 1))
+                    last = len(values) - int(offset - (width-1)/2.0) - 1
+                    bucket = values[last-width+1:last+1]
+                    self.assertEqual((lo, hi), (bucket.min(), bucket.max()))
+
+                # Up to the latest sample
+                self.assertEqual(offsets[-1], (len(values) % level.factor or level.factor)/2.0 - 0.5)
+
+    def test_same_for_any_block_size(self):
+        values = np.sin(np.arange(20000)/100.0)
+        pyramids = [self._pyramid(values, blockSize) for blockSize in (1, 13, 1000)]
+        for levels in zip(*[p.levels for p in pyramids]):
+            envelopes = [p.envelope(level, 15000) for p, level in zip(pyramids, levels)]
+            for envelope in envelopes[1:]:
+                for a, b in zip(envelopes[0], envelope):
+                    self.assertTrue(np.array_equal(a, b))
+
+    def test_levels(self):
+        pyramid = DecimationPyramid(10**7, 2000)
+        factors = [level.factor for level in pyramid.levels]
+
+        self.assertEqual(factors, [DECIMATION_FACTOR**(n+1) for n in range(len(factors))])
+        self.assertGreaterEqual(len(pyramid.levels[-1])*factors[-1], 10**7)
+
+    def test_level_for(self):
+        pyramid = DecimationPyramid(10**6, 2000)
+
+        level = pyramid.levelFor(10000, 2000)
+        self.assertEqual(level.factor, DECIMATION_FACTOR)
+
+        level = pyramid.levelFor(10**6, 2000)
+        self.assertLessEqual(10**6, len(level)*level.factor)
+
+    def test_points(self):
+        # At every zoom level the envelope covers the span in at most nbrPoints buckets
+        values = np.random.RandomState(0).randn(10**6 + 123)
+        pyramid = self._pyramid(values, 1000, length=10**6, size=10000)
+
+        for nbrPoints in (300, 2000, 4000):
+            for nbrSamples in np.logspace(4, 6, 20).astype(int):
+                level = pyramid.levelFor(nbrSamples, nbrPoints)
+                offsets, mins, maxs = pyramid.envelope(level, nbrSamples, nbrPoints)
+
+                self.assertLessEqual(len(offsets), nbrPoints)
+                self.assertGreaterEqual(len(offsets), min(nbrPoints, nbrSamples/level.factor) // 2)
+                self.assertGreaterEqual(offsets[0], nbrSamples - level.factor)
+                self.assertLessEqual(mins.min(), values[-nbrSamples:].min())
+                self.assertGreaterEqual(maxs.max(), values[-nbrSamples:].max())
+
+if __name__ == '__main__':
+    unittest.main()
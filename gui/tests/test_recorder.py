@@ -0,0 +1,145 @@
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'calmeas_ui'))
+
+import unittest
+import tempfile
+import shutil
+import csv
+import numpy as np
+
+import recorder
+from recorder import Recorder, readRecording, recordingToCsv, RECORDING_TIME_FIELD
+
+
+class _BrokenFile():
+
+    def write(self, data):
+        raise IOError('Disk full')
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+class RecorderTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, 'test.rec')
+
+        # Small chunks, so that the tests span several of them, and enough of them
+        # that no samples are dropped however far behind the writer is
+        self._chunks = (recorder.RECORDER_CHUNK_BYTES, recorder.RECORDER_CHUNKS_PER_RASTER)
+        recorder.RECORDER_CHUNK_BYTES = 1024
+        recorder.RECORDER_CHUNKS_PER_RASTER = 64
+
+    def tearDown(self):
+        recorder.RECORDER_CHUNK_BYTES, recorder.RECORDER_CHUNKS_PER_RASTER = self._chunks
+        shutil.rmtree(self.dir)
+
+    def _blocks(self, nbr, size, offset=0):
+        blocks = list()
+        for i in range(nbr):
+            n = np.arange(offset + i*size, offset + (i+1)*size)
+            blocks.append((0.001*n, [n.astype(np.uint8), n.astype(np.int16), n.astype(np.float32)]))
+        return blocks
+
+    def _columns(self, chunks, name):
+        return np.concatenate([chunk[name] for chunk in chunks])
+
+    def test_roundtrip(self):
+        names = ['a', 'b', 'c']
+        rec = Recorder(self.path)
+        rec.start()
+        for times, columns in self._blocks(100, 7):
+            rec.append(0, times, names, columns)
+            rec.append(3, times[:2], names[:1], columns[:1])
+        rec.close()
+
+        rasters = readRecording(self.path)
+        n = np.arange(700)
+
+        self.assertEqual(sorted(rasters.keys()), [0, 3])
+        self.assertGreater(len(rasters[0]), 1)
+        self.assertEqual(rasters[0][0].dtype.names, (RECORDING_TIME_FIELD, 'a', 'b', 'c'))
+        self.assertTrue(np.array_equal(self._columns(rasters[0], RECORDING_TIME_FIELD), 0.001*n))
+        self.assertTrue(np.array_equal(self._columns(rasters[0], 'a'), n.astype(np.uint8)))
+        self.assertTrue(np.array_equal(self._columns(rasters[0], 'b'), n.astype(np.int16)))
+        self.assertTrue(np.array_equal(self._columns(rasters[0], 'c'), n.astype(np.float32)))
+        self.assertEqual(self._columns(rasters[3], 'a').dtype, np.uint8)
+        self.assertEqual(len(self._columns(rasters[3], 'a')), 200)
+        self.assertEqual((rec.nbrSamples, rec.droppedSamples), (900, 0))
+
+    def test_unclosed(self):
+        # A recording that was not closed, e.g. after a crash, is read as far as it is complete
+        rec = Recorder(self.path)
+        rec.start()
+        for times, columns in self._blocks(100, 7):
+            rec.append(0, times, ['a', 'b', 'c'], columns)
+        rec.close()
+
+        with open(self.path, 'rb+') as f:
+            f.truncate(os.path.getsize(self.path) - 10)
+
+        chunks = readRecording(self.path)[0]
+        self.assertTrue(np.array_equal(self._columns(chunks, 'a'), np.arange(len(self._columns(chunks, 'a'))).astype(np.uint8)))
+
+    def test_not_a_recording(self):
+        with open(self.path, 'wb') as f:
+            f.write('time,value\n')
+        self.assertRaises(Exception, readRecording, self.path)
+
+    def test_drops_when_writer_behind(self):
+        rec = Recorder(self.path)
+        blocks = self._blocks(1000, 10)
+        for times, columns in blocks:
+            rec.append(0, times, ['a', 'b', 'c'], columns)
+
+        # The writer has not started, so nothing more than the chunks is kept
+        rows = recorder.RECORDER_CHUNK_BYTES // (8+1+2+4)
+        self.assertEqual(rec.nbrSamples, recorder.RECORDER_CHUNKS_PER_RASTER*rows)
+        self.assertEqual(rec.droppedSamples, 10000 - rec.nbrSamples)
+
+        rec.start()
+        rec.close()
+
+        chunks = readRecording(self.path)[0]
+        self.assertEqual(len(self._columns(chunks, 'a')), rec.nbrSamples)
+
+    def test_write_failure(self):
+        rec = Recorder(self.path)
+        rec._file.close()
+        rec._file = _BrokenFile()
+        rec.start()
+
+        for times, columns in self._blocks(1000, 10):
+            rec.append(0, times, ['a', 'b', 'c'], columns)
+        rec.close()
+
+        self.assertTrue(rec.failed)
+        self.assertGreater(rec.droppedSamples, 0)
+
+    def test_csv(self):
+        rec = Recorder(self.path)
+        rec.start()
+        for times, columns in self._blocks(10, 5):
+            rec.append(0, times, ['a', 'b', 'c'], columns)
+            rec.append(1, times[:2], ['d'], columns[2:])
+        rec.close()
+
+        csvPath = os.path.join(self.dir, 'test.csv')
+        recordingToCsv(self.path, csvPath)
+
+        with open(csvPath) as f:
+            rows = list(csv.reader(f))
+
+        self.assertEqual(rows[0], ['a_time', 'a', 'b_time', 'b', 'c_time', 'c', 'd_time', 'd'])
+        self.assertEqual(len(rows), 51)
+        self.assertEqual([float(x) for x in rows[3]], [0.002, 2, 0.002, 2, 0.002, 2, 0.005, 5])
+        self.assertEqual([float(x) for x in rows[50][:6]], [0.049, 49]*3)
+        self.assertEqual(rows[50][6:], ['', ''])
+
+if __name__ == '__main__':
+    unittest.main()
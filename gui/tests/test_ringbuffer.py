@@ -0,0 +1,61 @@
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'calmeas_ui'))
+
+import unittest
+import numpy as np
+
+from ringbuffer import RingBuffer
+
+
+class RingBufferTest(unittest.TestCase):
+
+    def test_initially_zeros(self):
+        buf = RingBuffer(5)
+        self.assertEqual(list(buf.view()), [0]*5)
+        self.assertEqual(len(buf), 5)
+
+    def test_append_and_extend(self):
+        # The same samples, one at a time and in blocks of any size
+        values = np.arange(1, 40, dtype=np.float64)
+        for size in (1, 2, 3, 7, 10, 11, 39):
+            single = RingBuffer(10)
+            blocks = RingBuffer(10)
+            for v in values:
+                single.append(v)
+            for i in range(0, len(values), size):
+                blocks.extend(values[i:i+size])
+
+            self.assertEqual(list(blocks.view()), list(values[-10:]))
+            self.assertEqual(list(single.view()), list(values[-10:]))
+            self.assertEqual(blocks.last(), values[-1])
+
+    def test_latest(self):
+        buf = RingBuffer(6, dtype=np.int32)
+        buf.extend(range(10))
+
+        self.assertEqual(list(buf.latest(3)), [7, 8, 9])
+        self.assertEqual(list(buf.latest(6)), [4, 5, 6, 7, 8, 9])
+        self.assertEqual(list(buf.latest(100)), [4, 5, 6, 7, 8, 9])
+        self.assertEqual(buf.dtype, np.int32)
+
+    def test_segments(self):
+        buf = RingBuffer(4)
+        buf.extend([1, 2, 3, 4])
+        segments = buf.segments()
+        self.assertEqual(len(segments), 1)
+
+        # Not copied
+        segments[0][0] = 10
+        self.assertEqual(buf.view()[0], 10)
+
+        buf.append(5)
+        self.assertEqual([list(s) for s in buf.segments()], [[2, 3, 4], [5]])
+
+    def test_empty(self):
+        buf = RingBuffer(0)
+        buf.extend([1, 2])
+        self.assertEqual(len(buf.view()), 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -27,6 +27,7 @@
 #define COM_PACKET_START          's'
 
 #define COM_BUFFER_RX_SIZE        (256)
+#define COM_DATA_SIZE_MAX_TX      (4096) // The host drops larger frames, see FRAME_RX_DATA_SIZE_MAX
 
 #define COM_CRC_LEN_RX            (1)
 #define COM_CRC_LEN_TX            (0)
@@ -165,7 +165,7 @@ int com_put_message(com_message_t *msg)
   uint8_t *data = msg->address;
   queue_t *buffer = &com_data[msg->port].buffer_tx;
 
-  if (msg->len + COM_PACKET_OVERHEAD_SIZE > queue_Available(buffer)) {
+  if (msg->len > COM_DATA_SIZE_MAX_TX || msg->len + COM_PACKET_OVERHEAD_SIZE > queue_Available(buffer)) {
     return -1;
   }
 